@@ -26,11 +26,17 @@
 # Imports
 #
 
+from alphapy.cache import get_stage_keys
+from alphapy.cache import get_stage_state
+from alphapy.cache import set_stage_state
+from alphapy.cache import StageCache
 from alphapy.data import get_data
 from alphapy.data import sample_data
 from alphapy.data import shuffle_data
 from alphapy.estimators import get_estimators
 from alphapy.estimators import scorers
+from alphapy.estimators import serial_estimators
+from alphapy.estimators import set_estimator_jobs
 from alphapy.features import apply_treatments
 from alphapy.features import create_crosstabs
 from alphapy.features import create_features
@@ -39,6 +45,7 @@ from alphapy.features import drop_features
 from alphapy.features import remove_lv_features
 from alphapy.features import save_features
 from alphapy.features import select_features
+from alphapy.features import transform_features
 from alphapy.frame import write_frame
 from alphapy.globals import CSEP, PSEP, SSEP, USEP
 from alphapy.globals import ModelType
@@ -57,15 +64,24 @@ from alphapy.model import save_model
 from alphapy.model import save_predictions
 from alphapy.optimize import hyper_grid_search
 from alphapy.optimize import rfecv_search
-from alphapy.plots import generate_plots
+from alphapy.profiler import profile_stage
+from alphapy.profiler import Profiler
+from alphapy.scorer import Scorer
+from alphapy.server import serve
 from alphapy.utilities import get_datestamp
+from alphapy.utilities import get_worker_count
+from alphapy.utilities import np_memmap_data
 
 import argparse
+from copy import copy
 from datetime import datetime
 import logging
 import numpy as np
 import os
 import pandas as pd
+from scipy import sparse
+from sklearn.externals.joblib import delayed
+from sklearn.externals.joblib import Parallel
 import sys
 import warnings
 warnings.simplefilter(action='ignore', category=DeprecationWarning)
@@ -79,6 +95,115 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 logger = logging.getLogger(__name__)
 
 
+#
+# Define the model attributes that store the results of each algorithm
+#
+
+algorithm_results = ['estimators', 'importances', 'coefs', 'support',
+                     'preds', 'probas']
+
+
+#
+# Function train_algorithm
+#
+
+def train_algorithm(model, algo, estimator):
+    r"""Fit, optimize, and predict with one algorithm.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        The model object with the training data.
+    algo : str
+        Abbreviation of the algorithm to run.
+    estimator : alphapy.Estimator
+        The estimator of the algorithm.
+
+    Returns
+    -------
+    model : alphapy.Model
+        The model object with the results of the algorithm.
+
+    """
+
+    logger.info("Algorithm: %s", algo)
+
+    # Unpack the model specifications
+
+    calibration = model.specs['calibration']
+    grid_search = model.specs['grid_search']
+    rfe = model.specs['rfe']
+
+    # initial fit
+
+    est = estimator.estimator
+    with profile_stage(model, 'first_fit', algo):
+        model = first_fit(model, algo, est)
+
+    # recursive feature elimination
+
+    if rfe:
+        has_coef = hasattr(est, "coef_")
+        has_fimp = hasattr(est, "feature_importances_")
+        if has_coef or has_fimp:
+            with profile_stage(model, 'rfecv_search', algo):
+                model = rfecv_search(model, algo)
+        else:
+            logger.info("No RFE Available for %s", algo)
+
+    # grid search
+
+    if grid_search:
+        with profile_stage(model, 'hyper_grid_search', algo):
+            model = hyper_grid_search(model, estimator)
+
+    # predictions
+
+    with profile_stage(model, 'make_predictions', algo):
+        model = make_predictions(model, algo, calibration)
+
+    return model
+
+
+#
+# Function train_algorithm_block
+#
+
+def train_algorithm_block(model, algo, estimator, n_jobs):
+    r"""Train one algorithm in a worker, returning only its results.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        The model object with the training data.
+    algo : str
+        Abbreviation of the algorithm to run.
+    estimator : alphapy.Estimator
+        The estimator of the algorithm.
+    n_jobs : int
+        The number of jobs for the estimator, cross-validation,
+        and grid search within the worker.
+
+    Returns
+    -------
+    results : dict
+        The entries of the algorithm for each attribute in
+        ``algorithm_results``, to be merged into the parent model.
+    stages : list
+        The profile of the stages run by the worker.
+
+    """
+    wmodel = copy(model)
+    wmodel.specs = dict(model.specs)
+    wmodel.specs['n_jobs'] = n_jobs
+    for attr in algorithm_results:
+        setattr(wmodel, attr, {})
+    set_estimator_jobs(estimator.estimator, n_jobs)
+    wmodel = train_algorithm(wmodel, algo, estimator)
+    results = {attr: getattr(wmodel, attr) for attr in algorithm_results}
+    return results, wmodel.profiler.stages
+
+
 #
 # Function training_pipeline
 #
@@ -108,98 +233,158 @@ def training_pipeline(model):
 
     # Unpack the model specifications
 
-    calibration = model.specs['calibration']
+    algorithm_jobs = model.specs['algorithm_jobs']
+    cache = model.specs['cache']
+    cache_size = model.specs['cache_size']
     directory = model.specs['directory']
     drop = model.specs['drop']
     extension = model.specs['extension']
     feature_selection = model.specs['feature_selection']
-    grid_search = model.specs['grid_search']
+    memory_map = model.specs['memory_map']
     model_type = model.specs['model_type']
+    n_jobs = model.specs['n_jobs']
     predict_mode = model.specs['predict_mode']
-    rfe = model.specs['rfe']
     sampling = model.specs['sampling']
     scorer = model.specs['scorer']
     separator = model.specs['separator']
     target = model.specs['target']
 
-    # Get train and test data
-
-    X_train, y_train = get_data(model, Partition.train)
-    X_test, y_test = get_data(model, Partition.test)
-
-    # Determine if there are any test labels
-
-    if y_test.any():
-        logger.info("Test Labels Found")
-        model.test_labels = True
-    model = save_features(model, X_train, X_test, y_train, y_test)
+    # Restore the last cached stage [if specified]
+
+    stage_cache = None
+    stage_keys = []
+    cached = []
+    if cache:
+        input_dir = SSEP.join([directory, 'input'])
+        input_files = [SSEP.join([input_dir, PSEP.join([datasets[p], extension])])
+                       for p in [Partition.train, Partition.test]]
+        stage_keys = get_stage_keys(model.specs, input_files)
+        stage_cache = StageCache(SSEP.join([directory, 'cache']), cache_size)
+        cached_stage, state = stage_cache.restore(stage_keys)
+        if cached_stage:
+            stages = [stage for stage, _ in stage_keys]
+            cached = stages[:stages.index(cached_stage) + 1]
+            all_features, split_point = set_stage_state(model, state)
+            del state
+    stage_keys = dict(stage_keys)
+
+    if 'treatments' not in cached:
+
+        # Get train and test data
+
+        with profile_stage(model, 'get_data'):
+            X_train, y_train = get_data(model, Partition.train)
+            X_test, y_test = get_data(model, Partition.test)
+
+        # Determine if there are any test labels
+
+        if y_test.any():
+            logger.info("Test Labels Found")
+            model.test_labels = True
+        model = save_features(model, X_train, X_test, y_train, y_test)
+
+        # Record the original features for scoring new data
+
+        model.feature_map['features'] = list(X_train.columns)
+        model.feature_map['dtypes'] = X_train.dtypes.astype(str).to_dict()
+
+        # Log feature statistics
+
+        logger.info("Original Feature Statistics")
+        logger.info("Number of Training Rows    : %d", X_train.shape[0])
+        logger.info("Number of Training Columns : %d", X_train.shape[1])
+        if model_type == ModelType.classification:
+            uv, uc = np.unique(y_train, return_counts=True)
+            logger.info("Unique Training Values for %s : %s", target, uv)
+            logger.info("Unique Training Counts for %s : %s", target, uc)
+        logger.info("Number of Testing Rows     : %d", X_test.shape[0])
+        logger.info("Number of Testing Columns  : %d", X_test.shape[1])
+        if model_type == ModelType.classification and model.test_labels:
+            uv, uc = np.unique(y_test, return_counts=True)
+            logger.info("Unique Testing Values for %s : %s", target, uv)
+            logger.info("Unique Testing Counts for %s : %s", target, uc)
+
+        # Merge training and test data
+
+        if X_train.shape[1] == X_test.shape[1]:
+            split_point = X_train.shape[0]
+            X = pd.concat([X_train, X_test])
+        else:
+            raise IndexError("The number of training and test columns [%d, %d] must match." %
+                             (X_train.shape[1], X_test.shape[1]))
 
-    # Log feature statistics
+        # Apply treatments to the feature matrix
 
-    logger.info("Original Feature Statistics")
-    logger.info("Number of Training Rows    : %d", X_train.shape[0])
-    logger.info("Number of Training Columns : %d", X_train.shape[1])
-    if model_type == ModelType.classification:
-        uv, uc = np.unique(y_train, return_counts=True)
-        logger.info("Unique Training Values for %s : %s", target, uv)
-        logger.info("Unique Training Counts for %s : %s", target, uc)
-    logger.info("Number of Testing Rows     : %d", X_test.shape[0])
-    logger.info("Number of Testing Columns  : %d", X_test.shape[1])
-    if model_type == ModelType.classification and model.test_labels:
-        uv, uc = np.unique(y_test, return_counts=True)
-        logger.info("Unique Testing Values for %s : %s", target, uv)
-        logger.info("Unique Testing Counts for %s : %s", target, uc)
-
-    # Merge training and test data
-
-    if X_train.shape[1] == X_test.shape[1]:
-        split_point = X_train.shape[0]
-        X = pd.concat([X_train, X_test])
-    else:
-        raise IndexError("The number of training and test columns [%d, %d] must match." %
-                         (X_train.shape[1], X_test.shape[1]))
+        with profile_stage(model, 'apply_treatments'):
+            all_features = apply_treatments(model, X)
 
-    # Apply treatments to the feature matrix
-    all_features = apply_treatments(model, X)
+        # Drop features
+        all_features = drop_features(all_features, drop)
 
-    # Drop features
-    all_features = drop_features(all_features, drop)
+        # Save the train and test files with extracted and dropped features
 
-    # Save the train and test files with extracted and dropped features
+        with profile_stage(model, 'save_input'):
+            datestamp = get_datestamp()
+            data_dir = SSEP.join([directory, 'input'])
+            df_train = all_features.iloc[:split_point, :]
+            df_train = pd.concat([df_train, pd.DataFrame(y_train, columns=[target])], axis=1)
+            output_file = USEP.join([model.train_file, datestamp])
+            write_frame(df_train, data_dir, output_file, extension, separator)
+            df_test = all_features.iloc[split_point:, :]
+            if y_test.any():
+                df_test = pd.concat([df_test, pd.DataFrame(y_test, columns=[target])], axis=1)
+            output_file = USEP.join([model.test_file, datestamp])
+            write_frame(df_test, data_dir, output_file, extension, separator)
+            del X, df_train, df_test
 
-    datestamp = get_datestamp()
-    data_dir = SSEP.join([directory, 'input'])
-    df_train = all_features.iloc[:split_point, :]
-    df_train = pd.concat([df_train, pd.DataFrame(y_train, columns=[target])], axis=1)
-    output_file = USEP.join([model.train_file, datestamp])
-    write_frame(df_train, data_dir, output_file, extension, separator)
-    df_test = all_features.iloc[split_point:, :]
-    if y_test.any():
-        df_test = pd.concat([df_test, pd.DataFrame(y_test, columns=[target])], axis=1)
-    output_file = USEP.join([model.test_file, datestamp])
-    write_frame(df_test, data_dir, output_file, extension, separator)
+        # Create crosstabs for any categorical features
 
-    # Create crosstabs for any categorical features
+        if model_type == ModelType.classification:
+            with profile_stage(model, 'create_crosstabs'):
+                create_crosstabs(model)
 
-    if model_type == ModelType.classification:
-        create_crosstabs(model)
+        if stage_cache:
+            stage_cache.save('treatments', stage_keys['treatments'],
+                             get_stage_state(model, all_features, split_point))
 
     # Create initial features
 
-    all_features = create_features(model, all_features)
-    X_train, X_test = np.array_split(all_features, [split_point])
+    model_dir = SSEP.join([directory, 'model'])
+    if 'features' not in cached:
+        with profile_stage(model, 'create_features'):
+            all_features = create_features(model, all_features)
+            if memory_map:
+                all_features = np_memmap_data(all_features, model_dir, 'features')
+        if stage_cache:
+            stage_cache.save('features', stage_keys['features'],
+                             get_stage_state(model, all_features, split_point))
+    X_train, X_test = all_features[:split_point], all_features[split_point:]
     model = save_features(model, X_train, X_test)
 
     # Generate interactions
 
-    all_features = create_interactions(model, all_features)
-    X_train, X_test = np.array_split(all_features, [split_point])
+    if 'interactions' not in cached:
+        with profile_stage(model, 'create_interactions'):
+            all_features = create_interactions(model, all_features)
+            if memory_map:
+                all_features = np_memmap_data(all_features, model_dir, 'interactions')
+        if stage_cache:
+            stage_cache.save('interactions', stage_keys['interactions'],
+                             get_stage_state(model, all_features, split_point))
+    X_train, X_test = all_features[:split_point], all_features[split_point:]
     model = save_features(model, X_train, X_test)
 
     # Remove low-variance features
 
-    all_features = remove_lv_features(model, all_features)
-    X_train, X_test = np.array_split(all_features, [split_point])
+    if 'lv_features' not in cached:
+        with profile_stage(model, 'remove_lv_features'):
+            all_features = remove_lv_features(model, all_features)
+            if memory_map:
+                all_features = np_memmap_data(all_features, model_dir, 'lv_features')
+        if stage_cache:
+            stage_cache.save('lv_features', stage_keys['lv_features'],
+                             get_stage_state(model, all_features, split_point))
+    X_train, X_test = all_features[:split_point], all_features[split_point:]
     model = save_features(model, X_train, X_test)
 
     # Shuffle the data [if specified]
@@ -209,19 +394,22 @@ def training_pipeline(model):
 
     if model_type == ModelType.classification:
         if sampling:
-            model = sample_data(model)
+            with profile_stage(model, 'sample_data'):
+                model = sample_data(model)
         else:
             logger.info("Skipping Sampling")
 
     # Perform feature selection, independent of algorithm
 
     if feature_selection:
-        model = select_features(model)
+        with profile_stage(model, 'select_features'):
+            model = select_features(model)
 
     # Get the available classifiers and regressors 
 
     logger.info("Getting All Estimators")
-    estimators = get_estimators(model)
+    with profile_stage(model, 'get_estimators'):
+        estimators = get_estimators(model)
 
     # Get the available scorers
 
@@ -232,51 +420,70 @@ def training_pipeline(model):
 
     logger.info("Selecting Models")
 
+    algos = []
     for algo in model.algolist:
-        logger.info("Algorithm: %s", algo)
-        # select estimator
-        try:
-            estimator = estimators[algo]
-            est = estimator.estimator
-        except KeyError:
+        if algo in estimators:
+            algos.append(algo)
+        else:
             logger.info("Algorithm %s not found", algo)
-        # initial fit
-        model = first_fit(model, algo, est)
-        # recursive feature elimination
-        if rfe:
-            has_coef = hasattr(est, "coef_")
-            has_fimp = hasattr(est, "feature_importances_")
-            if has_coef or has_fimp:
-                model = rfecv_search(model, algo)
-            else:
-                logger.info("No RFE Available for %s", algo)
-        # grid search
-        if grid_search:
-            model = hyper_grid_search(model, estimator)
-        # predictions
-        model = make_predictions(model, algo, calibration)
+
+    # Train independent algorithms in parallel, dividing the cores
+    # among the workers so that the machine is not oversubscribed.
+
+    parallel_algos = [a for a in algos if a not in serial_estimators]
+    nworkers = get_worker_count(algorithm_jobs, len(parallel_algos))
+    if nworkers > 1:
+        est_jobs = max(1, get_worker_count(n_jobs) // nworkers)
+        logger.info("Training %d Algorithms with %d Workers [%d jobs each]",
+                    len(parallel_algos), nworkers, est_jobs)
+        tmodel = copy(model)
+        tmodel.feature_map = {}
+        tmodel.profiler = Profiler(model.profiler.enabled)
+        results = Parallel(n_jobs=nworkers)(
+            delayed(train_algorithm_block)(tmodel, algo, estimators[algo], est_jobs)
+            for algo in parallel_algos)
+        for algo_results, stages in results:
+            for attr in algorithm_results:
+                getattr(model, attr).update(algo_results[attr])
+            model.profiler.stages.extend(stages)
+        del results
+        algos = [a for a in algos if a not in parallel_algos]
+
+    for algo in algos:
+        model = train_algorithm(model, algo, estimators[algo])
 
     # Create a blended estimator
 
     if len(model.algolist) > 1:
-        model = predict_blend(model)
+        with profile_stage(model, 'predict_blend'):
+            model = predict_blend(model)
 
     # Generate metrics
 
-    model = generate_metrics(model, Partition.train)
-    model = generate_metrics(model, Partition.test)
+    with profile_stage(model, 'generate_metrics'):
+        model = generate_metrics(model, Partition.train)
+        model = generate_metrics(model, Partition.test)
 
     # Store the best estimator
-    model = predict_best(model)
 
-    # Generate plots
+    with profile_stage(model, 'predict_best'):
+        model = predict_best(model)
+
+    # Generate plots, importing the plotting libraries only if needed
 
-    generate_plots(model, Partition.train)
-    if model.test_labels:
-        generate_plots(model, Partition.test)
+    plot_flags = ['calibration_plot', 'confusion_matrix', 'importances',
+                  'learning_curve', 'roc_curve']
+    if any(model.specs[flag] for flag in plot_flags):
+        with profile_stage(model, 'generate_plots'):
+            from alphapy.plots import generate_plots
+            generate_plots(model, Partition.train)
+            if model.test_labels:
+                generate_plots(model, Partition.test)
 
     # Save best features and predictions
-    save_model(model, 'BEST', Partition.test)
+
+    with profile_stage(model, 'save_model'):
+        save_model(model, 'BEST', Partition.test)
 
     # Return the model
     return model
@@ -296,7 +503,8 @@ def prediction_pipeline(model):
 
     Returns
     -------
-    None : None
+    model : alphapy.Model
+        The model object with the predictions.
 
     Notes
     -----
@@ -310,20 +518,18 @@ def prediction_pipeline(model):
     # Unpack the model specifications
 
     directory = model.specs['directory']
-    drop = model.specs['drop']
-    extension = model.specs['extension']
-    feature_selection = model.specs['feature_selection']
     model_type = model.specs['model_type']
-    rfe = model.specs['rfe']
-    separator = model.specs['separator']
 
     # Get all data. We need original train and test for interactions.
 
     partition = Partition.predict
-    X_predict, _ = get_data(model, partition)
+    with profile_stage(model, 'get_data'):
+        X_predict, _ = get_data(model, partition)
 
     # Load feature_map
-    model = load_feature_map(model, directory)
+
+    with profile_stage(model, 'load_feature_map'):
+        model = load_feature_map(model, directory)
 
     # Log feature statistics
 
@@ -331,53 +537,29 @@ def prediction_pipeline(model):
     logger.info("Number of Prediction Rows    : %d", X_predict.shape[0])
     logger.info("Number of Prediction Columns : %d", X_predict.shape[1])
 
-    # Apply treatments to the feature matrix
-    all_features = apply_treatments(model, X_predict)
-
-    # Drop features
-    all_features = drop_features(all_features, drop)
+    # Apply the saved feature transformations
 
-    # Create initial features
-    all_features = create_features(model, all_features)
+    with profile_stage(model, 'transform_features'):
+        all_features = transform_features(model, X_predict)
 
-    # Generate interactions
-    all_features = create_interactions(model, all_features)
-
-    # Remove low-variance features
-    all_features = remove_lv_features(model, all_features)
-
-    # Load the univariate support vector, if any
-
-    if feature_selection:
-        logger.info("Getting Univariate Support")
-        try:
-            support = model.feature_map['uni_support']
-            all_features = all_features[:, support]
-            logger.info("New Feature Count : %d", all_features.shape[1])
-        except:
-            logger.info("No Univariate Support")
+    # Load predictor
 
-    # Load the RFE support vector, if any
+    with profile_stage(model, 'load_predictor'):
+        predictor = load_predictor(directory)
 
-    if rfe:
-        logger.info("Getting RFE Support")
-        try:
-            support = model.feature_map['rfe_support']
-            all_features = all_features[:, support]
-            logger.info("New Feature Count : %d", all_features.shape[1])
-        except:
-            logger.info("No RFE Support")
+    # Keras models require a dense feature matrix
 
-    # Load predictor
-    predictor = load_predictor(directory)
+    if sparse.issparse(all_features) and 'keras' in type(predictor).__module__:
+        all_features = all_features.toarray()
 
     # Make predictions
     
     logger.info("Making Predictions")
     tag = 'BEST'
-    model.preds[(tag, partition)] = predictor.predict(all_features)
-    if model_type == ModelType.classification:
-        model.probas[(tag, partition)]  = predictor.predict_proba(all_features)[:, 1]
+    with profile_stage(model, 'make_predictions', tag):
+        model.preds[(tag, partition)] = predictor.predict(all_features)
+        if model_type == ModelType.classification:
+            model.probas[(tag, partition)]  = predictor.predict_proba(all_features)[:, 1]
 
     # Get date stamp to record file creation
 
@@ -386,7 +568,12 @@ def prediction_pipeline(model):
     timestamp = d.strftime(f)
 
     # Save predictions
-    save_predictions(model, tag, partition)
+
+    with profile_stage(model, 'save_predictions'):
+        save_predictions(model, tag, partition)
+
+    # Return the model
+    return model
 
 
 #
@@ -409,6 +596,8 @@ def main_pipeline(model):
     """
 
     # Extract any model specifications
+
+    directory = model.specs['directory']
     predict_mode = model.specs['predict_mode']
 
     # Prediction Only or Calibration
@@ -418,6 +607,9 @@ def main_pipeline(model):
     else:
         model = training_pipeline(model)
 
+    # Write the stage profile [if specified]
+    model.profiler.report(SSEP.join([directory, 'model']))
+
     # Return the completed model
     return model
 
@@ -460,6 +652,8 @@ def main(args=None):
     # Argument Parsing
 
     parser = argparse.ArgumentParser(description="AlphaPy Parser")
+    parser.add_argument('command', nargs='?', choices=['serve'],
+                        help="serve predictions from the saved model")
     parser.add_mutually_exclusive_group(required=False)
     parser.add_argument('--predict', dest='predict_mode', action='store_true')
     parser.add_argument('--train', dest='predict_mode', action='store_false')
@@ -480,6 +674,14 @@ def main(args=None):
             logger.info("Creating directory %s", output_dir)
             os.makedirs(output_dir)
 
+    # Serve predictions from the saved model
+
+    if args.command == 'serve':
+        logger.info("Starting Server")
+        serve(Scorer(specs), specs['server_host'], specs['server_port'],
+              specs['max_batch'], specs['max_wait'], specs['max_body'])
+        return
+
     # Create a model from the arguments
 
     logger.info("Creating Model")
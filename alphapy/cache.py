@@ -0,0 +1,346 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : cache
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.globals import PSEP, SSEP, USEP
+
+import glob
+import hashlib
+import json
+import logging
+import os
+from sklearn.externals import joblib
+
+
+#
+# Initialize logger
+#
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Define the cached stages and the specifications of each stage
+#
+# The stages are in pipeline order, and the key of each stage
+# includes the key of the stage before it.
+#
+
+stage_specs = [('treatments', ['drop', 'extension', 'factors', 'features',
+                               'model_type', 'separator', 'target',
+                               'target_value', 'treatments']),
+               ('features', ['cluster_inc', 'cluster_max', 'cluster_min',
+                             'clustering', 'counts', 'encoder', 'feature_dtype',
+                             'iso_components', 'iso_neighbors', 'isomap',
+                             'logtransform', 'ngrams_max', 'numpy', 'pca',
+                             'pca_inc', 'pca_max', 'pca_min', 'pca_whiten',
+                             'pvalue_level', 'rounding', 'scaler_option',
+                             'scaler_type', 'scipy', 'seed', 'sentinel',
+                             'sparse', 'tsne', 'tsne_components',
+                             'tsne_learn_rate', 'tsne_perplexity', 'vectorize']),
+               ('interactions', ['interactions', 'isample_pct', 'poly_degree']),
+               ('lv_features', ['lv_remove', 'lv_threshold'])]
+
+
+#
+# Function hash_files
+#
+
+def hash_files(file_paths, chunk_size=1 << 20):
+    r"""Hash the contents of the input files.
+
+    Parameters
+    ----------
+    file_paths : list
+        The paths of the files.
+    chunk_size : int, optional
+        The number of bytes to read at a time.
+
+    Returns
+    -------
+    digest : str
+        The SHA-1 hex digest of the file names and contents.
+
+    """
+    sha = hashlib.sha1()
+    for file_path in file_paths:
+        sha.update(os.path.basename(file_path).encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+#
+# Function get_stage_keys
+#
+
+def get_stage_keys(specs, file_paths):
+    r"""Get the cache key of each stage.
+
+    Parameters
+    ----------
+    specs : dict
+        The model specifications.
+    file_paths : list
+        The paths of the input files.
+
+    Returns
+    -------
+    stage_keys : list
+        The ``(stage, key)`` pairs in pipeline order.
+
+    Notes
+    -----
+    Each key is a hash of the key of the previous stage and the
+    specifications that the stage reads, so changing a setting
+    of one stage only invalidates that stage and the stages after
+    it. Changes to the code of treatment functions are not seen,
+    so clear the ``cache`` directory after editing them.
+
+    """
+    key = hash_files(file_paths)
+    stage_keys = []
+    for stage, spec_keys in stage_specs:
+        values = [key, stage] + [[k, specs.get(k)] for k in spec_keys]
+        content = json.dumps(values, sort_keys=True, default=str)
+        key = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        stage_keys.append((stage, key))
+    return stage_keys
+
+
+#
+# Function get_stage_state
+#
+
+def get_stage_state(model, all_features, split_point):
+    r"""Collect the output of a stage for the cache.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        The model object with the feature map and labels.
+    all_features : numpy array or pandas.DataFrame
+        The features of the training and test data.
+    split_point : int
+        The number of training rows in ``all_features``.
+
+    Returns
+    -------
+    state : dict
+        The stage output, including the fitted transformers in
+        the feature map.
+
+    """
+    state = {'features'    : all_features,
+             'split_point' : split_point,
+             'feature_map' : model.feature_map,
+             'y_train'     : model.y_train,
+             'y_test'      : model.y_test,
+             'test_labels' : model.test_labels}
+    return state
+
+
+#
+# Function set_stage_state
+#
+
+def set_stage_state(model, state):
+    r"""Restore the output of a cached stage.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        The model object to restore.
+    state : dict
+        The stage output from ``get_stage_state``.
+
+    Returns
+    -------
+    all_features : numpy array or pandas.DataFrame
+        The features of the training and test data.
+    split_point : int
+        The number of training rows in ``all_features``.
+
+    """
+    model.feature_map = state['feature_map']
+    model.y_train = state['y_train']
+    model.y_test = state['y_test']
+    model.test_labels = state['test_labels']
+    return state['features'], state['split_point']
+
+
+#
+# Class StageCache
+#
+
+class StageCache(object):
+    """Store pipeline stage outputs on disk by content.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the cache files.
+    max_size : float
+        The maximum size of the cache in megabytes.
+
+    Notes
+    -----
+    Each entry is a joblib file named by its stage and key. Loading
+    an entry updates its modification time, and when the cache is
+    larger than ``max_size``, the least recently used entries are
+    removed first.
+
+    """
+
+    # __init__
+
+    def __init__(self,
+                 directory,
+                 max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    # get_path
+
+    def get_path(self, stage, key):
+        r"""Get the file path of an entry."""
+        file_name = PSEP.join([USEP.join([stage, key]), 'pkl'])
+        return SSEP.join([self.directory, file_name])
+
+    # load
+
+    def load(self, stage, key):
+        r"""Load a cached stage output.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage.
+        key : str
+            The cache key of the stage.
+
+        Returns
+        -------
+        value : object
+            The stage output, or ``None`` if it is not cached.
+
+        """
+        file_path = self.get_path(stage, key)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            value = joblib.load(file_path)
+        except Exception as e:
+            logger.info("Could not load cached stage %s: %s", stage, e)
+            return None
+        # mark the entry as recently used
+        os.utime(file_path, None)
+        logger.info("Loaded stage %s from cache [%s]", stage, key[:12])
+        return value
+
+    # save
+
+    def save(self, stage, key, value):
+        r"""Save a stage output and evict old entries.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage.
+        key : str
+            The cache key of the stage.
+        value : object
+            The stage output.
+
+        Returns
+        -------
+        None : None
+
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        file_path = self.get_path(stage, key)
+        joblib.dump(value, file_path)
+        logger.info("Saved stage %s to cache [%s]", stage, key[:12])
+        self.evict(keep=file_path)
+
+    # evict
+
+    def evict(self, keep=None):
+        r"""Remove the least recently used entries over the size limit.
+
+        Parameters
+        ----------
+        keep : str, optional
+            The path of an entry that is never removed, usually
+            the one just saved.
+
+        Returns
+        -------
+        None : None
+
+        """
+        entries = []
+        for file_path in glob.glob(SSEP.join([self.directory, '*.pkl'])):
+            stat = os.stat(file_path)
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+        entries.sort()
+        total = sum([e[1] for e in entries])
+        limit = self.max_size * 1024 * 1024
+        for _, size, file_path in entries:
+            if total <= limit:
+                break
+            if file_path == keep:
+                continue
+            logger.info("Evicting %s from cache", file_path)
+            os.remove(file_path)
+            total -= size
+
+    # restore
+
+    def restore(self, stage_keys):
+        r"""Find the last stage with a cached output.
+
+        Parameters
+        ----------
+        stage_keys : list
+            The ``(stage, key)`` pairs from ``get_stage_keys``.
+
+        Returns
+        -------
+        stage : str
+            The name of the last cached stage, or ``None``.
+        value : object
+            The output of the stage, or ``None``.
+
+        """
+        for stage, key in reversed(stage_keys):
+            value = self.load(stage, key)
+            if value is not None:
+                return stage, value
+        return None, None
@@ -39,27 +39,9 @@ from alphapy.space import Space
 
 from datetime import datetime
 from datetime import timedelta
-from imblearn.combine import SMOTEENN
-from imblearn.combine import SMOTETomek
-from imblearn.ensemble import BalanceCascade
-from imblearn.ensemble import EasyEnsemble
-from imblearn.over_sampling import RandomOverSampler
-from imblearn.over_sampling import SMOTE
-from imblearn.under_sampling import ClusterCentroids
-from imblearn.under_sampling import CondensedNearestNeighbour
-from imblearn.under_sampling import EditedNearestNeighbours
-from imblearn.under_sampling import InstanceHardnessThreshold
-from imblearn.under_sampling import NearMiss
-from imblearn.under_sampling import NeighbourhoodCleaningRule
-from imblearn.under_sampling import OneSidedSelection
-from imblearn.under_sampling import RandomUnderSampler
-from imblearn.under_sampling import RepeatedEditedNearestNeighbours
-from imblearn.under_sampling import TomekLinks
 import logging
 import numpy as np
 import pandas as pd
-pd.core.common.is_list_like = pd.api.types.is_list_like
-import pandas_datareader.data as web
 import re
 import requests
 from scipy import sparse
@@ -215,6 +197,20 @@ def sample_data(model):
 
     logger.info("Sampling Data")
 
+    # Import the samplers here, as imbalanced-learn is only needed for sampling.
+
+    from imblearn.combine import SMOTEENN
+    from imblearn.combine import SMOTETomek
+    from imblearn.ensemble import BalanceCascade
+    from imblearn.ensemble import EasyEnsemble
+    from imblearn.over_sampling import RandomOverSampler
+    from imblearn.over_sampling import SMOTE
+    from imblearn.under_sampling import ClusterCentroids
+    from imblearn.under_sampling import NearMiss
+    from imblearn.under_sampling import NeighbourhoodCleaningRule
+    from imblearn.under_sampling import RandomUnderSampler
+    from imblearn.under_sampling import TomekLinks
+
     # Extract model parameters.
 
     sampling_method = model.specs['sampling_method']
@@ -485,7 +481,10 @@ def get_pandas_data(schema, symbol, lookback_period):
     start = datetime.now() - timedelta(lookback_period)
     end = datetime.now()
 
-    # Call the Pandas Web data reader.
+    # Call the Pandas Web data reader, importing it on first use.
+
+    pd.core.common.is_list_like = pd.api.types.is_list_like
+    import pandas_datareader.data as web
 
     df = None
     try:
@@ -30,32 +30,11 @@ from alphapy.globals import ModelType
 from alphapy.globals import Objective
 from alphapy.globals import SSEP
 
-from keras.layers import *
-from keras.models import Sequential
-from keras.wrappers.scikit_learn import KerasClassifier
-from keras.wrappers.scikit_learn import KerasRegressor
+from importlib import import_module
 import logging
 import numpy as np
+from scipy import sparse
 from scipy.stats import randint as sp_randint
-from sklearn.ensemble import AdaBoostClassifier
-from sklearn.ensemble import ExtraTreesClassifier
-from sklearn.ensemble import ExtraTreesRegressor
-from sklearn.ensemble import GradientBoostingClassifier
-from sklearn.ensemble import GradientBoostingRegressor
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.linear_model import LinearRegression
-from sklearn.linear_model import LogisticRegression
-from sklearn.linear_model import RandomizedLasso
-from sklearn.linear_model import RandomizedLogisticRegression
-from sklearn.naive_bayes import GaussianNB
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.neighbors import KNeighborsRegressor
-from sklearn.svm import LinearSVC
-from sklearn.svm import OneClassSVM
-from sklearn.svm import SVC
-import xgboost as xgb
 import yaml
 
 
@@ -139,6 +118,11 @@ class Estimator:
         self.model_type = model_type
         self.estimator = estimator
         self.grid = grid
+
+    # __getnewargs__
+
+    def __getnewargs__(self):
+        return (self.algorithm, self.model_type, self.estimator, self.grid)
         
     # __str__
 
@@ -149,31 +133,135 @@ class Estimator:
 #
 # Define estimator map
 #
+# The classes are named by their import paths, so the library
+# of an algorithm is only imported when the algorithm is used.
+#
 
-estimator_map = {'AB'     : AdaBoostClassifier,
-                 'GB'     : GradientBoostingClassifier,
-                 'GBR'    : GradientBoostingRegressor,
-                 'KERASC' : KerasClassifier,
-                 'KERASR' : KerasRegressor,
-                 'KNN'    : KNeighborsClassifier,
-                 'KNR'    : KNeighborsRegressor,
-                 'LOGR'   : LogisticRegression,
-                 'LR'     : LinearRegression,
-                 'LSVC'   : LinearSVC,
-                 'LSVM'   : SVC,
-                 'NB'     : MultinomialNB,
-                 'RBF'    : SVC,
-                 'RF'     : RandomForestClassifier,
-                 'RFR'    : RandomForestRegressor,
-                 'SVM'    : SVC,
-                 'XGB'    : xgb.XGBClassifier,
-                 'XGBM'   : xgb.XGBClassifier,
-                 'XGBR'   : xgb.XGBRegressor,
-                 'XT'     : ExtraTreesClassifier,
-                 'XTR'    : ExtraTreesRegressor
+estimator_map = {'AB'     : 'sklearn.ensemble.AdaBoostClassifier',
+                 'GB'     : 'sklearn.ensemble.GradientBoostingClassifier',
+                 'GBR'    : 'sklearn.ensemble.GradientBoostingRegressor',
+                 'KERASC' : 'keras.wrappers.scikit_learn.KerasClassifier',
+                 'KERASR' : 'keras.wrappers.scikit_learn.KerasRegressor',
+                 'KNN'    : 'sklearn.neighbors.KNeighborsClassifier',
+                 'KNR'    : 'sklearn.neighbors.KNeighborsRegressor',
+                 'LOGR'   : 'sklearn.linear_model.LogisticRegression',
+                 'LR'     : 'sklearn.linear_model.LinearRegression',
+                 'LSVC'   : 'sklearn.svm.LinearSVC',
+                 'LSVM'   : 'sklearn.svm.SVC',
+                 'NB'     : 'sklearn.naive_bayes.MultinomialNB',
+                 'RBF'    : 'sklearn.svm.SVC',
+                 'RF'     : 'sklearn.ensemble.RandomForestClassifier',
+                 'RFR'    : 'sklearn.ensemble.RandomForestRegressor',
+                 'SVM'    : 'sklearn.svm.SVC',
+                 'XGB'    : 'xgboost.XGBClassifier',
+                 'XGBM'   : 'xgboost.XGBClassifier',
+                 'XGBR'   : 'xgboost.XGBRegressor',
+                 'XT'     : 'sklearn.ensemble.ExtraTreesClassifier',
+                 'XTR'    : 'sklearn.ensemble.ExtraTreesRegressor'
                 }
 
 
+#
+# Function get_estimator_class
+#
+
+def get_estimator_class(algo):
+    r"""Import the estimator class of an algorithm.
+
+    Parameters
+    ----------
+    algo : str
+        Abbreviation of the algorithm, e.g., ``RF``.
+
+    Returns
+    -------
+    func : class
+        The estimator class.
+
+    Raises
+    ------
+    KeyError
+        The algorithm is not in the estimator map.
+
+    Notes
+    -----
+    Python caches imported modules, so only the first call for
+    a given library pays for the import.
+
+    """
+    module_name, class_name = estimator_map[algo].rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)
+
+
+#
+# Define estimators that require a dense feature matrix
+#
+
+dense_estimators = ['KERASC', 'KERASR']
+
+
+#
+# Define estimators that must be trained in the main process
+#
+
+serial_estimators = ['KERASC', 'KERASR']
+
+
+#
+# Function set_estimator_jobs
+#
+
+def set_estimator_jobs(est, n_jobs):
+    r"""Set the number of jobs of an estimator.
+
+    Parameters
+    ----------
+    est : estimator
+        The scikit-learn or XGBoost estimator.
+    n_jobs : int
+        The number of jobs to run in parallel.
+
+    Returns
+    -------
+    est : estimator
+        The estimator, with ``n_jobs`` or ``nthread`` set if it
+        has either parameter.
+
+    """
+    params = est.get_params()
+    jobs = {p: n_jobs for p in ['n_jobs', 'nthread'] if p in params}
+    if jobs:
+        est.set_params(**jobs)
+    return est
+
+
+#
+# Function get_estimator_data
+#
+
+def get_estimator_data(algo, X):
+    r"""Get the feature matrix in a form the estimator accepts.
+
+    Parameters
+    ----------
+    algo : str
+        Abbreviation of the algorithm.
+    X : numpy array or scipy.sparse.csr_matrix
+        The feature matrix.
+
+    Returns
+    -------
+    X : numpy array or scipy.sparse.csr_matrix
+        The feature matrix, converted to a dense array only if the
+        algorithm cannot accept sparse input.
+
+    """
+    if sparse.issparse(X) and algo in dense_estimators:
+        logger.info("Converting Sparse Features to a Dense Matrix for %s", algo)
+        X = X.toarray()
+    return X
+
+
 #
 # Function get_algos_config
 #
@@ -269,11 +357,13 @@ def create_keras_model(nlayers,
 
     """
 
+    keras_layers = import_module('keras.layers')
+    Sequential = import_module('keras.models').Sequential
     model = Sequential()
     for i in range(nlayers):
         lvar = 'layer' + str(i+1)
         layer = eval(lvar)
-        model.add(eval(layer))
+        model.add(eval(layer, vars(keras_layers)))
     model.compile(optimizer=optimizer, loss=loss, metrics=[metrics])
     return model
 
@@ -296,6 +386,11 @@ def get_estimators(model):
     estimators : dict
         All of the estimators required for running the pipeline.
 
+    Notes
+    -----
+    Only the algorithms in the model specifications are created,
+    so the libraries of the other algorithms are never imported.
+
     """
 
     # Extract model data
@@ -329,12 +424,14 @@ def get_estimators(model):
     # Create estimators for all of the algorithms
 
     for algo in algo_specs:
+        if algo not in model.algolist:
+            continue
         model_type = algo_specs[algo]['model_type']
         params = algo_specs[algo]['params']
         for param in params:
             if param in ps_fields and isinstance(param, str):
                 algo_specs[algo]['params'][param] = eval(ps_fields[param])
-        func = estimator_map[algo]
+        func = get_estimator_class(algo)
         if 'KERAS' in algo:
             params['build_fn'] = create_keras_model
             layers = algo_specs[algo]['layers']
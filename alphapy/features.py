@@ -33,8 +33,12 @@ from alphapy.globals import ModelType
 from alphapy.globals import Scalers
 from alphapy.market_variables import Variable
 from alphapy.market_variables import vparse
+from alphapy.profiler import profile_stage
+from alphapy.utilities import get_worker_count
+from alphapy.utilities import np_memmap_data
 
 import category_encoders as ce
+import copy
 from importlib import import_module
 from itertools import groupby
 import logging
@@ -47,6 +51,8 @@ from scipy import sparse
 import scipy.stats as sps
 from sklearn.cluster import MiniBatchKMeans
 from sklearn.decomposition import PCA
+from sklearn.externals.joblib import delayed
+from sklearn.externals.joblib import Parallel
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.feature_extraction.text import TfidfTransformer
 from sklearn.feature_selection import chi2
@@ -61,6 +67,7 @@ from sklearn.feature_selection import VarianceThreshold
 from sklearn.manifold import Isomap
 from sklearn.manifold import TSNE
 from sklearn.preprocessing import Imputer
+from sklearn.preprocessing import MaxAbsScaler
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.preprocessing import PolynomialFeatures
 from sklearn.preprocessing import StandardScaler
@@ -74,6 +81,133 @@ import sys
 logger = logging.getLogger(__name__)
 
 
+#
+# Function apply_transformer
+#
+
+def apply_transformer(model, key, transformer, X, method='transform'):
+    r"""Fit a transformer to the features, or apply the fitted
+    transformer from the feature map in prediction mode.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        Model object with the feature map, or ``None`` to fit the
+        transformer without saving it.
+    key : str
+        The name of the transformer in the feature map.
+    transformer : object
+        An unfitted scikit-learn transformer or estimator.
+    X : numpy array or pandas.DataFrame
+        The features to transform.
+    method : str, optional
+        The method applied after fitting, e.g., ``predict`` for
+        cluster labels.
+
+    Returns
+    -------
+    X_new : numpy array
+        The transformed features.
+
+    Notes
+    -----
+    Fitted transformers are stored in ``model.feature_map['transformers']``,
+    which is saved with the feature map, so that new data is transformed
+    without refitting.
+
+    """
+    if model is not None:
+        transformers = model.feature_map.setdefault('transformers', {})
+        predict_mode = model.specs['predict_mode']
+    else:
+        transformers = {}
+        predict_mode = False
+    if predict_mode and key in transformers:
+        return getattr(transformers[key], method)(X)
+    if predict_mode:
+        logger.info("No fitted transformer %s, fitting on prediction data", key)
+    if method == 'transform':
+        X_new = transformer.fit_transform(X)
+    else:
+        X_new = getattr(transformer.fit(X), method)(X)
+    transformers[key] = transformer
+    return X_new
+
+
+#
+# Function get_factor_codes
+#
+
+def get_factor_codes(model, key, feature, sort=False):
+    r"""Encode a feature as integer codes, using the saved factor
+    levels in prediction mode.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        Model object with the feature map.
+    key : str
+        The name of the factor levels in the feature map.
+    feature : pandas.Series
+        The feature to encode.
+    sort : bool, optional
+        If ``True``, then sort the factor levels.
+
+    Returns
+    -------
+    codes : numpy array
+        The factor codes, where -1 is a missing or unknown value.
+    nlevels : int
+        The number of factor levels.
+
+    """
+    transformers = model.feature_map.setdefault('transformers', {})
+    if model.specs['predict_mode'] and key in transformers:
+        uniques = transformers[key]
+        codes = uniques.get_indexer(feature)
+    else:
+        codes, uniques = pd.factorize(feature, sort=sort)
+        transformers[key] = pd.Index(uniques)
+    return codes, len(uniques)
+
+
+#
+# Define the prefixes of the transformers fitted for each base column
+#
+
+column_prefixes = ['count', 'encoder', 'factors', 'impute', 'log', 'tfidf']
+
+
+#
+# Function get_column_key
+#
+
+def get_column_key(prefix, fname):
+    r"""Get the feature map key of a transformer for one column.
+
+    Parameters
+    ----------
+    prefix : str
+        The kind of transformer, one of ``column_prefixes``.
+    fname : str
+        Name of the column.
+
+    Returns
+    -------
+    key : str
+        The name of the transformer in the feature map.
+
+    Raises
+    ------
+    ValueError
+        The prefix is not a column transformer.
+
+    """
+    if prefix not in column_prefixes:
+        raise ValueError("Unknown column transformer %s" % prefix)
+    return USEP.join([prefix, fname])
+
+
 #
 # Define feature scoring functions
 #
@@ -521,7 +655,7 @@ def apply_treatments(model, X):
 # Function impute_values
 #
 
-def impute_values(features, dt, sentinel):
+def impute_values(features, dt, sentinel, model=None, key=None):
     r"""Impute values for a given data type. The *median* strategy
     is applied for floating point values, and the *most frequent*
     strategy is applied for integer or Boolean values.
@@ -534,6 +668,10 @@ def impute_values(features, dt, sentinel):
         The values ``'float64'``, ``'int64'``, or ``'bool'``.
     sentinel : float
         The number to be imputed for NaN values.
+    model : alphapy.Model, optional
+        Model object for saving the fitted imputer.
+    key : str, optional
+        The name of the imputer in the feature map.
 
     Returns
     -------
@@ -562,7 +700,7 @@ def impute_values(features, dt, sentinel):
         imp = Imputer(missing_values='NaN', strategy='most_frequent', axis=0)
     else:
         raise TypeError("Data Type %s is invalid for imputation" % dt)
-    imputed = imp.fit_transform(features)
+    imputed = apply_transformer(model, key, imp, features)
     if imputed.shape[1] == 0:
         nans = np.isnan(features)
         features[nans] = sentinel
@@ -576,13 +714,15 @@ def impute_values(features, dt, sentinel):
 # Function get_numerical_features
 #
 
-def get_numerical_features(fnum, fname, df, nvalues, dt,
+def get_numerical_features(model, fnum, fname, df, nvalues, dt,
                            sentinel, logt, plevel):
     r"""Transform numerical features with imputation and possibly
     log-transformation.
 
     Parameters
     ----------
+    model : alphapy.Model
+        Model object with the feature map.
     fnum : int
         Feature number, strictly for logging purposes
     fname : str
@@ -614,14 +754,25 @@ def get_numerical_features(fnum, fname, df, nvalues, dt,
         logger.info("Feature %d: %s is a numerical feature of type %s with %d unique values",
                     fnum, fname, dt, nvalues)
     # imputer for float, integer, or boolean data types
-    new_values = impute_values(feature, dt, sentinel)
-    # log-transform any values that do not fit a normal distribution
-    if logt and np.all(new_values > 0):
-        stat, pvalue = sps.normaltest(new_values)
-        if pvalue <= plevel:
-            logger.info("Feature %d: %s is not normally distributed [p-value: %f]",
-                        fnum, fname, pvalue)
-            new_values = np.log(new_values)
+    new_values = impute_values(feature, dt, sentinel, model,
+                               get_column_key('impute', fname))
+    # log-transform any values that do not fit a normal distribution,
+    # reusing the decision from training in prediction mode
+    transformers = model.feature_map.setdefault('transformers', {})
+    log_key = get_column_key('log', fname)
+    if model.specs['predict_mode'] and log_key in transformers:
+        log_values = transformers[log_key]
+    else:
+        log_values = False
+        if logt and np.all(new_values > 0):
+            stat, pvalue = sps.normaltest(new_values)
+            if pvalue <= plevel:
+                logger.info("Feature %d: %s is not normally distributed [p-value: %f]",
+                            fnum, fname, pvalue)
+                log_values = True
+        transformers[log_key] = log_values
+    if log_values:
+        new_values = np.log(new_values)
     return new_values
 
 
@@ -662,12 +813,15 @@ def get_polynomials(features, poly_degree):
 # Function get_text_features
 #
 
-def get_text_features(fnum, fname, df, nvalues, vectorize, ngrams_max):
+def get_text_features(model, fnum, fname, df, nvalues, vectorize, ngrams_max,
+                      sparse_flag=False):
     r"""Transform text features with count vectorization and TF-IDF,
     or alternatively factorization.
 
     Parameters
     ----------
+    model : alphapy.Model
+        Model object with the feature map.
     fnum : int
         Feature number, strictly for logging purposes
     fname : str
@@ -680,10 +834,12 @@ def get_text_features(fnum, fname, df, nvalues, vectorize, ngrams_max):
         If ``True``, then attempt count vectorization.
     ngrams_max : int
         The maximum number of n-grams for count vectorization.
+    sparse_flag : bool, optional
+        If ``True``, then keep the vectorized features in a sparse matrix.
 
     Returns
     -------
-    new_features : numpy array
+    new_features : numpy array or scipy.sparse.csr_matrix
         The vectorized or factorized text features.
 
     References
@@ -704,20 +860,26 @@ def get_text_features(fnum, fname, df, nvalues, vectorize, ngrams_max):
     # need a null text placeholder for vectorization
     feature.fillna(value=NULLTEXT, inplace=True)
     # vectorization creates many columns, otherwise just factorize
-    if vectorize:
+    factor_key = get_column_key('factors', fname)
+    factored = factor_key in model.feature_map.get('transformers', {})
+    if vectorize and not factored:
         logger.info("Feature %d: %s => Attempting Vectorization", fnum, fname)
         count_vect = CountVectorizer(ngram_range=[1, ngrams_max])
         try:
-            count_feature = count_vect.fit_transform(feature)
+            count_feature = apply_transformer(model, get_column_key('count', fname),
+                                              count_vect, feature)
             tfidf_transformer = TfidfTransformer()
-            new_features = tfidf_transformer.fit_transform(count_feature).todense()
+            new_features = apply_transformer(model, get_column_key('tfidf', fname),
+                                             tfidf_transformer, count_feature)
+            if not sparse_flag:
+                new_features = new_features.todense()
             logger.info("Feature %d: %s => Vectorization Succeeded", fnum, fname)
         except:
             logger.info("Feature %d: %s => Vectorization Failed", fnum, fname)
-            new_features, uniques = pd.factorize(feature)
+            new_features, nlevels = get_factor_codes(model, factor_key, feature)
     else:
         logger.info("Feature %d: %s => Factorization", fnum, fname)
-        new_features, uniques = pd.factorize(feature)
+        new_features, nlevels = get_factor_codes(model, factor_key, feature)
     return new_features
 
 
@@ -823,8 +985,9 @@ def get_factors(model, df, fnum, fname, nvalues, dtype,
 
     Returns
     -------
-    all_features : numpy array
-        The features that have been transformed to factors.
+    all_features : numpy array or scipy.sparse.csr_matrix
+        The features that have been transformed to factors. One-hot
+        and binary encodings are sparse if ``sparse`` is specified.
 
     """
 
@@ -836,6 +999,7 @@ def get_factors(model, df, fnum, fname, nvalues, dtype,
 
     feature_map = model.feature_map
     model_type = model.specs['model_type']
+    sparse_flag = model.specs['sparse']
     target_value = model.specs['target_value']
 
     # get feature
@@ -844,14 +1008,21 @@ def get_factors(model, df, fnum, fname, nvalues, dtype,
     if dtype == 'float64':
         logger.info("Rounding: %d", rounding)
         feature = feature.apply(float_factor, args=[rounding])
-    # encoders
+    # encoders, with the factor levels saved for prediction
     enc = None
     ef = pd.DataFrame(feature)
+    pd_features = None
+    factor_key = get_column_key('factors', fname)
     if encoder == Encoders.factorize:
-        pd_factors = pd.factorize(feature)[0]
-        pd_features = pd.DataFrame(pd_factors)
+        pd_factors, nlevels = get_factor_codes(model, factor_key, feature)
+        pd_features = pd_factors.reshape(-1, 1)
     elif encoder == Encoders.onehot:
-        pd_features = pd.get_dummies(feature)
+        codes, nlevels = get_factor_codes(model, factor_key, feature, sort=True)
+        rows = np.flatnonzero(codes >= 0)
+        pd_features = sparse.csr_matrix((np.ones(len(rows)), (rows, codes[rows])),
+                                        shape=(len(codes), nlevels))
+        if not sparse_flag:
+            pd_features = pd_features.toarray()
     elif encoder == Encoders.ordinal:
         enc = ce.OrdinalEncoder(cols=[fname])
     elif encoder == Encoders.binary:
@@ -867,14 +1038,15 @@ def get_factors(model, df, fnum, fname, nvalues, dtype,
     else:
         raise ValueError("Unknown Encoder %s" % encoder)
     # If encoding worked, calculate target percentages for classifiers.
-    pd_exists = not pd_features.empty
+    pd_exists = pd_features is not None and pd_features.shape[1] > 0
     enc_exists = enc is not None
     all_features = None
     if pd_exists or enc_exists:
         if pd_exists:
             all_features = pd_features
         elif enc_exists:
-            all_features = enc.fit_transform(ef, None)
+            all_features = apply_transformer(model, get_column_key('encoder', fname),
+                                             enc, ef)
         # Calculate target percentages for factors
         if (model_type == ModelType.classification and
            fname in feature_map['crosstabs']):
@@ -886,10 +1058,17 @@ def get_factors(model, df, fnum, fname, nvalues, dtype,
             # impute sentinel for any values that could not be mapped
             ct_feature.fillna(value=sentinel, inplace=True)
             # concatenate all generated features
-            all_features = np.column_stack((all_features, ct_feature))
+            if sparse.issparse(all_features):
+                all_features = sparse.hstack((all_features, ct_feature.values),
+                                             format='csr')
+            else:
+                all_features = np.column_stack((all_features, ct_feature))
             logger.info("Applied target percentages for %s", fname)
     else:
         raise RuntimeError("Encoding for feature %s failed" % fname)
+    # keep wide encodings sparse
+    if sparse_flag and encoder == Encoders.binary:
+        all_features = sparse.csr_matrix(np.asarray(all_features, dtype=float))
     return all_features
 
 
@@ -897,7 +1076,7 @@ def get_factors(model, df, fnum, fname, nvalues, dtype,
 # Function create_numpy_features
 #
 
-def create_numpy_features(base_features, sentinel):
+def create_numpy_features(base_features, sentinel, model=None):
     r"""Calculate the sum, mean, standard deviation, and variance
     of each row.
 
@@ -907,6 +1086,8 @@ def create_numpy_features(base_features, sentinel):
         The feature dataframe.
     sentinel : float
         The number to be imputed for NaN values.
+    model : alphapy.Model, optional
+        Model object for saving the fitted imputer and scaler.
 
     Returns
     -------
@@ -931,8 +1112,10 @@ def create_numpy_features(base_features, sentinel):
     # Impute, scale, and stack all new features.
 
     np_features = np.column_stack((row_sum, row_mean, row_std, row_var))
-    np_features = impute_values(np_features, 'float64', sentinel)
-    np_features = StandardScaler().fit_transform(np_features)
+    np_features = impute_values(np_features, 'float64', sentinel,
+                                model, 'numpy_impute')
+    np_features = apply_transformer(model, 'numpy_scaler', StandardScaler(),
+                                    np_features)
 
     # Return new NumPy features
 
@@ -944,7 +1127,7 @@ def create_numpy_features(base_features, sentinel):
 # Function create_scipy_features
 #
 
-def create_scipy_features(base_features, sentinel):
+def create_scipy_features(base_features, sentinel, model=None):
     r"""Calculate the skew, kurtosis, and other statistical features
     for each row.
 
@@ -954,6 +1137,8 @@ def create_scipy_features(base_features, sentinel):
         The feature dataframe.
     sentinel : float
         The number to be imputed for NaN values.
+    model : alphapy.Model, optional
+        Model object for saving the fitted imputer and scaler.
 
     Returns
     -------
@@ -988,8 +1173,10 @@ def create_scipy_features(base_features, sentinel):
     sp_features = np.column_stack((row_gmean, row_kurtosis, row_ktest,
                                    row_normal, row_skew, row_stest,
                                    row_var, row_stn, row_sem))
-    sp_features = impute_values(sp_features, 'float64', sentinel)
-    sp_features = StandardScaler().fit_transform(sp_features)
+    sp_features = impute_values(sp_features, 'float64', sentinel,
+                                model, 'scipy_impute')
+    sp_features = apply_transformer(model, 'scipy_scaler', StandardScaler(),
+                                    sp_features)
 
     # Return new SciPy features
 
@@ -1042,15 +1229,13 @@ def create_clusters(features, model):
 
     # Generate clustering features
 
-    cfeatures = np.zeros((features.shape[0], 1))
-    for i in range(cluster_min, cluster_max+1, cluster_inc):
+    clusters = range(cluster_min, cluster_max+1, cluster_inc)
+    cfeatures = np.empty((features.shape[0], len(clusters)))
+    for j, i in enumerate(clusters):
         logger.info("k = %d", i)
         km = MiniBatchKMeans(n_clusters=i, random_state=seed)
-        km.fit(features)
-        labels = km.predict(features)
-        labels = labels.reshape(-1, 1)
-        cfeatures = np.column_stack((cfeatures, labels))
-    cfeatures = np.delete(cfeatures, 0, axis=1)
+        cfeatures[:, j] = apply_transformer(model, USEP.join(['kmeans', str(i)]),
+                                            km, features, 'predict')
 
     # Return new clustering features
 
@@ -1103,12 +1288,16 @@ def create_pca_features(features, model):
 
     # Generate clustering features
 
-    pfeatures = np.zeros((features.shape[0], 1))
-    for i in range(pca_min, pca_max+1, pca_inc):
+    components = range(pca_min, pca_max+1, pca_inc)
+    pfeatures = np.empty((features.shape[0], sum(components)))
+    col = 0
+    for i in components:
         logger.info("n_components = %d", i)
-        X_pca = PCA(n_components=i, whiten=pca_whiten).fit_transform(features)
-        pfeatures = np.column_stack((pfeatures, X_pca))
-    pfeatures = np.delete(pfeatures, 0, axis=1)
+        X_pca = apply_transformer(model, USEP.join(['pca', str(i)]),
+                                  PCA(n_components=i, whiten=pca_whiten),
+                                  features)
+        pfeatures[:, col:col+i] = X_pca
+        col += i
 
     # Return new clustering features
 
@@ -1164,9 +1353,9 @@ def create_isomap_features(features, model):
 
     # Generate Isomap features
 
-    model = Isomap(n_neighbors=iso_neighbors, n_components=iso_components,
-                   n_jobs=n_jobs)
-    ifeatures = model.fit_transform(features)
+    iso = Isomap(n_neighbors=iso_neighbors, n_components=iso_components,
+                 n_jobs=n_jobs)
+    ifeatures = apply_transformer(model, 'isomap', iso, features)
 
     # Return new Isomap features
 
@@ -1193,6 +1382,11 @@ def create_tsne_features(features, model):
     tfeatures : numpy array
         The t-SNE features.
 
+    Notes
+    -----
+    t-SNE has no ``transform`` for new data, so the embedding is
+    always fit to the given features, even in prediction mode.
+
     References
     ----------
     You can find more information on the t-SNE technique here [TSNE]_.
@@ -1218,9 +1412,9 @@ def create_tsne_features(features, model):
 
     # Generate T-SNE features
 
-    model = TSNE(n_components=tsne_components, perplexity=tsne_perplexity,
-                 learning_rate=tsne_learn_rate, random_state=seed)
-    tfeatures = model.fit_transform(features)
+    tsne = TSNE(n_components=tsne_components, perplexity=tsne_perplexity,
+                learning_rate=tsne_learn_rate, random_state=seed)
+    tfeatures = tsne.fit_transform(features)
 
     # Return new T-SNE features
 
@@ -1228,6 +1422,279 @@ def create_tsne_features(features, model):
     return tfeatures
 
 
+#
+# Function get_base_features
+#
+
+def get_base_features(model, X, fnum, fname):
+    r"""Transform one column of the original features.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        Model object with the feature specifications.
+    X : pandas.DataFrame
+        Dataframe containing the column ``fname``.
+    fnum : int
+        Feature number, strictly for logging purposes
+    fname : str
+        Name of the column to transform.
+
+    Returns
+    -------
+    features : numpy array or scipy.sparse.csr_matrix
+        The two-dimensional block of new features.
+
+    Raises
+    ------
+    TypeError
+        Unrecognized data type.
+
+    """
+
+    # Extract model parameters
+
+    encoder = model.specs['encoder']
+    factors = model.specs['factors']
+    logtransform = model.specs['logtransform']
+    ngrams_max = model.specs['ngrams_max']
+    pvalue_level = model.specs['pvalue_level']
+    rounding = model.specs['rounding']
+    sentinel = model.specs['sentinel']
+    sparse_flag = model.specs['sparse']
+    vectorize = model.specs['vectorize']
+
+    # Standard processing of numerical, categorical, and text features
+
+    dtype = X[fname].dtypes
+    nunique = len(X[fname].unique())
+    if fname in factors:
+        features = get_factors(model, X, fnum, fname, nunique, dtype,
+                               encoder, rounding, sentinel)
+    elif dtype == 'float64' or dtype == 'int64' or dtype == 'bool':
+        features = get_numerical_features(model, fnum, fname, X, nunique, dtype,
+                                          sentinel, logtransform, pvalue_level)
+    elif dtype == 'object':
+        features = get_text_features(model, fnum, fname, X, nunique, vectorize,
+                                     ngrams_max, sparse_flag)
+    else:
+        raise TypeError("Base Feature Error with unrecognized type %s" % dtype)
+    if not sparse.issparse(features):
+        features = np.asarray(features)
+        if features.ndim == 1:
+            features = features.reshape(-1, 1)
+    return features
+
+
+#
+# Function get_base_block
+#
+
+def get_base_block(model, X, fnum, fname):
+    r"""Transform one column of the original features in a worker,
+    returning the transformers that were fitted along the way.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        Model object with the feature specifications.
+    X : pandas.DataFrame
+        Dataframe containing the column ``fname``.
+    fnum : int
+        Feature number, strictly for logging purposes
+    fname : str
+        Name of the column to transform.
+
+    Returns
+    -------
+    features : numpy array or scipy.sparse.csr_matrix
+        The two-dimensional block of new features.
+    fitted : dict
+        The transformers fitted for this column, to be merged into
+        the feature map of the parent process.
+
+    """
+    transformers = model.feature_map.setdefault('transformers', {})
+    saved = set(transformers)
+    features = get_base_features(model, X, fnum, fname)
+    fitted = {k: v for k, v in transformers.items() if k not in saved}
+    return features, fitted
+
+
+#
+# Function get_base_blocks
+#
+
+def get_base_blocks(model, X, columns, nworkers=1):
+    r"""Generate the base features of each column in turn.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        Model object with the feature specifications.
+    X : pandas.DataFrame
+        Dataframe containing the original features.
+    columns : list
+        The feature number and the name of each column to transform.
+    nworkers : int, optional
+        The number of columns to transform in parallel.
+
+    Yields
+    ------
+    fname : str
+        Name of the transformed column.
+    features : numpy array or scipy.sparse.csr_matrix
+        The two-dimensional block of new features.
+
+    Notes
+    -----
+    Only ``nworkers`` blocks are held at a time, so the caller can
+    write each block into the feature matrix and release it. The
+    transformers fitted in the workers are merged into the feature
+    map of ``model``.
+
+    """
+    if nworkers > 1:
+        transformers = model.feature_map.setdefault('transformers', {})
+        fmodel = copy.copy(model)
+        fmodel.X_train = fmodel.X_test = None
+        fmodel.y_train = fmodel.y_test = None
+        fmodel.profiler = None
+        with Parallel(n_jobs=nworkers) as parallel:
+            for start in range(0, len(columns), nworkers):
+                batch = columns[start:start + nworkers]
+                results = parallel(
+                    delayed(get_base_block)(get_column_model(fmodel, fc),
+                                            X[[fc]], fnum, fc)
+                    for fnum, fc in batch)
+                for (fnum, fc), (features, fitted) in zip(batch, results):
+                    transformers.update(fitted)
+                    yield fc, features
+                del results
+    else:
+        for fnum, fc in columns:
+            yield fc, get_base_features(model, X, fnum, fc)
+
+
+#
+# Function get_column_model
+#
+
+def get_column_model(model, fname):
+    r"""Copy a model with only the feature map entries of one column.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        Model object with the feature map.
+    fname : str
+        Name of the column to transform.
+
+    Returns
+    -------
+    cmodel : alphapy.Model
+        A shallow copy of ``model`` whose feature map holds only the
+        crosstab and the transformers of ``fname``.
+
+    Notes
+    -----
+    The transformers of a base column are keyed by one of the
+    ``column_prefixes`` and the column name, e.g., ``impute_fname``,
+    so a worker is sent only the transformers it can use instead of
+    the whole feature map. The keys are looked up explicitly, so a
+    global transformer such as ``numpy_scaler`` is never sent for a
+    column named ``scaler``.
+
+    """
+    feature_map = model.feature_map
+    crosstabs = feature_map.get('crosstabs', {})
+    transformers = feature_map.get('transformers', {})
+    keys = [get_column_key(prefix, fname) for prefix in column_prefixes]
+    cmodel = copy.copy(model)
+    cmodel.feature_map = {
+        'crosstabs' : {fname: crosstabs[fname]} if fname in crosstabs else {},
+        'transformers' : {k: transformers[k] for k in keys if k in transformers}}
+    return cmodel
+
+
+#
+# Function get_derived_count
+#
+
+def get_derived_count(model):
+    r"""Get the number of derived features to be created from the
+    base features.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        Model object with the feature specifications.
+
+    Returns
+    -------
+    nderived : int
+        The total width of the NumPy, SciPy, clustering, PCA, Isomap,
+        and t-SNE feature blocks.
+
+    """
+    nderived = 0
+    if model.specs['numpy']:
+        nderived += 4
+    if model.specs['scipy']:
+        nderived += 9
+    if model.specs['clustering']:
+        nderived += len(range(model.specs['cluster_min'],
+                              model.specs['cluster_max'] + 1,
+                              model.specs['cluster_inc']))
+    if model.specs['pca']:
+        nderived += sum(range(model.specs['pca_min'],
+                              model.specs['pca_max'] + 1,
+                              model.specs['pca_inc']))
+    if model.specs['isomap']:
+        nderived += model.specs['iso_components']
+    if model.specs['tsne']:
+        nderived += model.specs['tsne_components']
+    return nderived
+
+
+#
+# Function insert_features
+#
+
+def insert_features(all_features, features, col):
+    r"""Write a block of features into the feature matrix.
+
+    Parameters
+    ----------
+    all_features : numpy array
+        The preallocated feature matrix.
+    features : numpy array
+        The block of features to insert.
+    col : int
+        The first column of the block in ``all_features``.
+
+    Returns
+    -------
+    col : int
+        The column following the inserted block.
+
+    Raises
+    ------
+    IndexError
+        The block does not fit in the feature matrix.
+
+    """
+    features = np.asarray(features)
+    if features.ndim == 1:
+        features = features.reshape(-1, 1)
+    end = col + features.shape[1]
+    if end > all_features.shape[1]:
+        raise IndexError("Feature block [%d:%d] exceeds the %d allocated columns" %
+                         (col, end, all_features.shape[1]))
+    all_features[:, col:end] = features
+    return end
+
+
 #
 # Function create_features
 #
@@ -1244,8 +1711,8 @@ def create_features(model, X):
 
     Returns
     -------
-    all_features : numpy array
-        The new features.
+    all_features : numpy array or scipy.sparse.csr_matrix
+        The new features, in a sparse matrix if ``sparse`` is specified.
 
     Raises
     ------
@@ -1258,23 +1725,20 @@ def create_features(model, X):
 
     clustering = model.specs['clustering']
     counts_flag = model.specs['counts']
-    encoder = model.specs['encoder']
-    factors = model.specs['factors']
+    feature_dtype = model.specs['feature_dtype']
     isomap = model.specs['isomap']
-    logtransform = model.specs['logtransform']
     model_type = model.specs['model_type']
-    ngrams_max = model.specs['ngrams_max']
+    n_jobs = model.specs['n_jobs']
     numpy_flag = model.specs['numpy']
     pca = model.specs['pca']
-    pvalue_level = model.specs['pvalue_level']
-    rounding = model.specs['rounding']
+    predict_mode = model.specs['predict_mode']
     scaling = model.specs['scaler_option']
     scaler = model.specs['scaler_type']
     scipy_flag = model.specs['scipy']
     sentinel = model.specs['sentinel']
+    sparse_flag = model.specs['sparse']
     target_value = model.specs['target_value']
     tsne = model.specs['tsne']
-    vectorize = model.specs['vectorize']
 
     # Log input parameters
 
@@ -1298,91 +1762,163 @@ def create_features(model, X):
         logger.info("New Feature Count : %d", X.shape[1])
 
     # Iterate through columns, dispatching and transforming each feature.
+    # The first pass fits the transformers and measures the width of
+    # each block, releasing the block right away. The widths are saved
+    # in the feature map, so new data skips the first pass. The columns
+    # are independent, so they are transformed in parallel if requested.
 
     logger.info("Creating Base Features")
-    all_features = np.zeros((X.shape[0], 1))
-
-    for i, fc in enumerate(X):
-        fnum = i + 1
-        dtype = X[fc].dtypes
-        nunique = len(X[fc].unique())
-        # standard processing of numerical, categorical, and text features
-        if fc in factors:
-            features = get_factors(model, X, fnum, fc, nunique, dtype,
-                                   encoder, rounding, sentinel)            
-        elif dtype == 'float64' or dtype == 'int64' or dtype == 'bool':
-            features = get_numerical_features(fnum, fc, X, nunique, dtype,
-                                              sentinel, logtransform, pvalue_level)
-        elif dtype == 'object':
-            features = get_text_features(fnum, fc, X, nunique, vectorize, ngrams_max)
-        else:
-            raise TypeError("Base Feature Error with unrecognized type %s" % dtype)
-        if features.shape[0] == all_features.shape[0]:
-            all_features = np.column_stack((all_features, features))
-        else:
-            logger.info("Feature %s has the wrong number of rows: %d",
-                        fc, features.shape[0])
-    all_features = np.delete(all_features, 0, axis=1)
-
-    logger.info("New Feature Count : %d", all_features.shape[1])
-
-    # Call standard scaler for all features
+    nrows = X.shape[0]
+    nworkers = get_worker_count(n_jobs, X.shape[1])
+    if nworkers > 1:
+        logger.info("Transforming %d Columns with %d Workers", X.shape[1], nworkers)
+
+    columns = [(i + 1, fc) for i, fc in enumerate(X)]
+    widths = model.feature_map.setdefault('base_widths', {})
+    measured = predict_mode and all([fc in widths for fc in X])
+    with profile_stage(model, 'base'):
+        if sparse_flag:
+            blocks = []
+            for fc, features in get_base_blocks(model, X, columns, nworkers):
+                if features.shape[0] == nrows:
+                    blocks.append(sparse.csr_matrix(features, dtype=feature_dtype))
+                else:
+                    logger.info("Feature %s has the wrong number of rows: %d",
+                                fc, features.shape[0])
+        elif not measured:
+            for fc, features in get_base_blocks(model, X, columns, nworkers):
+                if features.shape[0] == nrows:
+                    widths[fc] = features.shape[1]
+                else:
+                    widths[fc] = 0
+                    logger.info("Feature %s has the wrong number of rows: %d",
+                                fc, features.shape[0])
+                del features
+
+    # The second pass allocates the feature matrix once and writes
+    # each base block as it is produced, leaving room for the derived
+    # features. The blocks are produced again with the transformers
+    # fitted in the first pass. In sparse mode, the base blocks are
+    # stacked into a CSR matrix instead, and the dense derived features
+    # are appended at the end.
+
+    nderived = get_derived_count(model)
+    if sparse_flag:
+        nbase = sum([b.shape[1] for b in blocks])
+        logger.info("Stacking %d x %d Sparse Feature Matrix [%s]",
+                    nrows, nbase, feature_dtype)
+        all_features = sparse.hstack(blocks, format='csr', dtype=feature_dtype)
+        del blocks[:]
+        base_features = all_features
+        derived_features = np.empty((nrows, nderived), dtype=feature_dtype)
+    else:
+        columns = [(fnum, fc) for fnum, fc in columns if widths[fc] > 0]
+        nbase = sum([widths[fc] for fnum, fc in columns])
+        logger.info("Allocating %d x %d Feature Matrix [%s]",
+                    nrows, nbase + nderived, feature_dtype)
+        all_features = np.empty((nrows, nbase + nderived), dtype=feature_dtype)
+        pmodel = copy.copy(model)
+        pmodel.specs = dict(model.specs, predict_mode=True)
+        col = 0
+        with profile_stage(model, 'base'):
+            for fc, features in get_base_blocks(pmodel, X, columns, nworkers):
+                if features.shape != (nrows, widths[fc]):
+                    raise ValueError("Feature %s has shape %s instead of %s" %
+                                     (fc, features.shape, (nrows, widths[fc])))
+                col = insert_features(all_features, features, col)
+                del features
+        base_features = all_features[:, :nbase]
+        derived_features = all_features[:, nbase:]
+
+    logger.info("New Feature Count : %d", nbase)
+
+    # Call standard scaler for all features. Sparse features are not
+    # centered, and the sparse equivalent of min-max is max-abs.
 
     if scaling:
         logger.info("Scaling Base Features")
         if scaler == Scalers.standard:
-            all_features = StandardScaler().fit_transform(all_features)
+            scaler_est = StandardScaler(copy=False, with_mean=not sparse_flag)
+        elif scaler == Scalers.minmax and sparse_flag:
+            logger.info("Scaling Sparse Features by Maximum Absolute Value")
+            scaler_est = MaxAbsScaler(copy=False)
         elif scaler == Scalers.minmax:
-            all_features = MinMaxScaler().fit_transform(all_features)
+            scaler_est = MinMaxScaler(copy=False)
         else:
+            scaler_est = None
             logger.info("Unrecognized scaler: %s", scaler)
+        with profile_stage(model, 'scaling'):
+            if scaler_est is not None and sparse_flag:
+                all_features = base_features = apply_transformer(model, 'scaler',
+                                                                 scaler_est, base_features)
+            elif scaler_est is not None:
+                base_features[:] = apply_transformer(model, 'scaler', scaler_est,
+                                                     base_features)
     else:
         logger.info("Skipping Scaling")
 
-    # Perform dimensionality reduction only on base feature set
-    base_features = all_features
+    # Perform dimensionality reduction only on base feature set. Only
+    # clustering accepts sparse input, so the other transforms get a
+    # dense copy of the base features.
 
-    # Calculate the total, mean, standard deviation, and variance
+    dense_features = base_features
+    if sparse_flag and (numpy_flag or scipy_flag or pca or isomap or tsne):
+        logger.info("Converting Base Features to a Dense Matrix")
+        dense_features = base_features.toarray()
+    col = 0
+
+    # Calculate the total, mean, standard deviation, and variance.
 
     if numpy_flag:
-        np_features = create_numpy_features(base_features, sentinel)
-        all_features = np.column_stack((all_features, np_features))
-        logger.info("New Feature Count : %d", all_features.shape[1])
+        with profile_stage(model, 'numpy'):
+            np_features = create_numpy_features(dense_features, sentinel, model)
+        col = insert_features(derived_features, np_features, col)
+        logger.info("New Feature Count : %d", nbase + col)
 
     # Generate scipy features
 
     if scipy_flag:
-        sp_features = create_scipy_features(base_features, sentinel)
-        all_features = np.column_stack((all_features, sp_features))
-        logger.info("New Feature Count : %d", all_features.shape[1])
+        with profile_stage(model, 'scipy'):
+            sp_features = create_scipy_features(dense_features, sentinel, model)
+        col = insert_features(derived_features, sp_features, col)
+        logger.info("New Feature Count : %d", nbase + col)
 
     # Create clustering features
 
     if clustering:
-        cfeatures = create_clusters(base_features, model)
-        all_features = np.column_stack((all_features, cfeatures))
-        logger.info("New Feature Count : %d", all_features.shape[1])
+        with profile_stage(model, 'clusters'):
+            cfeatures = create_clusters(base_features, model)
+        col = insert_features(derived_features, cfeatures, col)
+        logger.info("New Feature Count : %d", nbase + col)
 
     # Create PCA features
 
     if pca:
-        pfeatures = create_pca_features(base_features, model)
-        all_features = np.column_stack((all_features, pfeatures))
-        logger.info("New Feature Count : %d", all_features.shape[1])
+        with profile_stage(model, 'pca'):
+            pfeatures = create_pca_features(dense_features, model)
+        col = insert_features(derived_features, pfeatures, col)
+        logger.info("New Feature Count : %d", nbase + col)
 
     # Create Isomap features
 
     if isomap:
-        ifeatures = create_isomap_features(base_features, model)
-        all_features = np.column_stack((all_features, ifeatures))
-        logger.info("New Feature Count : %d", all_features.shape[1])
+        with profile_stage(model, 'isomap'):
+            ifeatures = create_isomap_features(dense_features, model)
+        col = insert_features(derived_features, ifeatures, col)
+        logger.info("New Feature Count : %d", nbase + col)
 
     # Create T-SNE features
 
     if tsne:
-        tfeatures = create_tsne_features(base_features, model)
-        all_features = np.column_stack((all_features, tfeatures))
-        logger.info("New Feature Count : %d", all_features.shape[1])
+        with profile_stage(model, 'tsne'):
+            tfeatures = create_tsne_features(dense_features, model)
+        col = insert_features(derived_features, tfeatures, col)
+        logger.info("New Feature Count : %d", nbase + col)
+
+    # Append the derived features to a sparse matrix
+
+    if sparse_flag and nderived > 0:
+        all_features = sparse.hstack((all_features, derived_features), format='csr')
 
     # Return all transformed training and test features
     return all_features
@@ -1422,8 +1958,10 @@ def select_features(model):
 
     # Extract model parameters.
 
+    directory = model.specs['directory']
     fs_percentage = model.specs['fs_percentage']
     fs_score_func = model.specs['fs_score_func']
+    memory_map = model.specs['memory_map']
 
     # Select top features based on percentile.
 
@@ -1444,6 +1982,10 @@ def select_features(model):
 
     X_train_new = model.X_train[:, support]
     X_test_new = model.X_test[:, support]
+    if memory_map:
+        model_dir = SSEP.join([directory, 'model'])
+        X_train_new = np_memmap_data(X_train_new, model_dir, 'uni_train')
+        X_test_new = np_memmap_data(X_test_new, model_dir, 'uni_test')
 
     # Count the number of new features.
 
@@ -1566,10 +2108,17 @@ def create_interactions(model, X):
             model.feature_map['poly_support'] = support
         else:
             support = model.feature_map['poly_support']
-        pfeatures = get_polynomials(X[:, support], poly_degree)
+        pfeatures = X[:, support]
+        if sparse.issparse(pfeatures):
+            pfeatures = pfeatures.toarray()
+        pfeatures = get_polynomials(pfeatures, poly_degree)
         logger.info("Polynomial Feature Count : %d", pfeatures.shape[1])
-        pfeatures = StandardScaler().fit_transform(pfeatures)
-        all_features = np.hstack((all_features, pfeatures))
+        pfeatures = apply_transformer(model, 'poly_scaler', StandardScaler(),
+                                      pfeatures)
+        if sparse.issparse(all_features):
+            all_features = sparse.hstack((all_features, pfeatures), format='csr')
+        else:
+            all_features = np.hstack((all_features, pfeatures))
         logger.info("New Total Feature Count  : %d", all_features.shape[1])
     else:
         logger.info("Skipping Interactions")
@@ -1664,3 +2213,76 @@ def remove_lv_features(model, X):
         logger.info("Skipping Low-Variance Features")
 
     return X_reduced
+
+
+#
+# Function transform_features
+#
+
+def transform_features(model, X):
+    r"""Transform new data with the saved feature pipeline.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        Model object with the feature map from training.
+    X : pandas.DataFrame
+        The original features of the new data.
+
+    Returns
+    -------
+    all_features : numpy array or scipy.sparse.csr_matrix
+        The feature matrix for the predictor.
+
+    Notes
+    -----
+    The treatments, dropped features, base and derived features,
+    interactions, and support vectors are all applied as they were
+    in training, so that any subset of rows gets the same features.
+
+    """
+
+    # Extract model parameters
+
+    drop = model.specs['drop']
+    feature_selection = model.specs['feature_selection']
+    rfe = model.specs['rfe']
+
+    # Apply treatments to the feature matrix
+    all_features = apply_treatments(model, X)
+
+    # Drop features
+    all_features = drop_features(all_features, drop)
+
+    # Create initial features
+    all_features = create_features(model, all_features)
+
+    # Generate interactions
+    all_features = create_interactions(model, all_features)
+
+    # Remove low-variance features
+    all_features = remove_lv_features(model, all_features)
+
+    # Load the univariate support vector, if any
+
+    if feature_selection:
+        logger.info("Getting Univariate Support")
+        try:
+            support = model.feature_map['uni_support']
+            all_features = all_features[:, support]
+            logger.info("New Feature Count : %d", all_features.shape[1])
+        except:
+            logger.info("No Univariate Support")
+
+    # Load the RFE support vector, if any
+
+    if rfe:
+        logger.info("Getting RFE Support")
+        try:
+            support = model.feature_map['rfe_support']
+            all_features = all_features[:, support]
+            logger.info("New Feature Count : %d", all_features.shape[1])
+        except:
+            logger.info("No RFE Support")
+
+    return all_features
@@ -29,7 +29,10 @@
 from alphapy.globals import PSEP, SSEP, USEP
 from alphapy.globals import TAG_ID
 
+from collections import OrderedDict
+from importlib import import_module
 import logging
+import numpy as np
 import pandas as pd
 
 
@@ -128,13 +131,281 @@ class Frame(object):
         return frame_name(self.name, self.space)
 
 
+#
+# Define the default fields of a panel
+#
+
+panel_fields = ['open', 'high', 'low', 'close', 'volume']
+
+
+#
+# Class Panel
+#
+
+class Panel(object):
+    """Align the price frames of a group in a read-only array. All
+    panels are stored in ``Panel.panels``.
+
+    Parameters
+    ----------
+    name : str
+        Panel key, usually the group name.
+    space : alphapy.Space
+        Namespace of the price frames.
+    symbols : list
+        The symbols whose frames are in ``Frame.frames``.
+    fields : list, optional
+        The columns of the frames to store. The default fields
+        are in ``panel_fields``.
+
+    Attributes
+    ----------
+    panels : dict
+        Class variable for storing all known panels
+    dates : pandas.DatetimeIndex
+        The sorted union of the dates of all of the frames.
+    values : numpy array
+        The read-only prices with shape ``(symbols, dates, fields)``,
+        which are NaN where a frame has no row or column.
+    available : numpy array
+        ``True`` where the frame of a symbol has a row for a date.
+    sindex : dict
+        The row of each symbol.
+    dindex : dict
+        The column of each date.
+    findex : dict
+        The position of each field.
+    state : tuple
+        The ``frame_state`` of the frames when the panel was built.
+
+    Examples
+    --------
+
+    >>> panel = Panel('tech', Space('stock', 'prices', '1d'), ['AAPL', 'MSFT'])
+    >>> panel.get('AAPL', '2017-06-30', 'close')
+
+    """
+
+    # class variable to track all panels
+
+    panels = {}
+
+    # __init__
+
+    def __init__(self,
+                 name,
+                 space,
+                 symbols,
+                 fields = None):
+        # code
+        if fields is None:
+            fields = panel_fields
+        self.name = name
+        self.space = space
+        self.symbols = list(symbols)
+        self.fields = list(fields)
+        self.state = frame_state(self.symbols, space)
+        frames = []
+        for symbol in self.symbols:
+            fn = frame_name(symbol, space)
+            if fn in Frame.frames:
+                frames.append(Frame.frames[fn].df)
+            else:
+                logger.info("Frame %s not found for Panel", fn)
+                frames.append(None)
+        dates = [df.index.values for df in frames if df is not None]
+        self.dates = pd.DatetimeIndex(np.unique(np.concatenate(dates)) if dates else [])
+        shape = (len(self.symbols), len(self.dates), len(self.fields))
+        self.values = np.full(shape, np.nan)
+        self.available = np.zeros(shape[:2], dtype=bool)
+        for i, df in enumerate(frames):
+            if df is not None:
+                rows = self.dates.get_indexer(df.index)
+                self.available[i, rows] = True
+                for k, field in enumerate(self.fields):
+                    if field in df.columns:
+                        self.values[i, rows, k] = df[field].values
+        self.values.setflags(write=False)
+        self.available.setflags(write=False)
+        self.sindex = {symbol : i for i, symbol in enumerate(self.symbols)}
+        self.dindex = {tdate : j for j, tdate in enumerate(self.dates)}
+        self.findex = {field : k for k, field in enumerate(self.fields)}
+        # add panel to panels list
+        Panel.panels[frame_name(name, space)] = self
+
+    # __str__
+
+    def __str__(self):
+        return frame_name(self.name, self.space)
+
+    # date_loc
+
+    def date_loc(self, tdate):
+        r"""Get the column of a date, or -1 if it is not in the panel."""
+        j = self.dindex.get(tdate)
+        if j is None:
+            try:
+                j = self.dindex.get(pd.Timestamp(tdate), -1)
+            except ValueError:
+                j = -1
+        return j
+
+    # get
+
+    def get(self, symbol, tdate, field='close'):
+        r"""Get the value of a field for a symbol on a date.
+
+        Parameters
+        ----------
+        symbol : str
+            The symbol of the frame.
+        tdate : datetime or str
+            The date of the row.
+        field : str, optional
+            The column of the frame.
+
+        Returns
+        -------
+        value : float
+            The value, or ``None`` if the frame of the symbol has
+            no row for the date.
+
+        """
+        i = self.sindex[symbol]
+        j = self.date_loc(tdate)
+        if j < 0 or not self.available[i, j]:
+            return None
+        return float(self.values[i, j, self.findex[field]])
+
+    # field
+
+    def field(self, field):
+        r"""Get a field for all symbols and dates as a 2D array."""
+        return self.values[:, :, self.findex[field]]
+
+    # align
+
+    def align(self, symbols, dates, field='close'):
+        r"""Align a field of several symbols on other dates.
+
+        Parameters
+        ----------
+        symbols : list
+            The symbols of the rows.
+        dates : pandas.DatetimeIndex
+            The dates of the columns, e.g., calendar days.
+        field : str, optional
+            The column of the frames.
+
+        Returns
+        -------
+        prices : numpy array
+            The ``field`` value of each symbol on each date, with
+            shape ``(len(symbols), len(dates))``.
+        available : numpy array
+            ``True`` where the frame of the symbol has a row
+            for the date.
+
+        """
+        rows = [self.sindex[symbol] for symbol in symbols]
+        cols = self.dates.get_indexer(dates)
+        found = cols >= 0
+        prices = np.full((len(rows), len(cols)), np.nan)
+        available = np.zeros((len(rows), len(cols)), dtype=bool)
+        values = self.field(field)
+        prices[:, found] = values[rows][:, cols[found]]
+        available[:, found] = self.available[rows][:, cols[found]]
+        return prices, available
+
+
+#
+# Function frame_state
+#
+
+def frame_state(symbols, space):
+    r"""Summarize the current frames of some symbols.
+
+    Parameters
+    ----------
+    symbols : list
+        The symbols of the frames.
+    space : alphapy.Space
+        Namespace of the frames.
+
+    Returns
+    -------
+    state : tuple
+        For each symbol, ``None`` if it has no frame, or else the
+        identity, shape, and first and last dates of its frame.
+
+    """
+    state = []
+    for symbol in symbols:
+        fn = frame_name(symbol, space)
+        if fn in Frame.frames:
+            df = Frame.frames[fn].df
+            dates = (df.index[0], df.index[-1]) if len(df.index) else None
+            state.append((id(df), df.shape, dates))
+        else:
+            state.append(None)
+    return tuple(state)
+
+
+#
+# Function get_panel
+#
+
+def get_panel(name, space, symbols, fields=None):
+    r"""Get the panel of a group, building it if necessary.
+
+    Parameters
+    ----------
+    name : str
+        Panel key, usually the group name.
+    space : alphapy.Space
+        Namespace of the price frames.
+    symbols : list
+        The symbols of the panel.
+    fields : list, optional
+        The columns of the frames in the panel.
+
+    Returns
+    -------
+    panel : alphapy.Panel
+        The existing panel if it has all of the ``symbols`` and
+        ``fields`` and its frames have not changed, or else a new panel.
+
+    Notes
+    -----
+    A frame has changed if it was added, removed, or replaced in
+    ``Frame.frames``, or if its shape or its first or last date
+    changed. Prices edited in place are not detected, so delete
+    the panel from ``Panel.panels`` after editing them.
+
+    """
+    if fields is None:
+        fields = panel_fields
+    panel = Panel.panels.get(frame_name(name, space))
+    if panel is None or not set(symbols).issubset(panel.sindex) \
+       or not set(fields).issubset(panel.findex) \
+       or panel.state != frame_state(panel.symbols, space):
+        logger.info("Building Panel for %s", name)
+        panel = Panel(name, space, symbols, fields)
+    return panel
+
+
 #
 # Function read_frame
 #
 
 def read_frame(directory, filename, extension, separator,
-               index_col=None, squeeze=False):
-    r"""Read a delimiter-separated file into a data frame.
+               index_col=None, squeeze=False, columns=None):
+    r"""Read a file into a data frame.
+
+    The storage format is selected by the ``extension``. The formats
+    ``parquet`` and ``feather`` are Apache Arrow files, ``npy`` is a
+    NumPy structured array, and any other extension is read as a
+    delimiter-separated text file.
 
     Parameters
     ----------
@@ -146,10 +417,14 @@ def read_frame(directory, filename, extension, separator,
         File name extension, e.g., ``csv``.
     separator : str
         The delimiter between fields in the file.
-    index_col : str, optional
-        Column to use as the row labels in the dataframe.
+    index_col : str or int, optional
+        Column to use as the row labels in the dataframe, either by
+        name or by its position in the file.
     squeeze : bool, optional
         If the data contains only one column, then return a pandas Series.
+    columns : list, optional
+        The subset of columns to read. The ``index_col`` is read
+        even if it is not in this list.
 
     Returns
     -------
@@ -162,21 +437,70 @@ def read_frame(directory, filename, extension, separator,
     file_all = SSEP.join([directory, file_only])
     logger.info("Loading data from %s", file_all)
     try:
-        df = pd.read_csv(file_all, sep=separator, index_col=index_col,
-                         squeeze=squeeze)
+        if columns is not None and index_col is not None:
+            if not isinstance(index_col, str):
+                # map the position in the file before projecting
+                index_col = read_names(file_all, extension, separator)[index_col]
+            if index_col not in columns:
+                columns = [index_col] + list(columns)
+        if extension in frame_readers:
+            df = frame_readers[extension](file_all, columns)
+        else:
+            df = pd.read_csv(file_all, sep=separator, usecols=columns)
+        if index_col is not None:
+            if not isinstance(index_col, str):
+                index_col = df.columns[index_col]
+            df = df.set_index(index_col)
+        if squeeze and df.shape[1] == 1:
+            df = df.iloc[:, 0]
+    except ImportError:
+        df = None
+        logger.info("Install alphapy[arrow] to read %s files", extension)
     except:
         df = None
         logger.info("Could not find or access %s", file_all)
     return df
 
 
+#
+# Function read_names
+#
+
+def read_names(file_all, extension, separator):
+    r"""Read the column names of a file without reading its rows.
+
+    Parameters
+    ----------
+    file_all : str
+        Full path of the file.
+    extension : str
+        File name extension, e.g., ``csv``.
+    separator : str
+        The delimiter between fields in the file.
+
+    Returns
+    -------
+    names : list
+        The column names in file order.
+
+    """
+    if extension in frame_headers:
+        names = frame_headers[extension](file_all)
+    else:
+        names = pd.read_csv(file_all, sep=separator, nrows=0).columns
+    return list(names)
+
+
 #
 # Function write_frame
 #
 
 def write_frame(df, directory, filename, extension, separator,
                 index=False, index_label=None, columns=None):
-    r"""Write a dataframe into a delimiter-separated file.
+    r"""Write a dataframe into a file.
+
+    The storage format is selected by the ``extension``, as
+    described in ``read_frame``.
 
     Parameters
     ----------
@@ -206,12 +530,255 @@ def write_frame(df, directory, filename, extension, separator,
     file_all = SSEP.join([directory, file_only])
     logger.info("Writing data frame to %s", file_all)
     try:
-        df.to_csv(file_all, sep=separator, index=index,
-                  index_label=index_label, columns=columns)
+        if extension in frame_writers:
+            frame_writers[extension](table_frame(df, index, index_label, columns),
+                                     file_all)
+        else:
+            df.to_csv(file_all, sep=separator, index=index,
+                      index_label=index_label, columns=columns)
+    except ImportError:
+        logger.info("Install alphapy[arrow] to write %s files", extension)
     except:
         logger.info("Could not write data frame to %s", file_all)
 
 
+#
+# Function table_frame
+#
+
+def table_frame(df, index=False, index_label=None, columns=None):
+    r"""Prepare a dataframe for a columnar file.
+
+    Columnar formats store only columns, so the index is written
+    as one or more leading columns, just as in a text file.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The pandas dataframe to save to a file.
+    index : bool, optional
+        If ``True``, write the row names (index).
+    index_label : str, optional
+        A column label for the ``index``.
+    columns : str, optional
+        A list of column names.
+
+    Returns
+    -------
+    tf : pandas.DataFrame
+        The dataframe with a default index and string column names.
+
+    """
+    tf = df if columns is None else df[columns]
+    if isinstance(tf, pd.Series):
+        tf = tf.to_frame()
+    if index:
+        nlevels = tf.index.nlevels
+        tf = tf.reset_index()
+        if index_label is not None:
+            labels = [index_label] if isinstance(index_label, str) else list(index_label)
+            names = list(tf.columns)
+            names[:min(nlevels, len(labels))] = labels[:nlevels]
+            tf.columns = names
+    else:
+        tf = tf.reset_index(drop=True)
+    tf.columns = [str(c) for c in tf.columns]
+    return tf
+
+
+#
+# Define the kinds of values in the object columns of a NumPy file
+#
+
+npy_kinds = ['missing', 'str', 'int', 'float', 'bool']
+NPY_MISSING, NPY_STR, NPY_INT, NPY_FLOAT, NPY_BOOL = range(len(npy_kinds))
+
+
+#
+# Function npy_encode
+#
+
+def npy_encode(series):
+    r"""Encode an object column as strings and the kind of each value.
+
+    Parameters
+    ----------
+    series : pandas.Series
+        The object column.
+
+    Returns
+    -------
+    strings : numpy array
+        The text of each value, or an empty string if it is missing.
+    kinds : numpy array
+        The kind of each value, an index into ``npy_kinds``.
+
+    Notes
+    -----
+    Values of any other type are stored as strings.
+
+    """
+    missing = np.asarray(pd.isnull(series))
+    if pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+        strings = np.asarray(series.where(~missing, '').astype(str), dtype=str)
+        kinds = np.where(missing, NPY_MISSING, NPY_STR).astype('u1')
+        return strings, kinds
+    strings = []
+    kinds = np.empty(len(series), dtype='u1')
+    for i, x in enumerate(series):
+        if missing[i]:
+            kinds[i] = NPY_MISSING
+            x = ''
+        elif isinstance(x, (bool, np.bool_)):
+            kinds[i] = NPY_BOOL
+        elif isinstance(x, (int, np.integer)):
+            kinds[i] = NPY_INT
+        elif isinstance(x, (float, np.floating)):
+            kinds[i] = NPY_FLOAT
+            x = repr(float(x))
+        else:
+            kinds[i] = NPY_STR
+        strings.append(str(x))
+    return np.asarray(strings, dtype=str), kinds
+
+
+#
+# Function npy_decode
+#
+
+def npy_decode(strings, kinds):
+    r"""Decode an object column from its strings and kinds.
+
+    Parameters
+    ----------
+    strings : numpy array
+        The text of each value.
+    kinds : numpy array
+        The kind of each value, an index into ``npy_kinds``.
+
+    Returns
+    -------
+    values : numpy array
+        The object column, with ``NaN`` for the missing values.
+
+    """
+    values = np.empty(len(strings), dtype=object)
+    values[:] = strings
+    values[kinds == NPY_MISSING] = np.nan
+    for kind, convert in [(NPY_INT, int), (NPY_FLOAT, float),
+                          (NPY_BOOL, lambda x: x == 'True')]:
+        for i in np.flatnonzero(kinds == kind):
+            values[i] = convert(strings[i])
+    return values
+
+
+#
+# Function read_npy
+#
+
+def read_npy(file_all, columns=None):
+    r"""Read a NumPy structured array into a data frame.
+
+    Parameters
+    ----------
+    file_all : str
+        Full path of the file.
+    columns : list, optional
+        The subset of columns to read.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        The dataframe, with the object columns decoded by ``npy_decode``.
+
+    Notes
+    -----
+    In files from earlier versions, the object columns are plain
+    strings, and empty strings are read as missing values.
+
+    """
+    records = np.load(file_all, mmap_mode='r', allow_pickle=False)
+    names = list(records.dtype.names) if columns is None else list(columns)
+    data = OrderedDict()
+    for c in names:
+        field = records[c]
+        if field.dtype.names:
+            data[c] = npy_decode(np.array(field['value']), np.array(field['kind']))
+        elif field.dtype.kind == 'U':
+            data[c] = pd.Series(np.array(field)).replace('', np.nan).values
+        else:
+            data[c] = np.array(field)
+    return pd.DataFrame(data, columns=names)
+
+
+#
+# Function write_npy
+#
+
+def write_npy(df, file_all):
+    r"""Write a data frame into a NumPy structured array.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The dataframe with a default index.
+    file_all : str
+        Full path of the file.
+
+    Returns
+    -------
+    None : None
+
+    Notes
+    -----
+    Object columns are stored as a pair of fields, the value as a
+    fixed-width string and its kind, so the file can be loaded
+    without unpickling. The kind separates missing values from
+    empty strings and restores numbers and Booleans in columns
+    of mixed types.
+
+    """
+    arrays = []
+    for c in df.columns:
+        values = np.asarray(df[c])
+        if values.dtype.kind not in 'biufcmM':
+            values = npy_encode(df[c])
+        arrays.append(values)
+    dtype = []
+    for c, a in zip(df.columns, arrays):
+        if isinstance(a, tuple):
+            dtype.append((c, [('value', a[0].dtype), ('kind', a[1].dtype)]))
+        else:
+            dtype.append((c, a.dtype))
+    records = np.empty(df.shape[0], dtype=dtype)
+    for c, a in zip(df.columns, arrays):
+        if isinstance(a, tuple):
+            records[c]['value'], records[c]['kind'] = a
+        else:
+            records[c] = a
+    np.save(file_all, records, allow_pickle=False)
+
+
+#
+# Define the readers and writers for each columnar file extension.
+#
+
+frame_readers = {'feather' : lambda f, columns: pd.read_feather(f, columns=columns) \
+                                 if columns is not None else pd.read_feather(f),
+                 'npy'     : read_npy,
+                 'parquet' : lambda f, columns: pd.read_parquet(f, columns=columns)}
+
+frame_headers = {'feather' : lambda f: import_module('pyarrow.feather') \
+                                 .read_table(f, memory_map=True).schema.names,
+                 'npy'     : lambda f: np.load(f, mmap_mode='r').dtype.names,
+                 'parquet' : lambda f: import_module('pyarrow.parquet') \
+                                 .read_schema(f).names}
+
+frame_writers = {'feather' : lambda df, f: df.to_feather(f),
+                 'npy'     : write_npy,
+                 'parquet' : lambda df, f: df.to_parquet(f, index=False)}
+
+
 #
 # Function load_frames
 #
@@ -31,19 +31,25 @@ from alphapy.analysis import Analysis
 from alphapy.analysis import run_analysis
 from alphapy.data import get_market_data
 from alphapy.globals import PD_INTRADAY_OFFSETS
-from alphapy.globals import PSEP, SSEP
+from alphapy.globals import PSEP, SSEP, USEP
 from alphapy.group import Group
 from alphapy.market_variables import Variable
 from alphapy.market_variables import vmapply
+from alphapy.market_variables import vload
+from alphapy.market_variables import vmextend
+from alphapy.market_variables import vsave
 from alphapy.model import get_model_config
 from alphapy.model import Model
 from alphapy.portfolio import gen_portfolio
+from alphapy.sweep import sweep_system
 from alphapy.space import Space
 from alphapy.system import run_system
 from alphapy.system import System
+from alphapy.utilities import get_worker_count
 from alphapy.utilities import valid_date
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import datetime
 import logging
 import os
@@ -104,6 +110,10 @@ def get_market_config():
     specs['data_fractal'] = fractal
     specs['data_history'] = cfg['market']['data_history']
     specs['forecast_period'] = cfg['market']['forecast_period']
+    try:
+        specs['incremental'] = cfg['market']['incremental']
+    except:
+        specs['incremental'] = False
     fractal = cfg['market']['fractal']
     try:
         test_interval = pd.to_timedelta(fractal)
@@ -116,6 +126,10 @@ def get_market_config():
     specs['predict_history'] = cfg['market']['predict_history']
     specs['schema'] = cfg['market']['schema']
     specs['subject'] = cfg['market']['subject']
+    try:
+        specs['symbol_jobs'] = cfg['market']['symbol_jobs']
+    except:
+        specs['symbol_jobs'] = 1
     specs['target_group'] = cfg['market']['target_group']
 
     # Create the subject/schema/fractal namespace
@@ -160,6 +174,24 @@ def get_market_config():
         logger.info("No System Parameters Found")
         specs['system'] = {}
 
+    # Section: portfolio
+
+    try:
+        logger.info("Getting Portfolio Parameters")
+        specs['portfolio'] = cfg['portfolio']
+    except:
+        logger.info("No Portfolio Parameters Found")
+        specs['portfolio'] = {}
+
+    # Section: sweep
+
+    try:
+        logger.info("Getting Sweep Parameters")
+        specs['sweep'] = cfg['sweep']
+    except:
+        logger.info("No Sweep Parameters Found")
+        specs['sweep'] = {}
+
     # Section: variables
 
     logger.info("Defining AlphaPy Variables [phigh, plow]")
@@ -192,11 +224,15 @@ def get_market_config():
     logger.info('features        = %s', specs['features'])
     logger.info('forecast_period = %d', specs['forecast_period'])
     logger.info('fractal         = %s', specs['fractal'])
+    logger.info('incremental     = %r', specs['incremental'])
     logger.info('lag_period      = %d', specs['lag_period'])
     logger.info('leaders         = %s', specs['leaders'])
+    logger.info('portfolio       = %s', specs['portfolio'])
     logger.info('predict_history = %s', specs['predict_history'])
     logger.info('schema          = %s', specs['schema'])
     logger.info('subject         = %s', specs['subject'])
+    logger.info('sweep           = %s', specs['sweep'])
+    logger.info('symbol_jobs     = %d', specs['symbol_jobs'])
     logger.info('system          = %s', specs['system'])
     logger.info('target_group    = %s', specs['target_group'])
 
@@ -249,9 +285,11 @@ def market_pipeline(model, market_specs):
     forecast_period = market_specs['forecast_period']
     fractal = market_specs['fractal']
     functions = market_specs['functions']
+    incremental = market_specs['incremental']
     lag_period = market_specs['lag_period']
     leaders = market_specs['leaders']
     predict_history = market_specs['predict_history']
+    symbol_jobs = market_specs['symbol_jobs']
     target_group = market_specs['target_group']
 
     # Set the target group
@@ -277,8 +315,26 @@ def market_pipeline(model, market_specs):
 
     if create_model:
         # apply features to all of the frames
-        vmapply(group, features, functions)
-        vmapply(group, [target], functions)
+        nworkers = get_worker_count(symbol_jobs, len(group.members))
+        directory = model.specs['directory']
+        plans_name = PSEP.join([USEP.join(['plans', group.name]), 'pkl'])
+        plans_file = SSEP.join([directory, 'data', plans_name])
+        vload(plans_file)
+        if incremental:
+            # extend the features from the previous run
+            cache_name = PSEP.join([USEP.join(['variables', group.name]), 'pkl'])
+            cache_file = SSEP.join([directory, 'data', cache_name])
+            vcache = pd.read_pickle(cache_file) if os.path.isfile(cache_file) else {}
+            vcache = vmextend(group, list(features) + [target], functions, vcache)
+            pd.to_pickle(vcache, cache_file)
+        elif nworkers > 1:
+            with ProcessPoolExecutor(max_workers=nworkers) as executor:
+                vmapply(group, features, functions, executor)
+                vmapply(group, [target], functions, executor)
+        else:
+            vmapply(group, features, functions)
+            vmapply(group, [target], functions)
+        vsave(plans_file)
         # run the analysis, including the model pipeline
         a = Analysis(model, group)
         results = run_analysis(a, lag_period, forecast_period,
@@ -306,9 +362,25 @@ def market_pipeline(model, market_specs):
         # create and run the system
         system = System(system_name, longentry, shortentry,
                         longexit, shortexit, holdperiod, scale)
-        tfs = run_system(model, system, group, intraday)
-        # generate a portfolio
-        gen_portfolio(model, system_name, group, tfs)
+        sweep_specs = market_specs['sweep']
+        if sweep_specs:
+            # backtest a grid of the system parameters
+            sweep_system(model, system, group, sweep_specs['grid'], intraday,
+                         periods=sweep_specs.get('periods', 252),
+                         chunk_size=sweep_specs.get('chunk_size', 256),
+                         n_jobs=symbol_jobs)
+        else:
+            tfs = run_system(model, system, group, intraday,
+                             n_jobs=symbol_jobs)
+            # generate a portfolio
+            portfolio_specs = market_specs['portfolio']
+            gen_portfolio(model, system_name, group, tfs,
+                          rebalance=portfolio_specs.get('rebalance'),
+                          maxpos=portfolio_specs.get('maxpos'),
+                          kopos=portfolio_specs.get('kopos', 0),
+                          koby=portfolio_specs.get('koby', '-profit'),
+                          weightby=portfolio_specs.get('weightby'),
+                          maxloss=portfolio_specs.get('maxloss'))
 
     # Return the completed model
     return model
@@ -45,6 +45,7 @@
 # Imports
 #
 
+from alphapy.alias import Alias
 from alphapy.alias import get_alias
 from alphapy.frame import Frame
 from alphapy.frame import frame_name
@@ -52,9 +53,14 @@ from alphapy.globals import BSEP, LOFF, ROFF, USEP
 from alphapy.utilities import valid_name
 
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 from importlib import import_module
+import inspect
+import json
 import logging
 import numpy as np
+import os
 import pandas as pd
 import parser
 import re
@@ -90,6 +96,11 @@ class Variable(object):
     ----------
     variables : dict
         Class variable for storing all known variables
+    plans : dict
+        Class variable for storing compiled variable plans
+    used : set
+        Class variable for storing the keys of the plans used
+        in this run
 
     Examples
     --------
@@ -102,6 +113,8 @@ class Variable(object):
     # class variable to track all variables
 
     variables = {}
+    plans = {}
+    used = set()
 
     # function __new__
 
@@ -352,6 +365,137 @@ def vsub(v, expr):
     return newexpr
 
     
+#
+# Function vfunction
+#
+
+def vfunction(func_name, vfuncs=None):
+    r"""Find the function that computes a variable.
+
+    Parameters
+    ----------
+    func_name : str
+        The name of the variable function.
+    vfuncs : dict, optional
+        Dictionary of external modules and functions.
+
+    Returns
+    -------
+    func : function
+        The external or local variable function, or ``None``
+        if the function could not be found.
+
+    """
+    # Find the module and function
+    module = None
+    if vfuncs:
+        for m in vfuncs:
+            funcs = vfuncs[m]
+            if func_name in funcs:
+                module = m
+                break
+    # If the module was found, import the external treatment function,
+    # else search the local namespace.
+    func = None
+    if module:
+        ext_module = import_module(module)
+        func = getattr(ext_module, func_name)
+    else:
+        modname = globals()['__name__']
+        module = sys.modules[modname]
+        if func_name in dir(module):
+            func = getattr(module, func_name)
+    return func
+
+
+#
+# Function vnode
+#
+
+def vnode(v, vfuncs=None):
+    r"""Compile a variable into a node of an execution plan.
+
+    All of the parsing for a variable happens here, so that applying
+    the node to a dataframe requires no further string processing.
+
+    Parameters
+    ----------
+    v : str
+        Variable to compile.
+    vfuncs : dict, optional
+        Dictionary of external modules and functions.
+
+    Returns
+    -------
+    node : tuple
+        The variable name, the name without the lag, the lag,
+        the substituted expression for a defined variable, and
+        the function and its parameter list for a function call.
+
+    Other Parameters
+    ----------------
+    Variable.variables : dict
+        Global dictionary of variables
+
+    """
+    vxlag, root, plist, lag = vparse(v)
+    expr = None
+    func = None
+    args = []
+    if root in Variable.variables:
+        expr = vsub(vxlag, Variable.variables[root].expr)
+    else:
+        # Must be a function call, so convert the parameter list
+        for p in plist:
+            try:
+                args.append(int(p))
+            except:
+                try:
+                    args.append(float(p))
+                except:
+                    args.append(p)
+        func = vfunction(root, vfuncs)
+        if func is None:
+            logger.debug("Could not find function %s", root)
+    return v, vxlag, lag, expr, func, args
+
+
+#
+# Function vnexec
+#
+
+def vnexec(f, node):
+    r"""Add a compiled variable to the given dataframe.
+
+    Parameters
+    ----------
+    f : pandas.DataFrame
+        Dataframe to contain the new variable.
+    node : tuple
+        The compiled variable from ``vnode``.
+
+    Returns
+    -------
+    f : pandas.DataFrame
+        Dataframe with the new variable.
+
+    """
+    v, vxlag, lag, expr, func, args = node
+    if vxlag not in f.columns:
+        if expr is not None:
+            logger.debug("Expression: %s", expr)
+            # pandas eval
+            f[vxlag] = f.eval(expr)
+        elif func is not None:
+            # Create the variable by calling the function
+            f[v] = func(f, *args)
+    # if necessary, add the lagged variable
+    if lag > 0 and vxlag in f.columns:
+        f[v] = f[vxlag].shift(lag)
+    # output frame
+    return f
+
+
 #
 # Function vexec
 #
@@ -390,65 +534,203 @@ def vexec(f, v, vfuncs=None):
         Global dictionary of variables
 
     """
-    vxlag, root, plist, lag = vparse(v)
     logger.debug("vexec : %s", v)
-    logger.debug("vxlag : %s", vxlag)
-    logger.debug("root  : %s", root)
-    logger.debug("plist : %s", plist)
-    logger.debug("lag   : %s", lag)
-    if vxlag not in f.columns:
-        if root in Variable.variables:
-            logger.debug("Found variable %s: ", root)
-            vroot = Variable.variables[root]
-            expr = vroot.expr
-            expr_new = vsub(vxlag, expr)
-            estr = "%s" % expr_new
-            logger.debug("Expression: %s", estr)
-            # pandas eval
-            f[vxlag] = f.eval(estr)
+    return vnexec(f, vnode(v, vfuncs))
+
+
+#
+# Function vcompile
+#
+
+def vcompile(vs, vfuncs=None):
+    r"""Compile a list of variables into an execution plan.
+
+    The antecedents of every variable are collected into a single
+    dependency graph in topological order, so a shared variable such
+    as ``atr_10`` appears in the plan only once, no matter how many
+    features depend on it.
+
+    Parameters
+    ----------
+    vs : list
+        The list of variables to compile.
+    vfuncs : dict, optional
+        Dictionary of external modules and functions.
+
+    Returns
+    -------
+    plan : list
+        The compiled nodes in execution order.
+
+    Other Parameters
+    ----------------
+    Variable.plans : dict
+        Global dictionary of compiled plans
+
+    Notes
+    -----
+    Plans are cached under a hash of the variable list and the current
+    variable, alias, and function definitions, so a plan is only
+    recompiled when one of its definitions changes. A plan holds only
+    strings, numbers, and module-level functions, so the cache can be
+    saved with ``vsave`` and reloaded by a later run with ``vload``.
+
+    """
+    key = vkey(vs, vfuncs)
+    Variable.used.add(key)
+    if key in Variable.plans:
+        return Variable.plans[key]
+    allv = OrderedDict()
+    for v in vs:
+        for av in vtree(v):
+            allv[av] = None
+    plan = [vnode(v, vfuncs) for v in allv]
+    logger.info("Compiled %d variables into a plan of %d nodes", len(vs), len(plan))
+    Variable.plans[key] = plan
+    return plan
+
+
+#
+# Function vkey
+#
+
+def vkey(vs, vfuncs=None):
+    r"""Hash a variable list and its definitions into a plan key.
+
+    Parameters
+    ----------
+    vs : list
+        The list of variables to compile.
+    vfuncs : dict, optional
+        Dictionary of external modules and functions.
+
+    Returns
+    -------
+    key : str
+        The SHA-1 hex digest of the variables, the variable and
+        alias definitions, and the external functions.
+
+    """
+    variables, aliases = vstate()
+    content = json.dumps([list(vs), variables, aliases, vfuncs],
+                         sort_keys=True, default=str)
+    key = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    return key
+
+
+#
+# Function vload
+#
+
+def vload(file_path):
+    r"""Load the compiled plans of a previous run.
+
+    Parameters
+    ----------
+    file_path : str
+        The pickle file written by ``vsave``.
+
+    Returns
+    -------
+    nplans : int
+        The number of plans loaded.
+
+    Other Parameters
+    ----------------
+    Variable.plans : dict
+        Global dictionary of compiled plans
+
+    Notes
+    -----
+    A plan refers to its functions by module and name, so a file that
+    cannot be unpickled, e.g., after an external function was renamed,
+    is ignored and the plans are compiled again. A file saved with
+    other variable or alias definitions is deleted, because none of
+    its plans can be used.
+
+    """
+    nplans = 0
+    if os.path.isfile(file_path):
+        try:
+            saved = pd.read_pickle(file_path)
+            defs, plans = saved['defs'], saved['plans']
+        except Exception as e:
+            logger.info("Could not load plans from %s: %s", file_path, e)
+            return nplans
+        if defs != vkey([]):
+            logger.info("Variable definitions changed, so deleting %s", file_path)
+            os.remove(file_path)
         else:
-            logger.debug("Did not find variable: %s", root)
-            # Must be a function call
-            func_name = root
-            # Convert the parameter list and prepend the data frame
-            newlist = []
-            for p in plist:
-                try:
-                    newlist.append(int(p))
-                except:
-                    try:
-                        newlist.append(float(p))
-                    except:
-                        newlist.append(p)
-            newlist.insert(0, f)
-            # Find the module and function
-            module = None
-            if vfuncs:
-                for m in vfuncs:
-                    funcs = vfuncs[m]
-                    if func_name in funcs:
-                        module = m
-                        break
-            # If the module was found, import the external treatment function,
-            # else search the local namespace.
-            if module:
-                ext_module = import_module(module)
-                func = getattr(my_module, func_name)
-                # Create the variable by calling the function
-                f[v] = func(*newlist)
-            else:
-                modname = globals()['__name__']
-                module = sys.modules[modname]
-                if func_name in dir(module):
-                    func = getattr(module, func_name)
-                    # Create the variable
-                    f[v] = func(*newlist)
-                else:
-                    logger.debug("Could not find function %s", func_name)
-    # if necessary, add the lagged variable
-    if lag > 0 and vxlag in f.columns:
-        f[v] = f[vxlag].shift(lag)
-    # output frame
+            Variable.plans.update(plans)
+            nplans = len(plans)
+            logger.info("Loaded %d plans from %s", nplans, file_path)
+    return nplans
+
+
+#
+# Function vsave
+#
+
+def vsave(file_path):
+    r"""Save the compiled plans of this run for the next run.
+
+    Parameters
+    ----------
+    file_path : str
+        The pickle file to write.
+
+    Returns
+    -------
+    nplans : int
+        The number of plans saved.
+
+    Other Parameters
+    ----------------
+    Variable.plans : dict
+        Global dictionary of compiled plans
+    Variable.used : set
+        The keys of the plans used in this run
+
+    Notes
+    -----
+    Only the plans used in this run are saved, so the file does not
+    grow with plans of old feature lists. The plans are saved along
+    with the key of the variable and alias definitions, i.e., the key
+    of an empty variable list, which ``vload`` checks.
+
+    """
+    plans = {k : Variable.plans[k] for k in Variable.used if k in Variable.plans}
+    pd.to_pickle({'defs' : vkey([]), 'plans' : plans}, file_path)
+    return len(plans)
+
+
+#
+# Function vrun
+#
+
+def vrun(f, plan, vdefs=None):
+    r"""Execute a compiled plan on a dataframe.
+
+    Parameters
+    ----------
+    f : pandas.DataFrame
+        Dataframe to contain the new variables.
+    plan : list
+        The compiled nodes from ``vcompile``.
+    vdefs : tuple, optional
+        Variable definitions from ``vstate`` to restore when
+        running in a worker process.
+
+    Returns
+    -------
+    f : pandas.DataFrame
+        Dataframe with the new variables.
+
+    """
+    if vdefs:
+        vrestore(vdefs)
+    for node in plan:
+        f = vnexec(f, node)
     return f
 
 
@@ -482,30 +764,14 @@ def vapply(group, vname, vfuncs=None):
     vunapply
 
     """
-    # get all frame names to apply variables
-    gnames = [item.lower() for item in group.members]
-    # get all the precedent variables
-    allv = vtree(vname)
-    # apply the variables to each frame
-    for g in gnames:
-        fname = frame_name(g, group.space)
-        if fname in Frame.frames:
-            f = Frame.frames[fname].df
-            if not f.empty:
-                for v in allv:
-                    logger.debug("Applying variable %s to %s", v, g)
-                    f = vexec(f, v, vfuncs)
-            else:
-                logger.debug("Frame for %s is empty", g)
-        else:
-            logger.debug("Frame not found: %s", fname)
+    vmapply(group, [vname], vfuncs)
                 
 
 #
 # Function vmapply
 #
 
-def vmapply(group, vs, vfuncs=None):
+def vmapply(group, vs, vfuncs=None, executor=None):
     r"""Apply multiple variables to multiple dataframes.
 
     Parameters
@@ -516,11 +782,25 @@ def vmapply(group, vs, vfuncs=None):
         The list of variables to apply to the ``group``.
     vfuncs : dict, optional
         Dictionary of external modules and functions.
+    executor : concurrent.futures.Executor, optional
+        A thread or process pool for applying the variables to many
+        frames at once. By default, the frames are processed serially.
 
     Returns
     -------
     None : None
 
+    Other Parameters
+    ----------------
+    Frame.frames : dict
+        Global dictionary of dataframes
+
+    Notes
+    -----
+    A process pool receives a copy of each frame along with the
+    variable definitions, so the returned frames replace the ones
+    in ``Frame.frames``.
+
     See Also
     --------
     vmunapply
@@ -528,7 +808,31 @@ def vmapply(group, vs, vfuncs=None):
     """
     for v in vs:
         logger.info("Applying variable: %s", v)
-        vapply(group, v, vfuncs)
+    # compile the variables once for all frames
+    plan = vcompile(vs, vfuncs)
+    # get all frame names to apply variables
+    gnames = [item.lower() for item in group.members]
+    fnames = []
+    for g in gnames:
+        fname = frame_name(g, group.space)
+        if fname in Frame.frames:
+            if not Frame.frames[fname].df.empty:
+                fnames.append(fname)
+            else:
+                logger.debug("Frame for %s is empty", g)
+        else:
+            logger.debug("Frame not found: %s", fname)
+    # apply the plan to each frame
+    if executor:
+        vdefs = vstate() if isinstance(executor, ProcessPoolExecutor) else None
+        futures = [executor.submit(vrun, Frame.frames[fname].df, plan, vdefs)
+                   for fname in fnames]
+        for fname, future in zip(fnames, futures):
+            Frame.frames[fname].df = future.result()
+    else:
+        for fname in fnames:
+            logger.debug("Applying plan to %s", fname)
+            vrun(Frame.frames[fname].df, plan)
 
         
 #
@@ -604,6 +908,488 @@ def vmunapply(group, vs):
         vunapply(group, v)
 
 
+#
+# Function vstate
+#
+
+def vstate():
+    r"""Capture the variable and alias definitions.
+
+    Worker processes do not share the class registries of the parent
+    process, so the definitions are captured as plain dictionaries
+    that can be shipped along with each task.
+
+    Returns
+    -------
+    state : tuple
+        The dictionary of variable expressions and the dictionary
+        of alias expressions.
+
+    Other Parameters
+    ----------------
+    Variable.variables : dict
+        Global dictionary of variables
+    Alias.aliases : dict
+        Global dictionary of aliases
+
+    See Also
+    --------
+    vrestore
+
+    """
+    variables = OrderedDict((k, v.expr) for k, v in Variable.variables.items())
+    aliases = OrderedDict(Alias.aliases.items())
+    return variables, aliases
+
+
+#
+# Function vrestore
+#
+
+def vrestore(state):
+    r"""Restore the variable and alias definitions in a worker process.
+
+    Parameters
+    ----------
+    state : tuple
+        The definitions captured by ``vstate``.
+
+    Returns
+    -------
+    None : None
+
+    See Also
+    --------
+    vstate
+
+    """
+    variables, aliases = state
+    for name, expr in aliases.items():
+        if name not in Alias.aliases:
+            Alias(name, expr)
+    for name, expr in variables.items():
+        if name not in Variable.variables:
+            Variable(name, expr)
+
+
+#
+# Function vewm
+#
+
+def vewm(x, p, state=None):
+    r"""Calculate an exponentially weighted mean from a saved state.
+
+    This is the same recursion as ``pandas.Series.ewm(span=p).mean()``,
+    so new values can be appended to an existing mean without
+    recalculating the entire series.
+
+    Parameters
+    ----------
+    x : numpy array
+        The new input values.
+    p : int
+        The span of the exponential window.
+    state : tuple, optional
+        The state returned by the previous call. If ``None``, the
+        mean starts with the first value of ``x``.
+
+    Returns
+    -------
+    values : numpy array
+        The exponentially weighted mean for each input value.
+    state : tuple
+        The weighted mean, the weight of the old values, and the
+        number of observations after the last value.
+
+    """
+    alpha = 1. / (1. + (p - 1) / 2.)
+    old_wt_factor = 1. - alpha
+    n = len(x)
+    values = np.empty(n)
+    i0 = 0
+    if state is None:
+        if n == 0:
+            return values, None
+        weighted = x[0]
+        nobs = int(weighted == weighted)
+        old_wt = 1.
+        values[0] = weighted if nobs > 0 else np.nan
+        i0 = 1
+    else:
+        weighted, old_wt, nobs = state
+    for i in range(i0, n):
+        cur = x[i]
+        is_observation = cur == cur
+        nobs += int(is_observation)
+        if weighted == weighted:
+            old_wt *= old_wt_factor
+            if is_observation:
+                # avoid numerical errors on constant series
+                if weighted != cur:
+                    weighted = ((old_wt * weighted) + cur) / (old_wt + 1.)
+                old_wt += 1.
+        elif is_observation:
+            weighted = cur
+        values[i] = weighted if nobs > 0 else np.nan
+    return values, (weighted, old_wt, nobs)
+
+
+#
+# Functions for the exponential state of incremental variables
+#
+
+def ema_ewm(f, c, p = 20):
+    r"""Get the input of the exponential mean in ``ema``."""
+    return f[c], p, lambda e: e
+
+
+def diplus_ewm(f, p = 14):
+    r"""Get the input of the exponential mean in ``diplus``."""
+    vexec(f, 'truerange')
+    atr = USEP.join(['atr', str(p)])
+    vexec(f, atr)
+    vexec(f, 'dmplus')
+    return f['dmplus'], p, lambda e: 100 * e / f[atr]
+
+
+def diminus_ewm(f, p = 14):
+    r"""Get the input of the exponential mean in ``diminus``."""
+    vexec(f, 'truerange')
+    atr = USEP.join(['atr', str(p)])
+    vexec(f, atr)
+    f['dmminus'] = dminus(f)
+    return dminus(f), p, lambda e: 100 * e / f[atr]
+
+
+def adx_ewm(f, p = 14):
+    r"""Get the input of the exponential mean in ``adx``."""
+    vexec(f, 'diplus')
+    vexec(f, 'diminus')
+    dip = f['diplus']
+    dim = f['diminus']
+    return abs(dip - dim), p, lambda e: 100 * e / (dip + dim)
+
+
+#
+# Define the variable functions with an exponential state, along with
+# any variables that must be extended before them.
+#
+
+ewm_functions = {'adx'     : (adx_ewm, ['diplus', 'diminus']),
+                 'diminus' : (diminus_ewm, []),
+                 'diplus'  : (diplus_ewm, []),
+                 'ema'     : (ema_ewm, [])}
+
+
+#
+# Function vwindow
+#
+
+def vwindow(func, args):
+    r"""Get the number of prior rows that a variable function needs.
+
+    Parameters
+    ----------
+    func : function
+        The local variable function.
+    args : list
+        The parameters of the function call.
+
+    Returns
+    -------
+    window : int
+        The number of rows before the current row that determine
+        the value of the current row.
+
+    Notes
+    -----
+    Every local function with a finite window uses its integer
+    parameters as periods or offsets, so one more than the sum of
+    the integer parameters, including the defaults, is an upper
+    bound for the window.
+
+    """
+    params = list(inspect.signature(func).parameters.values())[1:]
+    values = list(args) + [x.default for x in params[len(args):]]
+    window = 1 + sum([x for x in values if type(x) is int])
+    return window
+
+
+#
+# Function vextend
+#
+
+def vextend(f, nf, vs, vfuncs=None, vstates=None):
+    r"""Extend the variables of a dataframe with newly arrived rows.
+
+    Parameters
+    ----------
+    f : pandas.DataFrame
+        Dataframe with the variables already applied.
+    nf : pandas.DataFrame
+        The new rows, containing only the base columns such as
+        the open, high, low, and close prices.
+    vs : list
+        The list of variables applied to ``f``.
+    vfuncs : dict, optional
+        Dictionary of external modules and functions.
+    vstates : dict, optional
+        The exponential states of the variables from a previous
+        call. Missing states are derived from ``f``.
+
+    Returns
+    -------
+    ef : pandas.DataFrame
+        The extended dataframe.
+    vstates : dict
+        The updated exponential states.
+
+    Notes
+    -----
+    Only the new rows are calculated. A variable with a finite window,
+    such as ``ma`` or ``highest``, is recalculated on the last rows of
+    the window. A variable with an exponential mean, such as ``ema``
+    or ``adx``, continues from its saved state. The results match a
+    full recalculation of ``f`` and ``nf`` together.
+
+    An external function has an unknown window, so it is recalculated
+    for all of the rows.
+
+    """
+    if vstates is None:
+        vstates = {}
+    nold = f.shape[0]
+    nnew = nf.shape[0]
+    if nnew == 0:
+        return f, vstates
+    plan = vcompile(vs, vfuncs)
+    modname = globals()['__name__']
+    # append the new rows, starting with the base columns only
+    ef = pd.concat([f, nf.reindex(columns=f.columns)])
+    complete = [c for c in ef.columns if c in nf.columns]
+
+    def vframe(start):
+        # copy the complete columns so that nested variables are recalculated
+        return ef[complete].iloc[start:].copy()
+
+    def vset(g, col):
+        # copy a column from a working frame into the extended frame,
+        # keeping the existing rows, which may be padding in g
+        if col in f.columns:
+            ef[col] = pd.concat([f[col], g[col].iloc[-nnew:]])
+        elif g.shape[0] == ef.shape[0]:
+            ef[col] = g[col].values
+        else:
+            return
+        if col not in complete:
+            complete.append(col)
+
+    def vkeep(g):
+        # keep the new variable along with any nested variables
+        for col in g.columns:
+            if col not in complete:
+                vset(g, col)
+
+    def vxnode(node):
+        v, vxlag, lag, expr, func, args = node
+        if vxlag not in complete:
+            name = func.__name__ if func is not None else None
+            if vxlag not in f.columns and v not in f.columns:
+                # new variable, so calculate it for all of the rows
+                g = vframe(0)
+                vnexec(g, node)
+                vkeep(g)
+            elif expr is not None:
+                g = vframe(nold)
+                g[vxlag] = g.eval(expr)
+                vset(g, vxlag)
+            elif name in ewm_functions and func.__module__ == modname:
+                kernel, antecedents = ewm_functions[name]
+                for av in antecedents:
+                    vxnode(vnode(av, vfuncs))
+                if v not in vstates:
+                    x, span, post = kernel(f.copy(), *args)
+                    vstates[v] = vewm(x.values, span)[1]
+                g = vframe(max(nold - vwindow(func, args), 0))
+                x, span, post = kernel(g, *args)
+                e, vstates[v] = vewm(x.values[-nnew:], span, vstates[v])
+                e = pd.Series(np.concatenate([np.full(g.shape[0] - nnew, np.nan), e]),
+                              index=g.index)
+                g[v] = post(e)
+                vkeep(g)
+            elif func is not None and func.__module__ == modname:
+                g = vframe(max(nold - vwindow(func, args), 0))
+                g[v] = func(g, *args)
+                vkeep(g)
+            elif func is not None:
+                g = vframe(0)
+                g[v] = func(g, *args)
+                vkeep(g)
+        # if necessary, add the lagged variable
+        if lag > 0 and vxlag in complete:
+            g = vframe(max(nold - lag, 0) if v in f.columns else 0)
+            g[v] = g[vxlag].shift(lag)
+            vset(g, v)
+
+    for node in plan:
+        vxnode(node)
+    # any remaining columns cannot be extended
+    for col in ef.columns:
+        if col not in complete:
+            logger.debug("Column %s was not extended", col)
+    return ef, vstates
+
+
+#
+# Function vmextend
+#
+
+def vmextend(group, vs, vfuncs=None, vcache=None):
+    r"""Apply multiple variables to multiple dataframes incrementally.
+
+    Parameters
+    ----------
+    group : alphapy.Group
+        The input group.
+    vs : list
+        The list of variables to apply to the ``group``.
+    vfuncs : dict, optional
+        Dictionary of external modules and functions.
+    vcache : dict, optional
+        The dataframes and exponential states from a previous run,
+        keyed by frame name.
+
+    Returns
+    -------
+    vcache : dict
+        The updated dataframes and exponential states.
+
+    Other Parameters
+    ----------------
+    Frame.frames : dict
+        Global dictionary of dataframes
+
+    Notes
+    -----
+    Each frame in ``Frame.frames`` holds the latest price data. If a
+    frame was cached by a previous run, then the cached rows before
+    the first date of the price data are dropped, so the cache never
+    holds more rows than the price data. The base columns of the
+    cached rows are compared with the price data, and the variables
+    are extended from the first row that changed, e.g., a bar that
+    was only partially formed when it was cached. If no cached row
+    changed, then only the new rows are calculated, starting from
+    the saved exponential states. Otherwise, all of the variables
+    are applied, and the exponential states are saved for the next
+    run.
+
+    """
+    if vcache is None:
+        vcache = {}
+    for v in vs:
+        logger.info("Applying variable: %s", v)
+    plan = vcompile(vs, vfuncs)
+    gnames = [item.lower() for item in group.members]
+    for g in gnames:
+        fname = frame_name(g, group.space)
+        if fname not in Frame.frames:
+            logger.debug("Frame not found: %s", fname)
+            continue
+        df = Frame.frames[fname].df
+        cf = None
+        if fname in vcache and not df.empty:
+            cf, vstates = vcache[fname]
+            cf = cf[cf.index >= df.index[0]]
+            nsame = vchanged(cf, df) if not cf.empty else 0
+            if nsame < cf.shape[0]:
+                logger.info("Prices of %s changed on %s", g, cf.index[nsame])
+                # derive the exponential states again from the unchanged rows
+                cf = cf.iloc[:nsame]
+                vstates = None
+        if cf is not None and not cf.empty:
+            nf = df[df.index > cf.index[-1]]
+            logger.info("Extending %s with %d new rows", g, nf.shape[0])
+            ef, vstates = vextend(cf, nf, vs, vfuncs, vstates)
+        elif not df.empty:
+            logger.info("Applying all rows to %s", g)
+            ef = vrun(df, plan)
+            vstates = vseed(ef, plan, {})
+        else:
+            logger.debug("Frame for %s is empty", g)
+            continue
+        Frame.frames[fname].df = ef
+        vcache[fname] = (ef, vstates)
+    return vcache
+
+
+#
+# Function vchanged
+#
+
+def vchanged(cf, df):
+    r"""Count the leading rows of a cached frame that are unchanged.
+
+    Parameters
+    ----------
+    cf : pandas.DataFrame
+        The cached dataframe with the variables applied.
+    df : pandas.DataFrame
+        The latest price data.
+
+    Returns
+    -------
+    nsame : int
+        The number of rows at the start of ``cf`` with the same dates
+        and the same base columns as ``df``. The base columns are the
+        columns of ``df`` that are also in ``cf``.
+
+    """
+    base = [c for c in df.columns if c in cf.columns]
+    old = df[df.index <= cf.index[-1]]
+    n = min(old.shape[0], cf.shape[0])
+    a = old[base].values[:n]
+    b = cf[base].values[:n]
+    same = (a == b) | (pd.isnull(a) & pd.isnull(b))
+    same = same.all(axis=1) & (old.index[:n] == cf.index[:n])
+    if same.all():
+        return n
+    return int(np.argmin(same))
+
+
+#
+# Function vseed
+#
+
+def vseed(f, plan, vstates):
+    r"""Save the exponential states of the variables in a dataframe.
+
+    Parameters
+    ----------
+    f : pandas.DataFrame
+        Dataframe with the variables already applied.
+    plan : list
+        The compiled nodes from ``vcompile``.
+    vstates : dict
+        The exponential states, updated in place.
+
+    Returns
+    -------
+    vstates : dict
+        The exponential states.
+
+    """
+    modname = globals()['__name__']
+    for v, vxlag, lag, expr, func, args in plan:
+        if func is not None and func.__name__ in ewm_functions \
+           and func.__module__ == modname and v not in vstates:
+            kernel, antecedents = ewm_functions[func.__name__]
+            for av in antecedents:
+                vseed(f, [vnode(av)], vstates)
+            x, span, post = kernel(f.copy(), *args)
+            vstates[v] = vewm(x.values, span)[1]
+    return vstates
+
+
 #
 # This is the reference for all internal and external variable functions.
 #
@@ -978,7 +1764,7 @@ def ema(f, c, p = 20):
     .. [IP_EMA] http://www.investopedia.com/terms/e/ema.asp
 
     """
-    new_column = pd.ewma(f[c], span=p)
+    new_column = f[c].ewm(span=p).mean()
     return new_column
 
 
@@ -26,6 +26,7 @@
 # Imports
 #
 
+from alphapy.estimators import get_estimator_data
 from alphapy.estimators import scorers
 from alphapy.estimators import xgb_score_map
 from alphapy.features import feature_scorers
@@ -38,17 +39,20 @@ from alphapy.globals import Partition, datasets
 from alphapy.globals import PSEP, SSEP, USEP
 from alphapy.globals import SamplingMethod
 from alphapy.globals import Scalers
+from alphapy.profiler import profile_stage
+from alphapy.profiler import Profiler
 from alphapy.utilities import get_datestamp
 from alphapy.utilities import most_recent_file
 
 from copy import copy
 from datetime import datetime
-from keras.models import load_model
 import logging
 import numpy as np
 import pandas as pd
+from sklearn.base import clone
 from sklearn.calibration import CalibratedClassifierCV
 from sklearn.externals import joblib
+from sklearn.isotonic import IsotonicRegression
 from sklearn.linear_model import LogisticRegression
 from sklearn.linear_model import RidgeCV
 from sklearn.metrics import accuracy_score
@@ -70,6 +74,8 @@ from sklearn.metrics import recall_score
 from sklearn.metrics import roc_auc_score
 from sklearn.metrics import roc_curve
 from sklearn.metrics.cluster import adjusted_rand_score
+from sklearn.model_selection import KFold
+from sklearn.model_selection import StratifiedKFold
 from sklearn.model_selection import train_test_split
 import sys
 import yaml
@@ -126,6 +132,8 @@ class Model:
         Probabilities from classification (keys: algorithm, partition)
     metrics : dict
         Model evaluation metrics (keys: algorith, partition, metric)
+    profiler : alphapy.Profiler
+        Time and memory of the pipeline stages
 
     Raises
     ------
@@ -170,6 +178,8 @@ class Model:
         self.probas = {}
         # Keys: (algorithm, partition, metric)
         self.metrics = {}
+        # stage profile
+        self.profiler = Profiler(self.specs.get('profile', False))
                 
     # __str__
 
@@ -265,6 +275,15 @@ def get_model_config():
         specs['encoder'] = Encoders(encoders[encoder])
     else:
         raise ValueError("model.yml features:encoding:type %s unrecognized" % encoder)
+    # feature matrix type
+    try:
+        feature_dtype = cfg['features']['dtype']
+    except:
+        feature_dtype = 'float64'
+    if feature_dtype in ['float32', 'float64']:
+        specs['feature_dtype'] = feature_dtype
+    else:
+        raise ValueError("model.yml features:dtype %s unrecognized" % feature_dtype)
     # factors
     specs['factors'] = cfg['features']['factors']
     # interactions
@@ -299,6 +318,11 @@ def get_model_config():
         raise ValueError("model.yml features:scaling:type %s unrecognized" % scaler_type)
     # SciPy
     specs['scipy'] = cfg['features']['scipy']['option']
+    # sparse matrix
+    try:
+        specs['sparse'] = cfg['features']['sparse']
+    except:
+        specs['sparse'] = False
     # text
     specs['ngrams_max'] = cfg['features']['text']['ngrams']
     specs['vectorize'] = cfg['features']['text']['vectorize']
@@ -323,6 +347,10 @@ def get_model_config():
     specs['n_estimators'] = cfg['model']['estimators']
     specs['pvalue_level'] = cfg['model']['pvalue_level']
     specs['scorer'] = cfg['model']['scoring_function']
+    try:
+        specs['stacking'] = cfg['model']['stacking']
+    except:
+        specs['stacking'] = False
     # calibration
     specs['calibration'] = cfg['model']['calibration']['option']
     specs['cal_type'] = cfg['model']['calibration']['type']
@@ -342,13 +370,73 @@ def get_model_config():
     specs['gs_random'] = cfg['model']['grid_search']['random']
     specs['gs_sample'] = cfg['model']['grid_search']['subsample']
     specs['gs_sample_pct'] = cfg['model']['grid_search']['sampling_pct']
+    try:
+        gs_method = cfg['model']['grid_search']['method']
+    except:
+        gs_method = 'grid'
+    if gs_method in ['grid', 'halving', 'hyperband']:
+        specs['gs_method'] = gs_method
+    else:
+        raise ValueError("model.yml model:grid_search:method %s unrecognized" % gs_method)
+    try:
+        specs['gs_resource'] = cfg['model']['grid_search']['resource']
+    except:
+        specs['gs_resource'] = 'samples'
+    try:
+        specs['gs_min_resource'] = cfg['model']['grid_search']['min_resource']
+    except:
+        specs['gs_min_resource'] = 0
+    try:
+        specs['gs_factor'] = cfg['model']['grid_search']['factor']
+    except:
+        specs['gs_factor'] = 3
     # rfe
     specs['rfe'] = cfg['model']['rfe']['option']
     specs['rfe_step'] = cfg['model']['rfe']['step']
+    try:
+        rfe_method = cfg['model']['rfe']['method']
+    except:
+        rfe_method = 'rfecv'
+    if rfe_method in ['rfecv', 'fast']:
+        specs['rfe_method'] = rfe_method
+    else:
+        raise ValueError("model.yml model:rfe:method %s unrecognized" % rfe_method)
+    try:
+        specs['rfe_fraction'] = cfg['model']['rfe']['fraction']
+    except:
+        specs['rfe_fraction'] = 0.2
+    try:
+        specs['rfe_patience'] = cfg['model']['rfe']['patience']
+    except:
+        specs['rfe_patience'] = 2
+    try:
+        specs['rfe_warm_start'] = cfg['model']['rfe']['warm_start']
+    except:
+        specs['rfe_warm_start'] = True
 
     # Section: pipeline
 
+    try:
+        specs['algorithm_jobs'] = cfg['pipeline']['algorithm_jobs']
+    except:
+        specs['algorithm_jobs'] = 1
+    try:
+        specs['cache'] = cfg['pipeline']['cache']
+    except:
+        specs['cache'] = False
+    try:
+        specs['cache_size'] = cfg['pipeline']['cache_size']
+    except:
+        specs['cache_size'] = 1024
+    try:
+        specs['memory_map'] = cfg['pipeline']['memory_map']
+    except:
+        specs['memory_map'] = False
     specs['n_jobs'] = cfg['pipeline']['number_jobs']
+    try:
+        specs['profile'] = cfg['pipeline']['profile']
+    except:
+        specs['profile'] = False
     specs['seed'] = cfg['pipeline']['seed']
     specs['verbosity'] = cfg['pipeline']['verbosity']
 
@@ -360,6 +448,18 @@ def get_model_config():
     specs['learning_curve'] = cfg['plots']['learning_curve']
     specs['roc_curve'] = cfg['plots']['roc_curve']
 
+    # Section: server
+
+    try:
+        server = cfg['server']
+    except:
+        server = {}
+    specs['max_batch'] = server.get('batch_size', 64)
+    specs['max_body'] = server.get('max_body', 1 << 20)
+    specs['max_wait'] = server.get('max_wait', 5.0)
+    specs['server_host'] = server.get('host', '127.0.0.1')
+    specs['server_port'] = server.get('port', 8000)
+
     # Section: treatments
 
     try:
@@ -375,7 +475,10 @@ def get_model_config():
     # Log the configuration parameters
 
     logger.info('MODEL PARAMETERS:')
+    logger.info('algorithm_jobs    = %d', specs['algorithm_jobs'])
     logger.info('algorithms        = %s', specs['algorithms'])
+    logger.info('cache             = %r', specs['cache'])
+    logger.info('cache_size        = %r', specs['cache_size'])
     logger.info('calibration       = %r', specs['calibration'])
     logger.info('cal_type          = %s', specs['cal_type'])
     logger.info('calibration_plot  = %r', specs['calibration'])
@@ -393,13 +496,18 @@ def get_model_config():
     logger.info('esr               = %d', specs['esr'])
     logger.info('factors           = %s', specs['factors'])
     logger.info('features [X]      = %s', specs['features'])
+    logger.info('feature_dtype     = %s', specs['feature_dtype'])
     logger.info('feature_selection = %r', specs['feature_selection'])
     logger.info('fs_percentage     = %d', specs['fs_percentage'])
     logger.info('fs_score_func     = %s', specs['fs_score_func'])
     logger.info('fs_uni_grid       = %s', specs['fs_uni_grid'])
     logger.info('grid_search       = %r', specs['grid_search'])
+    logger.info('gs_factor         = %d', specs['gs_factor'])
     logger.info('gs_iters          = %d', specs['gs_iters'])
+    logger.info('gs_method         = %s', specs['gs_method'])
+    logger.info('gs_min_resource   = %d', specs['gs_min_resource'])
     logger.info('gs_random         = %r', specs['gs_random'])
+    logger.info('gs_resource       = %s', specs['gs_resource'])
     logger.info('gs_sample         = %r', specs['gs_sample'])
     logger.info('gs_sample_pct     = %f', specs['gs_sample_pct'])
     logger.info('importances       = %r', specs['importances'])
@@ -412,6 +520,10 @@ def get_model_config():
     logger.info('logtransform      = %r', specs['logtransform'])
     logger.info('lv_remove         = %r', specs['lv_remove'])
     logger.info('lv_threshold      = %f', specs['lv_threshold'])
+    logger.info('max_batch         = %d', specs['max_batch'])
+    logger.info('max_body          = %d', specs['max_body'])
+    logger.info('max_wait          = %f', specs['max_wait'])
+    logger.info('memory_map        = %r', specs['memory_map'])
     logger.info('model_type        = %r', specs['model_type'])
     logger.info('n_estimators      = %d', specs['n_estimators'])
     logger.info('n_jobs            = %d', specs['n_jobs'])
@@ -423,9 +535,14 @@ def get_model_config():
     logger.info('pca_min           = %d', specs['pca_min'])
     logger.info('pca_whiten        = %r', specs['pca_whiten'])
     logger.info('poly_degree       = %d', specs['poly_degree'])
+    logger.info('profile           = %r', specs['profile'])
     logger.info('pvalue_level      = %f', specs['pvalue_level'])
     logger.info('rfe               = %r', specs['rfe'])
+    logger.info('rfe_fraction      = %f', specs['rfe_fraction'])
+    logger.info('rfe_method        = %s', specs['rfe_method'])
+    logger.info('rfe_patience      = %d', specs['rfe_patience'])
     logger.info('rfe_step          = %d', specs['rfe_step'])
+    logger.info('rfe_warm_start    = %r', specs['rfe_warm_start'])
     logger.info('roc_curve         = %r', specs['roc_curve'])
     logger.info('rounding          = %d', specs['rounding'])
     logger.info('sampling          = %r', specs['sampling'])
@@ -438,8 +555,12 @@ def get_model_config():
     logger.info('seed              = %d', specs['seed'])
     logger.info('sentinel          = %d', specs['sentinel'])
     logger.info('separator         = %s', specs['separator'])
+    logger.info('server_host       = %s', specs['server_host'])
+    logger.info('server_port       = %d', specs['server_port'])
     logger.info('shuffle           = %r', specs['shuffle'])
+    logger.info('sparse            = %r', specs['sparse'])
     logger.info('split             = %f', specs['split'])
+    logger.info('stacking          = %r', specs['stacking'])
     logger.info('submission_file   = %s', specs['submission_file'])
     logger.info('submit_probas     = %r', specs['submit_probas'])
     logger.info('target [y]        = %s', specs['target'])
@@ -490,6 +611,7 @@ def load_predictor(directory):
         if file_ext == 'pkl':
             predictor = joblib.load(file_name)
         elif file_ext == 'h5':
+            from keras.models import load_model
             predictor = load_model(file_name)
     else:
         logging.error("Could not find model predictor in %s", search_path)
@@ -657,7 +779,7 @@ def first_fit(model, algo, est):
 
     # Extract model data.
 
-    X_train = model.X_train
+    X_train = get_estimator_data(algo, model.X_train)
     y_train = model.y_train
 
     # Fit the initial model.
@@ -691,6 +813,177 @@ def first_fit(model, algo, est):
     return model
 
 
+#
+# Class CalibratedPredictor
+#
+
+class CalibratedPredictor(object):
+    """Calibrate a fitted classifier with out-of-fold probabilities.
+
+    Parameters
+    ----------
+    estimator : estimator
+        The binary classifier fitted on all of the training data.
+    method : str
+        The calibration method, ``sigmoid`` or ``isotonic``.
+
+    Attributes
+    ----------
+    calibrator : estimator
+        The map from the probabilities of the classifier to
+        calibrated probabilities.
+    classes_ : numpy array
+        The class labels of the classifier.
+
+    Raises
+    ------
+    ValueError
+        The classifier has more than two classes.
+
+    Notes
+    -----
+    Unlike ``CalibratedClassifierCV``, the calibrator is fit on the
+    out-of-fold probabilities from stacking, so the classifier is
+    not refit for calibration.
+
+    """
+
+    # __init__
+
+    def __init__(self,
+                 estimator,
+                 method):
+        self.estimator = estimator
+        self.method = method
+        self.calibrator = None
+        self.classes_ = estimator.classes_
+        if len(self.classes_) != 2:
+            raise ValueError("CalibratedPredictor supports only binary classifiers, not %d classes"
+                             % len(self.classes_))
+
+    # fit
+
+    def fit(self, probas, y):
+        r"""Fit the calibrator on out-of-fold probabilities."""
+        target = (np.asarray(y) == self.classes_[1]).astype(float)
+        if self.method == 'isotonic':
+            self.calibrator = IsotonicRegression(y_min=0.0, y_max=1.0,
+                                                 out_of_bounds='clip')
+            self.calibrator.fit(probas, target)
+        else:
+            self.calibrator = LogisticRegression(C=1e10)
+            self.calibrator.fit(probas.reshape(-1, 1), target)
+        return self
+
+    # calibrate
+
+    def calibrate(self, probas):
+        r"""Map probabilities of the target class to calibrated values."""
+        if self.method == 'isotonic':
+            return self.calibrator.predict(probas)
+        return self.calibrator.predict_proba(probas.reshape(-1, 1))[:, 1]
+
+    # predict_proba
+
+    def predict_proba(self, X):
+        r"""Predict calibrated probabilities for both classes."""
+        probas = self.calibrate(self.estimator.predict_proba(X)[:, 1])
+        return np.column_stack((1.0 - probas, probas))
+
+    # predict
+
+    def predict(self, X):
+        r"""Predict the class with the larger calibrated probability."""
+        return self.classes_[(self.predict_proba(X)[:, 1] >= 0.5).astype(int)]
+
+
+#
+# Function get_cv_folds
+#
+
+def get_cv_folds(model, y):
+    r"""Get the shared cross-validation folds of the training data.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        The model object with specifications.
+    y : numpy array
+        The training labels.
+
+    Returns
+    -------
+    folds : list
+        The ``(train_index, test_index)`` pairs of each fold.
+
+    Notes
+    -----
+    The folds depend only on the labels and the seed, so every
+    algorithm, including those trained in worker processes, gets
+    the same folds.
+
+    """
+    cv_folds = model.specs['cv_folds']
+    model_type = model.specs['model_type']
+    seed = model.specs['seed']
+    if model_type == ModelType.classification:
+        kf = StratifiedKFold(n_splits=cv_folds, shuffle=True, random_state=seed)
+    else:
+        kf = KFold(n_splits=cv_folds, shuffle=True, random_state=seed)
+    return list(kf.split(np.zeros(len(y)), y))
+
+
+#
+# Function get_oof_predictions
+#
+
+def get_oof_predictions(model, algo, est, X_train, y_train):
+    r"""Make out-of-fold predictions for the training data.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        The model object with specifications.
+    algo : str
+        Abbreviation of the algorithm.
+    est : estimator
+        The fitted estimator, whose parameters are used for each fold.
+    X_train : numpy array or scipy.sparse.csr_matrix
+        The training features.
+    y_train : numpy array
+        The training labels.
+
+    Returns
+    -------
+    preds : numpy array
+        The prediction for each row from the fold that held it out.
+    probas : numpy array
+        The probability of the target class for each row, or
+        ``None`` for regression.
+
+    """
+    model_type = model.specs['model_type']
+    # a search estimator is replaced by its best estimator
+    base = getattr(est, 'best_estimator_', est)
+    y_train = np.asarray(y_train)
+    if model_type == ModelType.classification:
+        preds = np.zeros(X_train.shape[0], dtype=y_train.dtype)
+        probas = np.zeros(X_train.shape[0])
+    else:
+        preds = np.zeros(X_train.shape[0])
+        probas = None
+    folds = get_cv_folds(model, y_train)
+    logger.info("Out-of-Fold Predictions for %s with %d Folds", algo, len(folds))
+    for train_index, test_index in folds:
+        fold_est = clone(base)
+        fold_est.fit(X_train[train_index], y_train[train_index])
+        X_fold = X_train[test_index]
+        preds[test_index] = np.ravel(fold_est.predict(X_fold))
+        if probas is not None:
+            probas[test_index] = fold_est.predict_proba(X_fold)[:, 1]
+    return preds, probas
+
+
 #
 # Function make_predictions
 #
@@ -718,6 +1011,14 @@ def make_predictions(model, algo, calibrate):
     actual predictions. In this case, AlphaPy predicts both labels
     and probabilities. For regression, real values are predicted.
 
+    With stacking, the training predictions are made out-of-fold
+    on the shared folds, and the calibrator of a binary classifier
+    is fit on those same predictions, so each algorithm is fit once
+    per fold in total. A multiclass classifier is calibrated with
+    ``CalibratedClassifierCV`` instead.
+    The test predictions come from the estimator fit on all of the
+    training data.
+
     """
 
     logger.info("Final Model Predictions for %s", algo)
@@ -727,6 +1028,7 @@ def make_predictions(model, algo, calibrate):
     cal_type = model.specs['cal_type']
     cv_folds = model.specs['cv_folds']
     model_type = model.specs['model_type']
+    stacking = model.specs['stacking']
 
     # Get the estimator
 
@@ -741,15 +1043,36 @@ def make_predictions(model, algo, calibrate):
     except:
         X_train = model.X_train
         X_test = model.X_test
+    X_train = get_estimator_data(algo, X_train)
+    X_test = get_estimator_data(algo, X_test)
     y_train = model.y_train
 
+    # Out-of-fold predictions on the shared folds
+
+    if stacking:
+        with profile_stage(model, 'stacking', algo):
+            oof_preds, oof_probas = get_oof_predictions(model, algo, est,
+                                                        X_train, y_train)
+
     # Calibration
 
     if model_type == ModelType.classification:
-        if calibrate:
+        binary = len(np.unique(y_train)) == 2
+        if calibrate and stacking and binary:
+            logger.info("Calibrating Classifier with Out-of-Fold Probabilities")
+            with profile_stage(model, 'calibration', algo):
+                est = CalibratedPredictor(est, cal_type).fit(oof_probas, y_train)
+                oof_probas = est.calibrate(oof_probas)
+                oof_preds = est.classes_[(oof_probas >= 0.5).astype(int)]
+            model.estimators[algo] = est
+            logger.info("Calibration Complete")
+        elif calibrate:
+            if stacking:
+                logger.info("Out-of-Fold Calibration is only for Binary Classifiers")
             logger.info("Calibrating Classifier")
             est = CalibratedClassifierCV(est, cv=cv_folds, method=cal_type)
-            est.fit(X_train, y_train)
+            with profile_stage(model, 'calibration', algo):
+                est.fit(X_train, y_train)
             model.estimators[algo] = est
             logger.info("Calibration Complete")
         else:
@@ -758,10 +1081,16 @@ def make_predictions(model, algo, calibrate):
     # Make predictions on original training and test data.
 
     logger.info("Making Predictions")
-    model.preds[(algo, Partition.train)] = est.predict(X_train)
+    if stacking:
+        model.preds[(algo, Partition.train)] = oof_preds
+    else:
+        model.preds[(algo, Partition.train)] = est.predict(X_train)
     model.preds[(algo, Partition.test)] = est.predict(X_test)
     if model_type == ModelType.classification:
-        model.probas[(algo, Partition.train)] = est.predict_proba(X_train)[:, 1]
+        if stacking:
+            model.probas[(algo, Partition.train)] = oof_probas
+        else:
+            model.probas[(algo, Partition.train)] = est.predict_proba(X_train)[:, 1]
         model.probas[(algo, Partition.test)] = est.predict_proba(X_test)[:, 1]
     logger.info("Predictions Complete")
 
@@ -907,6 +1236,10 @@ def predict_blend(model):
     For classification, AlphaPy uses logistic regression for creating
     a blended model. For regression, ridge regression is applied.
 
+    With stacking, the training predictions of each algorithm are
+    out-of-fold, so the blender learns how the algorithms perform
+    on unseen data rather than on the data they were fit on.
+
     """
 
     logger.info("Blending Models")
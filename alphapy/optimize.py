@@ -26,15 +26,27 @@
 # Imports
 #
 
+from alphapy.estimators import get_estimator_data
 from alphapy.globals import ModelType
 
 from datetime import datetime
 import logging
+from math import ceil, floor, log
 import numpy as np
+from sklearn.base import BaseEstimator
+from sklearn.base import clone
+from sklearn.base import is_classifier
+from sklearn.externals.joblib import delayed
+from sklearn.externals.joblib import Parallel
 from sklearn.feature_selection import RFE
 from sklearn.feature_selection import RFECV
 from sklearn.feature_selection import SelectPercentile
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import check_cv
+from sklearn.model_selection import cross_val_score
 from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import ParameterGrid
+from sklearn.model_selection import ParameterSampler
 from sklearn.model_selection import RandomizedSearchCV
 from sklearn.pipeline import Pipeline
 from time import time
@@ -78,6 +90,9 @@ def rfecv_search(model, algo):
     with Cross-Validation (CV), as in this function; otherwise, it just
     does RFE without CV.
 
+    If the RFE method is ``fast``, then the features are eliminated
+    with ``FastRFECV`` instead of ``RFECV``.
+
     References
     ----------
     For more information about Recursive Feature Elimination,
@@ -89,14 +104,18 @@ def rfecv_search(model, algo):
 
     # Extract model data.
 
-    X_train = model.X_train
+    X_train = get_estimator_data(algo, model.X_train)
     y_train = model.y_train
 
     # Extract model parameters.
 
     cv_folds = model.specs['cv_folds']
     n_jobs = model.specs['n_jobs']
+    rfe_fraction = model.specs['rfe_fraction']
+    rfe_method = model.specs['rfe_method']
+    rfe_patience = model.specs['rfe_patience']
     rfe_step = model.specs['rfe_step']
+    rfe_warm_start = model.specs['rfe_warm_start']
     scorer = model.specs['scorer']
     verbosity = model.specs['verbosity']
     estimator = model.estimators[algo]
@@ -104,8 +123,14 @@ def rfecv_search(model, algo):
     # Perform Recursive Feature Elimination
 
     logger.info("Recursive Feature Elimination with CV")
-    rfecv = RFECV(estimator, step=rfe_step, cv=cv_folds,
-                  scoring=scorer, verbose=verbosity, n_jobs=n_jobs)
+    if rfe_method == 'fast':
+        rfecv = FastRFECV(estimator, step=rfe_step, fraction=rfe_fraction,
+                          patience=rfe_patience, warm_start=rfe_warm_start,
+                          cv=cv_folds, scoring=scorer, n_jobs=n_jobs,
+                          verbose=verbosity)
+    else:
+        rfecv = RFECV(estimator, step=rfe_step, cv=cv_folds,
+                      scoring=scorer, verbose=verbosity, n_jobs=n_jobs)
     start = time()
     selector = rfecv.fit(X_train, y_train)
     logger.info("RFECV took %.2f seconds for step %d and %d folds",
@@ -123,6 +148,248 @@ def rfecv_search(model, algo):
     return model
 
 
+#
+# Function get_feature_importances
+#
+
+def get_feature_importances(est):
+    r"""Get the importance of each feature from a fitted estimator.
+
+    Parameters
+    ----------
+    est : estimator
+        The fitted estimator with ``coef_`` or ``feature_importances_``.
+
+    Returns
+    -------
+    importances : numpy array
+        The importance of each feature. Coefficients are squared and
+        summed over classes, as in scikit-learn ``RFE``.
+
+    """
+    if hasattr(est, 'coef_'):
+        coefs = np.asarray(est.coef_)
+        if coefs.ndim > 1:
+            return (coefs ** 2).sum(axis=0)
+        return coefs ** 2
+    return np.asarray(est.feature_importances_)
+
+
+#
+# Function fit_rfe_fold
+#
+
+def fit_rfe_fold(est, scorer, X, y, train, test, features, prior, warm_start):
+    r"""Fit and score the estimator of one fold on a feature subset.
+
+    Parameters
+    ----------
+    est : estimator
+        The unfitted estimator.
+    scorer : callable
+        The scorer, or ``None`` for the ``score`` method of the estimator.
+    X : numpy array or scipy.sparse.csr_matrix
+        The training features.
+    y : numpy array
+        The training labels.
+    train : numpy array
+        The rows of the training fold.
+    test : numpy array
+        The rows of the validation fold.
+    features : numpy array
+        The columns of the feature subset.
+    prior : tuple
+        The coefficients and intercept of the fold from the previous
+        round on this subset of features, or ``None``.
+    warm_start : bool
+        If ``True``, then start the solver from ``prior``.
+
+    Returns
+    -------
+    score : float
+        The score of the validation fold.
+    importances : numpy array
+        The importance of each feature in the subset.
+    coefs : tuple
+        The fitted coefficients and intercept, or ``None`` for
+        estimators without coefficients.
+
+    """
+    X_train = X[train][:, features]
+    X_test = X[test][:, features]
+    if warm_start and prior is not None and 'warm_start' in est.get_params():
+        est.set_params(warm_start=True)
+        est.coef_, est.intercept_ = prior
+    est.fit(X_train, y[train])
+    if scorer is not None:
+        score = scorer(est, X_test, y[test])
+    else:
+        score = est.score(X_test, y[test])
+    coefs = None
+    if hasattr(est, 'coef_'):
+        coefs = (np.array(est.coef_), np.array(getattr(est, 'intercept_', 0.0)))
+    return score, get_feature_importances(est), coefs
+
+
+#
+# Class FastRFECV
+#
+
+class FastRFECV(BaseEstimator):
+    """Eliminate features in geometric steps with early stopping.
+
+    Parameters
+    ----------
+    estimator : estimator
+        The estimator with ``coef_`` or ``feature_importances_``.
+    step : int, optional
+        The minimum number of features removed in each round.
+    fraction : float, optional
+        The fraction of the remaining features removed in each round.
+    patience : int, optional
+        The number of rounds without a better cross-validation score
+        before the elimination stops.
+    warm_start : bool, optional
+        If ``True``, then each fold of an estimator with coefficients
+        and a ``warm_start`` parameter starts from the coefficients
+        of the previous round.
+    min_features : int, optional
+        The smallest number of features to consider.
+    cv : int, optional
+        The number of cross-validation folds.
+    scoring : str, optional
+        The scikit-learn scoring function.
+    n_jobs : int, optional
+        The number of jobs for fitting the folds.
+    verbose : int, optional
+        The verbosity of the fold fits.
+
+    Attributes
+    ----------
+    estimator_ : estimator
+        The estimator refit on the selected features.
+    n_features_ : int
+        The number of selected features.
+    ranking_ : numpy array
+        The rank of each feature, where the selected features
+        are ranked 1 and the first feature eliminated is ranked last.
+    scores_ : dict
+        The mean cross-validation score for each number of features.
+    support_ : numpy array
+        The mask of the selected features.
+
+    Notes
+    -----
+    Each round fits one estimator per fold on the remaining features,
+    ranks the features by their importances averaged over the folds,
+    and removes the lowest ``fraction`` of them. With ``n`` features,
+    there are about ``log(n) / fraction`` rounds rather than the
+    ``n / step`` of ``RFECV``, and far fewer if the score plateaus.
+
+    """
+
+    # __init__
+
+    def __init__(self,
+                 estimator,
+                 step=1,
+                 fraction=0.2,
+                 patience=2,
+                 warm_start=True,
+                 min_features=1,
+                 cv=3,
+                 scoring=None,
+                 n_jobs=1,
+                 verbose=0):
+        self.estimator = estimator
+        self.step = step
+        self.fraction = fraction
+        self.patience = patience
+        self.warm_start = warm_start
+        self.min_features = min_features
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+
+    # fit
+
+    def fit(self, X, y):
+        r"""Select the features with the best cross-validation score.
+
+        Parameters
+        ----------
+        X : numpy array or scipy.sparse.csr_matrix
+            The training features.
+        y : numpy array
+            The training labels.
+
+        Returns
+        -------
+        self : FastRFECV
+            The fitted selector.
+
+        """
+        y = np.asarray(y)
+        n_features = X.shape[1]
+        cv = check_cv(self.cv, y, classifier=is_classifier(self.estimator))
+        folds = list(cv.split(X, y))
+        scorer = get_scorer(self.scoring) if self.scoring else None
+        min_features = max(1, min(self.min_features, n_features))
+
+        features = np.arange(n_features)
+        ranking = np.ones(n_features, dtype=int)
+        eliminated = []
+        priors = [None] * len(folds)
+        self.scores_ = {}
+        best_score = -np.inf
+        best_features = features
+        stale = 0
+
+        while True:
+            results = Parallel(n_jobs=self.n_jobs, verbose=self.verbose)(
+                delayed(fit_rfe_fold)(clone(self.estimator), scorer, X, y,
+                                      train, test, features, prior,
+                                      self.warm_start)
+                for (train, test), prior in zip(folds, priors))
+            score = np.mean([r[0] for r in results])
+            self.scores_[len(features)] = score
+            logger.info("RFE Round: %d Features, Score: %.4f", len(features), score)
+            if score > best_score:
+                best_score = score
+                best_features = features
+                stale = 0
+            else:
+                stale += 1
+            if stale >= self.patience or len(features) <= min_features:
+                break
+            # remove the least important features of this round
+            importances = np.mean([r[1] for r in results], axis=0)
+            n_remove = max(self.step, int(floor(self.fraction * len(features))))
+            n_remove = min(n_remove, len(features) - min_features)
+            order = np.argsort(importances, kind='mergesort')
+            eliminated.extend(features[order[:n_remove]])
+            keep = np.sort(order[n_remove:])
+            features = features[keep]
+            priors = [(r[2][0][..., keep], r[2][1]) if r[2] is not None else None
+                      for r in results]
+
+        # rank the eliminated features, last eliminated first
+
+        selected = set(best_features)
+        unselected = [f for f in eliminated if f not in selected]
+        unselected += [f for f in features if f not in selected]
+        for rank, f in enumerate(reversed(unselected)):
+            ranking[f] = rank + 2
+
+        self.support_ = np.zeros(n_features, dtype=bool)
+        self.support_[best_features] = True
+        self.n_features_ = len(best_features)
+        self.ranking_ = ranking
+        self.estimator_ = clone(self.estimator).fit(X[:, best_features], y)
+        return self
+
+
 #
 # Function grid_report
 #
@@ -152,6 +419,319 @@ def grid_report(results, n_top=3):
             logger.info("Parameters: {0}".format(results['params'][candidate]))
 
 
+#
+# Function rank_key
+#
+
+def rank_key(score):
+    r"""Sort scores from best to worst with ``NaN`` scores last.
+
+    Parameters
+    ----------
+    score : float
+        The mean cross-validation score.
+
+    Returns
+    -------
+    key : tuple
+        The sort key of the score.
+
+    """
+    if np.isnan(score):
+        return (1, 0.0)
+    return (0, -score)
+
+
+#
+# Class HalvingSearchCV
+#
+
+class HalvingSearchCV(BaseEstimator):
+    """Search hyperparameters by successive halving or Hyperband.
+
+    Parameters
+    ----------
+    estimator : estimator
+        The estimator or pipeline to tune.
+    param_grid : dict
+        The lists or distributions of the hyperparameters.
+    scoring : str, optional
+        The scikit-learn scoring function.
+    cv : int, optional
+        The number of cross-validation folds.
+    n_jobs : int, optional
+        The number of jobs for cross-validation.
+    n_iter : int, optional
+        The number of sampled candidates. If 0, then every
+        combination in the grid is a candidate.
+    resource : str, optional
+        The budget of each round: ``samples`` for the number of
+        training rows, or an estimator parameter such as
+        ``est__n_estimators`` for the number of boosting rounds
+        or trees.
+    min_resources : int, optional
+        The budget of the first round. If 0, then it is chosen so
+        that the last round uses the full budget. For a classifier
+        with the ``samples`` resource, the rows of each round are
+        stratified by class, and the first round has at least
+        ``2 * cv`` rows of the smallest class.
+    factor : int, optional
+        The fraction ``1 / factor`` of the candidates is kept after
+        each round, and the budget is multiplied by ``factor``.
+    hyperband : bool, optional
+        If ``True``, run Hyperband brackets of successive halving,
+        from many candidates on a small budget to a few candidates
+        on the full budget.
+    random_state : int, optional
+        The seed for sampling candidates and rows.
+    verbose : int, optional
+        The verbosity of cross-validation.
+
+    Attributes
+    ----------
+    best_estimator_ : estimator
+        The best candidate refit on all of the training data.
+    best_params_ : dict
+        The parameters of the best candidate.
+    best_score_ : float
+        The mean cross-validation score of the best candidate.
+    cv_results_ : dict of numpy arrays
+        The last evaluation of each candidate, in the same format
+        as ``GridSearchCV`` with the extra keys ``n_resources`` and
+        ``iter``. Candidates that were stopped early rank below the
+        candidates that reached a larger budget, and a ``NaN`` score
+        ranks last among the candidates of the same budget.
+
+    Notes
+    -----
+    Each round scores the surviving candidates with cross-validation
+    on the round's budget and stops all but the best ``1 / factor``.
+    Most candidates are only ever scored on a small fraction of the
+    budget, so many more candidates can be searched in the time
+    of a full grid search.
+
+    References
+    ----------
+    For more information about Hyperband, refer to [HYPER]_.
+
+    .. [HYPER] Li, L., et al. (2018). Hyperband: A Novel Bandit-Based Approach
+       to Hyperparameter Optimization. JMLR, 18(185), 1-52.
+
+    """
+
+    # __init__
+
+    def __init__(self,
+                 estimator,
+                 param_grid,
+                 scoring=None,
+                 cv=3,
+                 n_jobs=1,
+                 n_iter=0,
+                 resource='samples',
+                 min_resources=0,
+                 factor=3,
+                 hyperband=False,
+                 random_state=None,
+                 verbose=0):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.scoring = scoring
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.n_iter = n_iter
+        self.resource = resource
+        self.min_resources = min_resources
+        self.factor = factor
+        self.hyperband = hyperband
+        self.random_state = random_state
+        self.verbose = verbose
+
+    # get_candidates
+
+    def get_candidates(self, n_iter, seed):
+        r"""Get a list of candidate parameters from the grid."""
+        grid = {k: v for k, v in self.param_grid.items() if k != self.resource}
+        all_lists = all([isinstance(v, list) for v in grid.values()])
+        if all_lists:
+            grid_size = len(ParameterGrid(grid))
+            if n_iter <= 0 or n_iter >= grid_size:
+                return list(ParameterGrid(grid))
+        return list(ParameterSampler(grid, n_iter, random_state=seed))
+
+    # get_order
+
+    def get_order(self, y, rng):
+        r"""Order the rows so that each prefix is stratified by class."""
+        position = np.empty(len(y))
+        for c in np.unique(y):
+            rows = np.flatnonzero(y == c)
+            position[rng.permutation(rows)] = (np.arange(len(rows)) + 0.5) / len(rows)
+        return np.lexsort((rng.rand(len(y)), position))
+
+    # evaluate
+
+    def evaluate(self, X, y, params, budget):
+        r"""Score one candidate with cross-validation on a budget."""
+        est = clone(self.estimator).set_params(**params)
+        if self.resource == 'samples':
+            rows = self.order_[:budget]
+            X, y = X[rows], y[rows]
+        else:
+            est.set_params(**{self.resource : budget})
+        scores = cross_val_score(est, X, y, scoring=self.scoring, cv=self.cv,
+                                 n_jobs=self.n_jobs, verbose=self.verbose)
+        return scores.mean(), scores.std()
+
+    # successive_halving
+
+    def successive_halving(self, X, y, candidates, budget, n_rounds, max_budget):
+        r"""Run rounds of successive halving on the candidates.
+
+        Returns
+        -------
+        results : list
+            The ``(params, mean, std, budget, round)`` tuple of the
+            last evaluation of each candidate.
+
+        """
+        results = []
+        for i in range(n_rounds):
+            if i == n_rounds - 1:
+                budget = max_budget
+            logger.info("Halving Round %d: %d Candidates with %s = %d",
+                        i + 1, len(candidates), self.resource, budget)
+            scored = []
+            for params in candidates:
+                mean, std = self.evaluate(X, y, params, budget)
+                scored.append((params, mean, std, budget, i))
+            scored.sort(key=lambda x: rank_key(x[1]))
+            if i == n_rounds - 1:
+                results.extend(scored)
+            else:
+                n_keep = max(1, int(ceil(len(scored) / float(self.factor))))
+                results.extend(scored[n_keep:])
+                candidates = [x[0] for x in scored[:n_keep]]
+                budget = int(budget * self.factor)
+        return results
+
+    # fit
+
+    def fit(self, X, y):
+        r"""Search for the best candidate and refit it.
+
+        Parameters
+        ----------
+        X : numpy array or scipy.sparse.csr_matrix
+            The training features.
+        y : numpy array
+            The training labels.
+
+        Returns
+        -------
+        self : alphapy.HalvingSearchCV
+            The fitted search.
+
+        """
+        y = np.asarray(y)
+        factor = self.factor
+        rng = np.random.RandomState(self.random_state)
+        classify = is_classifier(self.estimator)
+        if classify and self.resource == 'samples':
+            self.order_ = self.get_order(y, rng)
+        else:
+            self.order_ = rng.permutation(X.shape[0])
+
+        # Get the full budget and the budget of the first round.
+
+        if self.resource == 'samples':
+            max_budget = X.shape[0]
+            min_budget = self.min_resources or 2 * self.cv
+            if classify:
+                # each fold of the first round needs rows of every class
+                _, counts = np.unique(y, return_counts=True)
+                min_rows = 2 * self.cv * max_budget / float(counts.min())
+                min_budget = max(min_budget, 2 * self.cv * len(counts),
+                                 int(ceil(min_rows)))
+                min_budget = min(min_budget, max_budget)
+        else:
+            max_budget = self.estimator.get_params()[self.resource]
+            min_budget = self.min_resources or 1
+        max_rounds = 1 + int(floor(log(max(max_budget / float(min_budget), 1.0), factor)))
+
+        # Run one set of rounds, or a Hyperband bracket for each budget.
+
+        results = []
+        if self.hyperband:
+            s_max = max_rounds - 1
+            for s in range(s_max, -1, -1):
+                n = int(ceil((s_max + 1) * factor ** s / float(s + 1)))
+                candidates = self.get_candidates(n, rng.randint(2 ** 31))
+                budget = max(min_budget, int(max_budget / factor ** s))
+                logger.info("Hyperband Bracket %d: %d Candidates", s, len(candidates))
+                results.extend(self.successive_halving(X, y, candidates, budget,
+                                                       s + 1, max_budget))
+        else:
+            candidates = self.get_candidates(self.n_iter, rng.randint(2 ** 31))
+            n_rounds = 1 + int(floor(log(len(candidates), factor)))
+            n_rounds = min(n_rounds, max_rounds)
+            if self.min_resources:
+                budget = min_budget
+            else:
+                budget = max(min_budget, int(max_budget / factor ** (n_rounds - 1)))
+            results = self.successive_halving(X, y, candidates, budget,
+                                              n_rounds, max_budget)
+
+        # Rank by the budget reached, then by the score.
+
+        results.sort(key=lambda x: (-x[3],) + rank_key(x[1]))
+        self.cv_results_ = {'params'          : [x[0] for x in results],
+                            'mean_test_score' : np.array([x[1] for x in results]),
+                            'std_test_score'  : np.array([x[2] for x in results]),
+                            'n_resources'     : np.array([x[3] for x in results]),
+                            'iter'            : np.array([x[4] for x in results]),
+                            'rank_test_score' : np.arange(1, len(results) + 1)}
+        self.best_index_ = 0
+        self.best_params_ = results[0][0]
+        self.best_score_ = results[0][1]
+
+        # Refit the best candidate on all of the data.
+
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_)
+        self.best_estimator_.fit(X, y)
+        return self
+
+    # _estimator_type
+
+    @property
+    def _estimator_type(self):
+        return self.estimator._estimator_type
+
+    # classes_
+
+    @property
+    def classes_(self):
+        return self.best_estimator_.classes_
+
+    # predict
+
+    def predict(self, X):
+        r"""Predict with the best estimator."""
+        return self.best_estimator_.predict(X)
+
+    # predict_proba
+
+    def predict_proba(self, X):
+        r"""Predict probabilities with the best estimator."""
+        return self.best_estimator_.predict_proba(X)
+
+    # score
+
+    def score(self, X, y):
+        r"""Score the best estimator."""
+        return self.best_estimator_.score(X, y)
+
+
 #
 # Function hyper_grid_search
 #
@@ -179,6 +759,10 @@ def hyper_grid_search(model, estimator):
     the scikit-learn Pipeline with feature selection to
     reduce the feature space.
 
+    With the ``halving`` or ``hyperband`` method, the candidates
+    are scored on a growing budget of rows or boosting rounds,
+    and the weakest candidates are stopped after each round.
+
     References
     ----------
     For more information about grid search, refer to [GRID]_.
@@ -210,6 +794,7 @@ def hyper_grid_search(model, estimator):
         X_train = model.X_train[:, support]
     except:
         X_train = model.X_train
+    X_train = get_estimator_data(algo, X_train)
     y_train = model.y_train
 
     # Extract model parameters.
@@ -219,18 +804,23 @@ def hyper_grid_search(model, estimator):
     fs_percentage = model.specs['fs_percentage']
     fs_score_func = model.specs['fs_score_func']
     fs_uni_grid = model.specs['fs_uni_grid']
+    gs_factor = model.specs['gs_factor']
     gs_iters = model.specs['gs_iters']
+    gs_method = model.specs['gs_method']
+    gs_min_resource = model.specs['gs_min_resource']
     gs_random = model.specs['gs_random']
+    gs_resource = model.specs['gs_resource']
     gs_sample = model.specs['gs_sample']
     gs_sample_pct = model.specs['gs_sample_pct']
     n_jobs = model.specs['n_jobs']
     scorer = model.specs['scorer']
+    seed = model.specs['seed']
     verbosity = model.specs['verbosity']
 
     # Subsample if necessary to reduce grid search duration.
 
     if gs_sample:
-        length = len(X_train)
+        length = X_train.shape[0]
         subset = int(length * gs_sample_pct)
         indices = np.random.choice(length, subset, replace=False)
         X_train = X_train[indices]
@@ -257,9 +847,19 @@ def hyper_grid_search(model, estimator):
     else:
         pipeline = Pipeline([("est", est)])
 
-    # Create the randomized grid search iterator.
-
-    if gs_random:
+    # Create the halving, randomized, or full grid search iterator.
+
+    if gs_method in ['halving', 'hyperband']:
+        logger.info("Grid Search by %s over %s", gs_method.title(), gs_resource)
+        if gs_resource != 'samples':
+            gs_resource = '__'.join(['est', gs_resource])
+        gscv = HalvingSearchCV(pipeline, param_grid=grid_new, scoring=scorer,
+                               cv=cv_folds, n_jobs=n_jobs,
+                               n_iter=gs_iters if gs_random else 0,
+                               resource=gs_resource, min_resources=gs_min_resource,
+                               factor=gs_factor, hyperband=gs_method == 'hyperband',
+                               random_state=seed, verbose=verbosity)
+    elif gs_random:
         logger.info("Randomized Grid Search")
         gscv = RandomizedSearchCV(pipeline, param_distributions=grid_new,
                                   n_iter=gs_iters, scoring=scorer,
@@ -273,7 +873,7 @@ def hyper_grid_search(model, estimator):
 
     start = time()
     gscv.fit(X_train, y_train)
-    if gs_iters > 0:
+    if gs_iters > 0 and gs_method == 'grid':
         logger.info("Grid Search took %.2f seconds for %d candidate"
                     " parameter settings." % ((time() - start), gs_iters))
     else:
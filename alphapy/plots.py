@@ -55,6 +55,7 @@ print(__doc__)
 # Imports
 #
 
+from alphapy.estimators import get_estimator_data
 from alphapy.estimators import get_estimators
 from alphapy.globals import BSEP, PSEP, SSEP, USEP
 from alphapy.globals import ModelType
@@ -335,7 +336,7 @@ def plot_calibration(model, partition):
         if hasattr(clf, "predict_proba"):
             prob_pos = model.probas[(algo, partition)]
         else:  # use decision function
-            prob_pos = clf.decision_function(X)
+            prob_pos = clf.decision_function(get_estimator_data(algo, X))
             prob_pos = \
                 (prob_pos - prob_pos.min()) / (prob_pos.max() - prob_pos.min())
         fraction_of_positives, mean_predicted_value = \
@@ -490,7 +491,8 @@ def plot_learning_curve(model, partition):
         # call learning curve function
         train_sizes=np.linspace(0.1, 1.0, cv_folds)
         train_sizes, train_scores, test_scores = \
-            learning_curve(est, X, y, train_sizes=train_sizes, cv=cv,
+            learning_curve(est, get_estimator_data(algo, X), y,
+                           train_sizes=train_sizes, cv=cv,
                            n_jobs=n_jobs, verbose=verbosity)
         train_scores_mean = np.mean(train_scores, axis=1)
         train_scores_std = np.std(train_scores, axis=1)
@@ -722,7 +724,8 @@ def plot_validation_curve(model, partition, pname, prange):
         estimator = model.estimators[algo]
         # set up plot
         train_scores, test_scores = validation_curve(
-            estimator, X, y, param_name=pname, param_range=prange,
+            estimator, get_estimator_data(algo, X), y,
+            param_name=pname, param_range=prange,
             cv=cv_folds, scoring=scorer, n_jobs=n_jobs)
         train_scores_mean = np.mean(train_scores, axis=1)
         train_scores_std = np.std(train_scores, axis=1)
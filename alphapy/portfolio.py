@@ -28,6 +28,8 @@
 
 from alphapy.frame import Frame
 from alphapy.frame import frame_name
+from alphapy.frame import get_panel
+from alphapy.frame import panel_fields
 from alphapy.frame import read_frame
 from alphapy.frame import write_frame
 from alphapy.globals import MULTIPLIERS, SSEP
@@ -39,7 +41,7 @@ import math
 import numpy as np
 from pandas import DataFrame
 from pandas import date_range
-from pandas import Series
+from pandas import DatetimeIndex
 
 
 #
@@ -98,14 +100,16 @@ class Portfolio():
         The number of positions to kick out from the portfolio.
     koby : str, optional
         The "kick out" criteria. For example, a ``koby`` value
-        of '-profit' means the three least profitable positions
-        will be closed.
+        of '-profit' means the least profitable positions will
+        be closed, and a value of 'atr' means the positions with
+        the highest ``atr`` column will be closed.
     restricted : bool, optional
         If ``True``, then the portfolio is limited to a maximum
         number of positions ``maxpos``.
     weightby : str, optional
         The weighting variable to balance the portfolio, e.g.,
-        by closing price, by volatility, or by any column.
+        by closing price, by volatility, or by any column. A
+        leading '-' inverts the weights.
     startcap : float, optional
         The amount of starting capital.
     margin : float, optional
@@ -122,6 +126,9 @@ class Portfolio():
     ----------
     portfolios : dict
         Class variable for storing all known portfolios
+    panel : alphapy.Panel
+        The aligned prices of the members, or ``None`` to look
+        up prices in each frame.
     value : float
         Class variable for storing all known portfolios
     netprofit : float
@@ -206,6 +213,7 @@ class Portfolio():
         self.netreturn = 0.0
         self.totalprofit = 0.0
         self.totalreturn = 0.0
+        self.panel = None
         # add portfolio to portfolios list
         pn = portfolio_name(group_name, tag)
         Portfolio.portfolios[pn] = self
@@ -251,7 +259,8 @@ class Position:
     profit : float
         The net profit of the current position.
     netreturn : float
-        The Return On Investment (ROI), or net return.
+        The Return On Investment (ROI), or net return, which is
+        the profit divided by the cost basis of the net position.
     opened : datetime
         Date the position is opened.
     held : int
@@ -262,8 +271,19 @@ class Position:
         The executed trades for the position so far.
     ntrades : int
         Total number of trades.
+    netpos : float
+        Running net quantity of all trades.
+    tshares : float
+        Running total of the shares traded.
+    tvalue : float
+        Running total of the traded value at the trade prices.
+    evalue : float
+        Running total of the signed entry value of the trades,
+        which is the quantity times the price.
     pdata : pandas DataFrame
         Price data for the given ``name``.
+    panel : alphapy.Panel
+        The aligned prices of the portfolio, if any.
     multiplier : float
         Multiple for instrument type (e.g., 1.0 for stocks).
 
@@ -290,7 +310,12 @@ class Position:
         self.costbasis = 0.0
         self.trades = []
         self.ntrades = 0
+        self.netpos = 0.0
+        self.tshares = 0.0
+        self.tvalue = 0.0
+        self.evalue = 0.0
         self.pdata = Frame.frames[frame_name(name, space)].df
+        self.panel = portfolio.panel
         self.multiplier = MULTIPLIERS[space.subject]
 
     # __str__
@@ -343,6 +368,42 @@ class Trade:
         self.tdate = tdate
 
 
+#
+# Function position_price
+#
+
+def position_price(position, tdate, field='close'):
+    r"""Get a price field of a position on a date.
+
+    Parameters
+    ----------
+    position : alphapy.Position
+        The position of the instrument.
+    tdate : datetime or str
+        The date of the price.
+    field : str, optional
+        The column of the price data.
+
+    Returns
+    -------
+    value : float
+        The price, or ``None`` if there is no price for the date.
+
+    Notes
+    -----
+    The price comes from the panel of the portfolio, if it has the
+    symbol and field, and otherwise from the price frame.
+
+    """
+    panel = position.panel
+    if panel is not None and position.name in panel.sindex and field in panel.findex:
+        return panel.get(position.name, tdate, field)
+    pdata = position.pdata
+    if tdate in pdata.index:
+        return float(pdata.ix[tdate][field])
+    return None
+
+
 #
 # Function add_position
 #
@@ -433,34 +494,25 @@ def valuate_position(position, tdate):
     traded (800), so 14,000 / 800 = 17.5, and the net position
     is -200.
 
+    The valuation uses the running totals of the position, which
+    ``update_position`` maintains for each trade, so its cost does
+    not grow with the number of trades.
+
     """
     # get current price
-    pdata = position.pdata
-    if tdate in pdata.index:
-        cp = float(pdata.ix[tdate]['close'])
-        # start valuation
+    cp = position_price(position, tdate)
+    if cp is not None and position.tshares:
+        # value the running totals at the current price
         multiplier = position.multiplier
-        netpos = 0
-        tts = 0     # total traded shares
-        ttv = 0     # total traded value
-        totalprofit = 0.0
-        for trade in position.trades:
-            tq = trade.quantity
-            netpos = netpos + tq
-            tts = tts + abs(tq)
-            tp = trade.price
-            pfactor = tq * multiplier
-            cv = pfactor * cp
-            cvabs = abs(cv)
-            ttv = ttv + cvabs
-            ev = pfactor * tp
-            totalprofit = totalprofit + cv - ev
+        netpos = position.netpos
+        totalprofit = multiplier * (netpos * cp - position.evalue)
         position.quantity = netpos
         position.price = cp
         position.value = abs(netpos) * multiplier * cp
         position.profit = totalprofit
-        position.costbasis = ttv / tts
-        position.netreturn = totalprofit / cvabs - 1.0
+        position.costbasis = multiplier * position.tvalue / position.tshares
+        cost = abs(netpos) * position.costbasis
+        position.netreturn = totalprofit / cost if cost else 0.0
     return position
 
 
@@ -486,6 +538,12 @@ def update_position(position, trade):
     """
     position.trades.append(trade)
     position.ntrades = position.ntrades + 1
+    # update the running totals
+    tq = trade.quantity
+    position.netpos += tq
+    position.tshares += abs(tq)
+    position.tvalue += abs(tq * trade.price)
+    position.evalue += tq * trade.price
     position.date = trade.tdate
     position.held = trade.tdate - position.opened
     position = valuate_position(position, trade.tdate)
@@ -523,9 +581,9 @@ def close_position(p, position, tdate):
     if pq != 0:
         tradesize = -pq
         position.date = tdate
-        pdata = position.pdata
-        cp = pdata.ix[tdate]['close']
-        newtrade = Trade(position.name, tradesize, cp, tdate)
+        cp = position_price(position, tdate)
+        order = Orders.lx if pq > 0 else Orders.sx
+        newtrade = Trade(position.name, order, tradesize, cp, tdate)
         p = update_portfolio(p, position, newtrade)
         position.quantity = 0
     position.status = 'closed'
@@ -650,6 +708,182 @@ def delete_portfolio(p):
     del p
 
 
+#
+# Position attributes for portfolio rules
+#
+
+rule_attributes = ['netreturn', 'price', 'profit', 'quantity', 'value']
+
+
+#
+# Orders that exit a position
+#
+
+exit_orders = [Orders.lx, Orders.sx, Orders.lh, Orders.sh]
+
+
+#
+# Function parse_rule
+#
+
+def parse_rule(variable):
+    r"""Split a rule variable into its name and sign.
+
+    Parameters
+    ----------
+    variable : str
+        The rule variable, e.g., ``-profit``.
+
+    Returns
+    -------
+    name : str
+        The position attribute or price column, e.g., ``profit``.
+    negate : bool
+        ``True`` if the variable has a leading '-'.
+
+    """
+    if variable.startswith('-'):
+        return variable[1:], True
+    return variable, False
+
+
+#
+# Function rule_value
+#
+
+def rule_value(position, tdate, name):
+    r"""Get the value of a rule variable for a position.
+
+    Parameters
+    ----------
+    position : alphapy.Position
+        The position to evaluate.
+    tdate : datetime
+        The date of the price.
+    name : str
+        A position attribute, e.g., ``profit``, or a price column.
+
+    Returns
+    -------
+    value : float
+        The attribute, or the price column on ``tdate``.
+
+    """
+    if hasattr(position, name):
+        return getattr(position, name)
+    return position_price(position, tdate, name)
+
+
+#
+# Function stop_loss_rule
+#
+
+def stop_loss_rule(netreturn, maxloss):
+    r"""Find the positions that have reached the stop loss.
+
+    Parameters
+    ----------
+    netreturn : numpy array
+        The net return of each position.
+    maxloss : float
+        The maximum loss as a fraction of the cost basis.
+
+    Returns
+    -------
+    stops : numpy array
+        ``True`` for each position to close.
+
+    """
+    return np.asarray(netreturn) <= -maxloss
+
+
+#
+# Function kick_out_rule
+#
+
+def kick_out_rule(kovalues, numpos, maxpos, kopos, lowest):
+    r"""Rank the positions and find the ones to kick out.
+
+    Parameters
+    ----------
+    kovalues : numpy array
+        The ``koby`` value of each position that can be closed.
+    numpos : int
+        The number of open positions in the portfolio.
+    maxpos : int
+        The maximum number of positions.
+    kopos : int
+        The number of extra positions to close.
+    lowest : bool
+        If ``True``, then the positions with the lowest values are
+        closed first, and otherwise the highest.
+
+    Returns
+    -------
+    kick : numpy array
+        ``True`` for each position to close.
+
+    """
+    kovalues = np.asarray(kovalues, dtype=float)
+    kick = np.zeros(len(kovalues), dtype=bool)
+    if numpos >= maxpos:
+        freepos = min(numpos - maxpos + kopos, len(kovalues))
+        if freepos > 0:
+            ranks = kovalues if lowest else -kovalues
+            kick[np.argsort(ranks, kind='mergesort')[:freepos]] = True
+    return kick
+
+
+#
+# Function balance_rule
+#
+
+def balance_rule(bdata, invert, quantity, price, multiplier, pvalue):
+    r"""Get the balanced quantity of each position.
+
+    Parameters
+    ----------
+    bdata : numpy array
+        The ``weightby`` value of each position.
+    invert : bool
+        If ``True``, then the positions with smaller values get
+        larger weights.
+    quantity : numpy array
+        The current quantity of each position.
+    price : numpy array
+        The current price of each position.
+    multiplier : float
+        Multiple for instrument type.
+    pvalue : float
+        The portfolio value to allocate across the positions.
+
+    Returns
+    -------
+    newq : numpy array
+        The target quantity of each position, with the same sign
+        as its current quantity. Positions with a missing value
+        are not changed.
+
+    """
+    bdata = np.asarray(bdata, dtype=float)
+    quantity = np.asarray(quantity, dtype=float)
+    price = np.asarray(price, dtype=float)
+    newq = quantity.copy()
+    valid = np.isfinite(bdata) & np.isfinite(price) & (price > 0)
+    bdata = bdata[valid]
+    total = bdata.sum()
+    if not total:
+        return newq
+    if invert:
+        weights = (2 * bdata.mean() - bdata) / total
+    else:
+        weights = bdata / total
+    target = weights * pvalue / (multiplier * price[valid])
+    target = np.maximum(np.trunc(target), 0.0)
+    newq[valid] = np.where(quantity[valid] < 0, -target, target)
+    return newq
+
+
 #
 # Function balance
 #
@@ -690,53 +924,38 @@ def balance(p, tdate, cashlevel):
 
     Notes
     -----
-
-    .. warning:: The portfolio management functions ``balance``,
-       ``kick_out``, and ``stop_loss`` are not part of the
-       main **StockStream** pipeline, and thus have not been
-       thoroughly tested. Feel free to exercise the code and
-       report any issues.
+    The target quantities of all of the positions are calculated
+    at once by ``balance_rule``. In ``gen_portfolio``, the same rule
+    is applied on each rebalancing day.
 
     """
-    currentcash = p.cash
-    mincash = p.mincash
     weightby = p.weightby
     if not weightby:
         weightby = 'close'
+    weightby, invert = parse_rule(weightby)
     p = valuate_portfolio(p, tdate)
     pvalue = p.value - cashlevel * p.value
-    positions = p.positions
-    bdata = np.ones(len(positions))
-    # get weighting variable values
-    if weightby[0] == "-":
-        invert = True
-        weightby = weightby[1:]
-    else:
-        invert = False
-    attrs = [aname for aname in dir(positions[0]) if not aname.startswith('_')]
-    for i, pos in enumerate(positions):
-        if weightby in attrs:
-            estr = '.'.join('pos', weightby)
-            bdata[i] = eval(estr)
-        else:
-            bdata[i] = pos.pdata.ix[tdate][weightby]
-    if invert:
-        bweights = (2 * bdata.mean() - bdata) / sum(bdata)
-    else:
-        bweights = bdata / sum(bdata)
+    positions = [pos for pos in p.positions.values()
+                 if position_price(pos, tdate) is not None]
+    if not positions:
+        return p
+    bdata = [rule_value(pos, tdate, weightby) for pos in positions]
+    quantity = np.array([pos.quantity for pos in positions])
+    cp = np.array([position_price(pos, tdate) for pos in positions])
+    newq = balance_rule(bdata, invert, quantity, cp, positions[0].multiplier, pvalue)
     # rebalance
-    for i, pos in enumerate(positions):
-        multiplier = pos.multiplier
-        bdelta = bweights[i] * pvalue - pos.value
-        cp = pos.pdata.ix[tdate]['close']
-        tradesize = math.trunc(bdelta / cp)
-        ntv = abs(tradesize) * cp * multiplier
-        if tradesize > 0:
-            order = Orders.le
-        if tradesize < 0:
-            order = Orders.se
-        exec_trade(p, pos.name, order, tradesize, cp, tdate)
-        p.cash = currentcash + bdelta - ntv
+    for pos, q, nq, c in zip(positions, quantity, newq, cp):
+        tradesize = nq - q
+        if tradesize == 0:
+            continue
+        if abs(nq) > abs(q):
+            order = Orders.le if nq > 0 else Orders.se
+        else:
+            order = Orders.lx if q > 0 else Orders.sx
+        p = update_portfolio(p, pos, Trade(pos.name, order, tradesize, c, tdate))
+        if pos.quantity == 0:
+            p = close_position(p, pos, tdate)
+            p.npos -= 1
     return p
 
 
@@ -766,42 +985,21 @@ def kick_out(p, tdate):
 
     Notes
     -----
-
-    .. warning:: The portfolio management functions ``kick_out``,
-       ``balance``, and ``stop_loss`` are not part of the
-       main **StockStream** pipeline, and thus have not been
-       thoroughly tested. Feel free to exercise the code and
-       report any issues.
+    The positions are ranked all at once by ``kick_out_rule``. In
+    ``gen_portfolio``, the same rule is applied on each rebalancing day.
 
     """
-    positions = p.positions
-    maxpos = p.maxpos
-    numpos = len(positions)
-    kovalue = np.zeros(numpos)
     koby = p.koby
     if not koby:
         koby = 'profit'
-    if koby[0] == "-":
-        descending = True
-        koby = koby[1:]
-    else:
-        descending = False
-    attrs = [aname for aname in dir(positions[0]) if not aname.startswith('_')]
-    for i, pos in enumerate(positions):
-        if koby in attrs:
-            estr = '.'.join('pos', koby)
-            kovalue[i] = eval(estr)
-        else:
-            kovalue[i] = pos.pdata.ix[tdate][koby]
-    koorder = np.argsort(np.argsort(kovalues))
-    if descending:
-        koorder = [i for i in reversed(koorder)]
-    if numpos >= maxpos:
-        freepos = numpos - maxpos + p.kopos
-        # close the top freepos positions
-        if freepos > 0:
-            for i in range(freepos):
-                p = close_position(p, positions[koorder[i]], tdate)
+    koby, lowest = parse_rule(koby)
+    positions = list(p.positions.values())
+    kovalues = [rule_value(pos, tdate, koby) for pos in positions]
+    kick = kick_out_rule(kovalues, len(positions), p.maxpos, p.kopos, lowest)
+    for pos, closed in zip(positions, kick):
+        if closed:
+            p = close_position(p, pos, tdate)
+            p.npos -= 1
     return p
 
 
@@ -826,21 +1024,18 @@ def stop_loss(p, tdate):
 
     Notes
     -----
-
-    .. warning:: The portfolio management functions ``stop_loss``,
-       ``balance``, and ``kick_out`` are not part of the
-       main **StockStream** pipeline, and thus have not been
-       thoroughly tested. Feel free to exercise the code and
-       report any issues.
+    The net returns of all of the positions are tested at once by
+    ``stop_loss_rule``. In ``gen_portfolio``, the same rule is applied
+    on each rebalancing day.
 
     """
-    positions = p.positions
-    maxloss = p.maxloss
-    for key in positions:
-        pos = positions[key]
-        nr = pos.netreturn
-        if nr <= -maxloss:
+    positions = list(p.positions.values())
+    netreturn = [pos.netreturn for pos in positions]
+    stops = stop_loss_rule(netreturn, p.maxloss)
+    for pos, closed in zip(positions, stops):
+        if closed:
             p = close_position(p, pos, tdate)
+            p.npos -= 1
     return p
 
 
@@ -979,13 +1174,16 @@ def exec_trade(p, name, order, quantity, price, tdate):
     else:
         pos = Position(p, name, tdate)
         newpos = True
+    # an exit cannot open a new position, e.g., after a stop loss
+    if newpos and order in exit_orders:
+        logger.info("No Position in %s to Exit", name)
+        return 0
     # check the dynamic position sizing variable
     if not p.posby:
         tsize = quantity
     else:
         if order == Orders.le or order == Orders.se:
-            pf = Frame.frames[frame_name(name, p.space)].df
-            cv = float(pf.ix[tdate][p.posby])
+            cv = position_price(pos, tdate, p.posby)
             tsize = math.trunc((p.value * p.fixedfrac) / cv)
             if quantity < 0:
                 tsize = -tsize
@@ -1012,12 +1210,266 @@ def exec_trade(p, name, order, quantity, price, tdate):
     return tsize
 
 
+#
+# Function portfolio_engine
+#
+
+def portfolio_engine(p, symbols, dates, trades, close, available,
+                     rdays=None, fields=None):
+    r"""Run the trades through the portfolio with array accounting.
+
+    Parameters
+    ----------
+    p : alphapy.Portfolio
+        The empty portfolio, which holds the final state on return.
+    symbols : list
+        The symbols of the rows of ``close``.
+    dates : pandas.DatetimeIndex
+        The days of the columns of ``close``.
+    trades : list
+        The ``(day, row, order, quantity, price, tdate, tavail, tclose,
+        tsizer)`` tuple of each trade in the order of execution, where
+        ``day`` is the column of the trade date, ``row`` is the row of
+        the symbol, and ``tavail``, ``tclose``, and ``tsizer`` are the
+        availability, close, and position sizing value at ``tdate``.
+    close : numpy array
+        The closing price of each symbol on each day.
+    available : numpy array
+        ``True`` where a symbol has a price on a day.
+    rdays : numpy array, optional
+        ``True`` for the days when the stop-loss, kick-out, and
+        balancing rules of the portfolio are applied at the close.
+    fields : dict, optional
+        The aligned values of the price fields named by ``koby``
+        or ``weightby``, with the same shape as ``close``.
+
+    Returns
+    -------
+    returns : list
+        The net return of the portfolio for each day.
+    values : numpy array
+        The signed value of each position for each day before the
+        daily valuation, with shape ``(days, symbols)``.
+    cash : numpy array
+        The cash of the portfolio for each day.
+    transactions : list
+        The ``(day, amount, price, symbol)`` tuple of each trade.
+
+    Notes
+    -----
+    This engine reproduces ``exec_trade`` and ``valuate_portfolio``
+    with unrestricted allocation. Instead of replaying the trades of
+    each position at every valuation, it keeps the running quantity,
+    traded shares, and entry value of every symbol in arrays, so a
+    trade costs O(1) and the daily mark of all of the positions is a
+    single array operation on a column of ``close``.
+
+    On the rule days, the positions with a price are tested against
+    all of the rules at once with ``stop_loss_rule``, ``kick_out_rule``,
+    and ``balance_rule``, and only the resulting trades are executed.
+    An exit order for a symbol that is already flat, e.g., after a
+    stop loss, is skipped instead of opening a reverse position.
+
+    """
+
+    nsyms, ndays = close.shape
+    multiplier = MULTIPLIERS[p.space.subject]
+    if fields is None:
+        fields = {}
+
+    # Running totals and marks for each symbol
+
+    isopen = np.zeros(nsyms, dtype=bool)
+    netpos = np.zeros(nsyms)
+    tshares = np.zeros(nsyms)
+    tvalue = np.zeros(nsyms)
+    evalue = np.zeros(nsyms)
+    quantity = np.zeros(nsyms)
+    price = np.zeros(nsyms)
+    value = np.zeros(nsyms)
+    profit = np.zeros(nsyms)
+    costbasis = np.zeros(nsyms)
+    netreturn = np.zeros(nsyms)
+    mpos = ['flat'] * nsyms
+    tlists = [[] for _ in range(nsyms)]
+    order = []
+    book = {'netreturn' : netreturn,
+            'price'     : price,
+            'profit'    : profit,
+            'quantity'  : quantity,
+            'value'     : value}
+
+    # Initialize the daily output
+
+    returns = []
+    values = np.zeros((ndays, nsyms))
+    cash = np.zeros(ndays)
+    transactions = []
+
+    # Execute a trade and update the running totals of the symbol
+
+    def execute(i, trade, tavail, tclose):
+        ppq = abs(quantity[i])
+        allocation = abs(quantity[i] + trade.quantity) - ppq
+        if allocation == 0:
+            logger.info("Trade Allocation for %s is 0", trade.name)
+            return
+        if not isopen[i]:
+            isopen[i] = True
+            order.append(i)
+            p.npos += 1
+        # update the running totals, then mark at the trade date
+        tlists[i].append(trade)
+        netpos[i] += trade.quantity
+        tshares[i] += abs(trade.quantity)
+        tvalue[i] += abs(trade.quantity * trade.price)
+        evalue[i] += trade.quantity * trade.price
+        if tavail:
+            quantity[i] = netpos[i]
+            price[i] = tclose
+            value[i] = abs(netpos[i]) * multiplier * tclose
+            profit[i] = multiplier * (netpos[i] * tclose - evalue[i])
+            costbasis[i] = multiplier * tvalue[i] / tshares[i]
+            cost = abs(netpos[i]) * costbasis[i]
+            netreturn[i] = profit[i] / cost if cost else 0.0
+        if quantity[i] > 0:
+            mpos[i] = 'long'
+        if quantity[i] < 0:
+            mpos[i] = 'short'
+        p.date = trade.tdate
+        p.cash -= trade.price * multiplier * (abs(quantity[i]) - ppq)
+        # if net position is zero, then close the position
+        if quantity[i] == 0:
+            isopen[i] = False
+            order.remove(i)
+            netpos[i] = tshares[i] = tvalue[i] = evalue[i] = 0.0
+            price[i] = value[i] = profit[i] = costbasis[i] = netreturn[i] = 0.0
+            mpos[i] = 'flat'
+            tlists[i] = []
+            p.npos -= 1
+
+    # Execute a rule trade at the close
+
+    def adjust(day, i, tsize):
+        q = quantity[i]
+        if abs(q + tsize) > abs(q):
+            torder = Orders.le if q + tsize > 0 else Orders.se
+        else:
+            torder = Orders.lx if q > 0 else Orders.sx
+        cp = close[i, day]
+        transactions.append((day, tsize, cp, symbols[i]))
+        execute(i, Trade(symbols[i], torder, tsize, cp, dates[day]), True, cp)
+
+    # Get the values of a rule variable for some symbols
+
+    def rule_values(name, rows, day):
+        if name in book:
+            return book[name][rows]
+        return fields[name][rows, day]
+
+    # Iterate through the days, updating the portfolio.
+
+    t = 0
+    ntrades = len(trades)
+    for day in range(ndays):
+        # process today's trades
+        while t < ntrades and trades[t][0] == day:
+            _, i, torder, tquantity, tprice, tdate, tavail, tclose, tsizer = trades[t]
+            t += 1
+            name = symbols[i]
+            if torder in exit_orders and not isopen[i]:
+                # a rule may have closed the position already
+                logger.info("No Position in %s to Exit", name)
+                continue
+            if not p.posby:
+                tsize = tquantity
+            elif torder == Orders.le or torder == Orders.se:
+                tsize = math.trunc((p.value * p.fixedfrac) / float(tsizer))
+                if tquantity < 0:
+                    tsize = -tsize
+            else:
+                tsize = -float(quantity[i])
+            if tsize != 0:
+                transactions.append((day, tsize, tprice, name))
+            else:
+                logger.info("Trade could not be executed for %s", name)
+            execute(i, Trade(name, torder, tsize, tprice, tdate), tavail, tclose)
+        # record the current positions
+        values[day] = np.where(isopen, np.where(quantity > 0, value, -value), 0.0)
+        cash[day] = p.cash
+        # mark the positions to the close and update the returns
+        marked = isopen & available[:, day]
+        quantity[marked] = netpos[marked]
+        price[marked] = close[marked, day]
+        value[marked] = np.abs(netpos[marked]) * multiplier * close[marked, day]
+        profit[marked] = multiplier * (netpos[marked] * close[marked, day] - evalue[marked])
+        costbasis[marked] = multiplier * tvalue[marked] / tshares[marked]
+        cost = np.abs(netpos[marked]) * costbasis[marked]
+        netreturn[marked] = np.divide(profit[marked], cost, out=np.zeros(len(cost)),
+                                      where=cost != 0)
+        prev_value = p.value
+        p.value = np.add.accumulate(np.append(p.cash, value[order]))[-1]
+        p.netprofit = p.value - prev_value
+        p.netreturn = p.value / prev_value - 1.0
+        returns.append(p.netreturn)
+        # apply the portfolio rules to the positions with a price
+        if rdays is not None and rdays[day]:
+            if p.maxloss:
+                rows = np.flatnonzero(isopen & available[:, day])
+                for i in rows[stop_loss_rule(netreturn[rows], p.maxloss)]:
+                    adjust(day, i, -float(quantity[i]))
+            if p.maxpos:
+                rows = np.flatnonzero(isopen & available[:, day])
+                koby, lowest = parse_rule(p.koby)
+                kick = kick_out_rule(rule_values(koby, rows, day), len(order),
+                                     p.maxpos, p.kopos, lowest)
+                for i in rows[kick]:
+                    adjust(day, i, -float(quantity[i]))
+            if p.weightby:
+                rows = np.flatnonzero(isopen & available[:, day])
+                weightby, invert = parse_rule(p.weightby)
+                pvalue = p.value - p.mincash * p.value
+                newq = balance_rule(rule_values(weightby, rows, day), invert,
+                                    quantity[rows], close[rows, day], multiplier, pvalue)
+                for i, q in zip(rows, newq):
+                    if q != quantity[i]:
+                        adjust(day, i, float(q - quantity[i]))
+
+    # Record the open positions in the portfolio.
+
+    for i in order:
+        tlist = tlists[i]
+        pos = Position(p, symbols[i], tlist[0].tdate)
+        pos.trades = tlist
+        pos.ntrades = len(tlist)
+        pos.date = tlist[-1].tdate
+        pos.held = pos.date - pos.opened
+        pos.quantity = quantity[i]
+        pos.mpos = mpos[i]
+        pos.price = price[i]
+        pos.value = value[i]
+        pos.netpos = netpos[i]
+        pos.tshares = tshares[i]
+        pos.tvalue = tvalue[i]
+        pos.evalue = evalue[i]
+        pos.profit = profit[i]
+        pos.costbasis = costbasis[i]
+        pos.netreturn = netreturn[i]
+        p.positions[symbols[i]] = pos
+    p.weights = [0] * len(order)
+    p.totalprofit = p.value - p.startcap
+    p.totalreturn = p.value / p.startcap - 1.0
+    return returns, values, cash, transactions
+
+
 #
 # Function gen_portfolio
 #
 
 def gen_portfolio(model, system, group, tframe,
-                  startcap=100000, posby='close'):
+                  startcap=100000, posby='close', rebalance=None,
+                  maxpos=None, kopos=0, koby='-profit', weightby=None,
+                  maxloss=None):
     r"""Create a portfolio from a trades frame.
 
     Parameters
@@ -1034,6 +1486,23 @@ def gen_portfolio(model, system, group, tframe,
         Starting capital.
     posby : str
         The position sizing column in the price dataframe.
+    rebalance : str, optional
+        The pandas frequency of the rule days, e.g., ``W`` or ``M``.
+        The rules are applied at the close of the last trading day
+        of each period. If ``None``, then no rules are applied.
+    maxpos : int, optional
+        The maximum number of positions for the kick-out rule.
+        If ``None``, then positions are not kicked out.
+    kopos : int, optional
+        The number of extra positions to kick out.
+    koby : str, optional
+        The kick-out criteria, e.g., ``-profit``.
+    weightby : str, optional
+        The weighting variable for balancing the positions. If
+        ``None``, then the positions are not balanced.
+    maxloss : float, optional
+        The stop loss as a fraction of the cost basis. If ``None``,
+        then there is no stop loss.
 
     Returns
     -------
@@ -1055,6 +1524,12 @@ def gen_portfolio(model, system, group, tframe,
     * Positions File
     * Transactions File
 
+    The prices of the group are aligned in a panel once, and
+    ``portfolio_engine`` runs the
+    trades with array accounting. The results are the same as
+    executing each trade with ``exec_trade`` and calling
+    ``valuate_portfolio`` every day.
+
     """
 
     logger.info("Creating Portfolio for System %s", system)
@@ -1075,10 +1550,15 @@ def gen_portfolio(model, system, group, tframe,
     p = Portfolio(gname,
                   system,
                   gspace,
-                  startcap = startcap,
+                  maxpos = maxpos,
                   posby = posby,
+                  kopos = kopos,
+                  koby = koby,
                   restricted = False,
-                  fixedfrac = ff)
+                  weightby = weightby,
+                  startcap = startcap,
+                  fixedfrac = ff,
+                  maxloss = maxloss)
     if not p:
         raise MemoryError("Could not allocate Portfolio")
 
@@ -1086,46 +1566,78 @@ def gen_portfolio(model, system, group, tframe,
 
     start = tframe.index[0]
     end = tframe.index[-1]
-    trange = np.unique(tframe.index.map(lambda x: x.date().strftime('%Y-%m-%d'))).tolist()
     drange = date_range(start, end).map(lambda x: x.date().strftime('%Y-%m-%d'))
 
+    # Align the closing prices of the symbols on the calendar days.
+
+    symbols = list(gmembers)
+    tnames = tframe['name'].tolist()
+    symbols.extend(sorted(set(tnames) - set(symbols)))
+    rows = {symbol : i for i, symbol in enumerate(symbols)}
+    rules = []
+    if rebalance:
+        if maxpos:
+            rules.append(parse_rule(koby)[0])
+        if weightby:
+            rules.append(parse_rule(weightby)[0])
+    fields = list(panel_fields)
+    for field in [posby] + rules:
+        if field and field not in fields and field not in rule_attributes:
+            fields.append(field)
+    p.panel = get_panel(gname, gspace, symbols, fields)
+    dates = DatetimeIndex(drange)
+    close, available = p.panel.align(symbols, dates)
+
+    # Find the last trading day of each rebalancing period.
+
+    rdays = None
+    rfields = {}
+    if rebalance:
+        logger.info("Applying Portfolio Rules with Frequency %s", rebalance)
+        trading = np.flatnonzero(available.any(axis=0))
+        periods = dates[trading].to_period(rebalance)
+        rdays = np.zeros(len(dates), dtype=bool)
+        rdays[trading[np.append(periods[1:] != periods[:-1], True)]] = True
+        for field in rules:
+            if field not in rule_attributes:
+                rfields[field] = p.panel.align(symbols, dates, field)[0]
+
+    # Look up the close and sizing values at the time of each trade.
+
+    tdates = tframe.index
+    tdays = dates.get_indexer(tdates.normalize())
+    trows = np.array([p.panel.sindex[name] for name in tnames], dtype=int)
+    tcols = p.panel.dates.get_indexer(tdates)
+    tavail = (tcols >= 0) & p.panel.available[trows, tcols]
+    tclose = p.panel.field('close')[trows, tcols]
+    tsizer = np.zeros(len(tframe))
+    if posby:
+        tsizer = p.panel.field(posby)[trows, tcols]
+
+    # Execute the trades of each day in their original order.
+
+    trades = []
+    torders = tframe['order'].tolist()
+    tquantities = tframe['quantity'].tolist()
+    tprices = tframe['price'].tolist()
+    for t in np.argsort(tdays, kind='mergesort'):
+        if tdays[t] >= 0:
+            trades.append((tdays[t], rows[tnames[t]], torders[t], tquantities[t],
+                           tprices[t], tdates[t], tavail[t], tclose[t], tsizer[t]))
+    returns, values, cash, transactions = portfolio_engine(p, symbols, dates, trades,
+                                                           close, available,
+                                                           rdays, rfields)
+
     # Initialize return, position, and transaction data.
 
-    rs = []
+    rf = DataFrame({'return' : returns}, index=drange, columns=['return'])
     pcols = list(gmembers)
     pcols.extend(['cash'])
-    pf = DataFrame(index=drange, columns=pcols).fillna(0.0)
-    ts = []
-
-    # Iterate through the date range, updating the portfolio.
-    for d in drange:
-        # process today's trades
-        if d in trange:
-            trades = tframe.ix[d]
-            if isinstance(trades, Series):
-                trades = DataFrame(trades).transpose()
-            for t in trades.iterrows():
-                tdate = t[0]
-                row = t[1]
-                tsize = exec_trade(p, row['name'], row['order'], row['quantity'], row['price'], tdate)
-                if tsize != 0:
-                    ts.append((d, [tsize, row['price'], row['name']]))
-                else:
-                    logger.info("Trade could not be executed for %s", row['name'])
-        # iterate through current positions
-        positions = p.positions
-        pfrow = pf.ix[d]
-        for key in positions:
-            pos = positions[key]
-            if pos.quantity > 0:
-                value = pos.value
-            else:
-                value = -pos.value
-            pfrow[pos.name] = value
-        pfrow['cash'] = p.cash
-        # update the portfolio returns
-        p = valuate_portfolio(p, d)
-        rs.append((d, [p.netreturn]))
+    pf = DataFrame(np.column_stack((values[:, :len(gmembers)], cash)),
+                   index=drange, columns=pcols)
+    tf = DataFrame([[tsize, tprice, name] for day, tsize, tprice, name in transactions],
+                   index=[drange[day] for day, tsize, tprice, name in transactions],
+                   columns=['amount', 'price', 'symbol'])
 
     # Create systems directory path
 
@@ -1135,7 +1647,6 @@ def gen_portfolio(model, system, group, tframe,
 
     logger.info("Recording Returns Frame")
     rspace = Space(system, 'returns', gspace.fractal)
-    rf = DataFrame.from_items(rs, orient='index', columns=['return'])
     rfname = frame_name(gname, rspace)
     write_frame(rf, system_dir, rfname, extension, separator,
                 index=True, index_label='date')
@@ -1154,7 +1665,6 @@ def gen_portfolio(model, system, group, tframe,
 
     logger.info("Recording Transactions Frame")
     tspace = Space(system, 'transactions', gspace.fractal)
-    tf = DataFrame.from_items(ts, orient='index', columns=['amount', 'price', 'symbol'])
     tfname = frame_name(gname, tspace)
     write_frame(tf, system_dir, tfname, extension, separator,
                 index=True, index_label='date')
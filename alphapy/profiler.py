@@ -0,0 +1,266 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : profiler
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.globals import PSEP, SSEP, USEP
+from alphapy.utilities import get_datestamp
+
+from contextlib import contextmanager
+import json
+import logging
+import os
+import pandas as pd
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+#
+# Initialize logger
+#
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Profile columns
+#
+
+profile_columns = ['stage', 'algorithm', 'depth', 'wall', 'cpu',
+                   'child_cpu', 'peak_rss', 'rss_growth']
+
+
+#
+# Function get_peak_rss
+#
+
+def get_peak_rss():
+    r"""Get the peak resident set size of this process.
+
+    Parameters
+    ----------
+    None : None
+
+    Returns
+    -------
+    peak_rss : float
+        The peak memory in megabytes, or 0.0 if the platform
+        does not report resource usage.
+
+    """
+    if resource is None:
+        return 0.0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes
+    if sys.platform == 'darwin':
+        return maxrss / (1024.0 * 1024.0)
+    return maxrss / 1024.0
+
+
+#
+# Function get_child_cpu
+#
+
+def get_child_cpu():
+    r"""Get the CPU time of the finished child processes.
+
+    Parameters
+    ----------
+    None : None
+
+    Returns
+    -------
+    child_cpu : float
+        The user and system time in seconds of the child processes
+        that have been waited for, or 0.0 if not available.
+
+    """
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+#
+# Class Profiler
+#
+
+class Profiler(object):
+    """Record the time and memory of each stage of a pipeline.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        If ``False``, then stages are not measured.
+
+    Attributes
+    ----------
+    stages : list
+        A dictionary for each stage in the order that the stages
+        started, with the columns in ``profile_columns``.
+    path : list
+        The names of the stages that are running, outermost first.
+
+    Notes
+    -----
+    Wall time comes from ``time.perf_counter`` and CPU time from
+    ``time.process_time``. The CPU time of worker processes is only
+    reported by the operating system once they exit, so it appears
+    in ``child_cpu`` of the stage that shut the workers down. Peak
+    RSS is the high-water mark of the process at the end of a stage,
+    and ``rss_growth`` is how much the stage raised it.
+
+    Examples
+    --------
+
+    >>> profiler = Profiler()
+    >>> with profiler.stage('first_fit', 'RF'):
+    >>>     est.fit(X_train, y_train)
+
+    """
+
+    # __init__
+
+    def __init__(self,
+                 enabled = True):
+        self.enabled = enabled
+        self.stages = []
+        self.path = []
+
+    # stage
+
+    @contextmanager
+    def stage(self, name, algo=None):
+        r"""Measure a stage of the pipeline.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage. Nested stages are named by their
+            path, e.g., ``create_features/pca``.
+        algo : str, optional
+            The algorithm of the stage, if any.
+
+        """
+        if not self.enabled:
+            yield
+            return
+        self.path.append(name)
+        record = dict.fromkeys(profile_columns)
+        record['stage'] = SSEP.join(self.path)
+        record['algorithm'] = algo if algo else ''
+        record['depth'] = len(self.path) - 1
+        self.stages.append(record)
+        start_rss = get_peak_rss()
+        start_child = get_child_cpu()
+        start_cpu = time.process_time()
+        start_wall = time.perf_counter()
+        try:
+            yield
+        finally:
+            record['wall'] = time.perf_counter() - start_wall
+            record['cpu'] = time.process_time() - start_cpu
+            record['child_cpu'] = get_child_cpu() - start_child
+            record['peak_rss'] = get_peak_rss()
+            record['rss_growth'] = record['peak_rss'] - start_rss
+            self.path.pop()
+            logger.info("Stage %s%s: %.3f s wall, %.3f s CPU, %.1f MB peak RSS",
+                        record['stage'], ' [%s]' % algo if algo else '',
+                        record['wall'], record['cpu'], record['peak_rss'])
+
+    # report
+
+    def report(self, directory):
+        r"""Write the stage profile as JSON and CSV files.
+
+        Parameters
+        ----------
+        directory : str
+            The directory for the report, usually ``model``.
+
+        Returns
+        -------
+        file_name : str
+            The path of the report without its extension, or ``None``
+            if there is nothing to report.
+
+        """
+        if not self.enabled or not self.stages:
+            return None
+        file_name = SSEP.join([directory, USEP.join(['profile', get_datestamp()])])
+        logger.info("Writing Stage Profile to %s.{json,csv}", file_name)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(PSEP.join([file_name, 'json']), 'w') as f:
+            json.dump(self.stages, f, indent=2)
+        pf = pd.DataFrame(self.stages, columns=profile_columns)
+        pf.to_csv(PSEP.join([file_name, 'csv']), index=False, float_format='%.6f')
+        # log the top-level stages by wall time
+        top = pf[pf['depth'] == 0].sort_values('wall', ascending=False)
+        total = top['wall'].sum()
+        for _, row in top.iterrows():
+            logger.info("%-30s %8s %10.3f s %5.1f%%", row['stage'], row['algorithm'],
+                        row['wall'], 100.0 * row['wall'] / total if total else 0.0)
+        return file_name
+
+
+#
+# Function profile_stage
+#
+
+def profile_stage(model, name, algo=None):
+    r"""Measure a stage with the profiler of a model.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        The model object with a ``profiler``.
+    name : str
+        The name of the stage.
+    algo : str, optional
+        The algorithm of the stage, if any.
+
+    Returns
+    -------
+    stage : context manager
+        The context for running the stage.
+
+    Examples
+    --------
+
+    >>> with profile_stage(model, 'create_interactions'):
+    >>>     all_features = create_interactions(model, all_features)
+
+    """
+    profiler = getattr(model, 'profiler', None)
+    if profiler is None:
+        profiler = Profiler(False)
+    return profiler.stage(name, algo)
@@ -0,0 +1,207 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : scorer
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.features import transform_features
+from alphapy.globals import ModelType
+from alphapy.model import get_model_config
+from alphapy.model import load_feature_map
+from alphapy.model import load_predictor
+from alphapy.model import Model
+
+import logging
+import pandas as pd
+from scipy import sparse
+
+
+#
+# Initialize logger
+#
+
+logger = logging.getLogger(__name__)
+
+
+#
+# Class Scorer
+#
+
+class Scorer(object):
+    """Score new data in process with the saved predictor.
+
+    Parameters
+    ----------
+    specs : dict, optional
+        The model specifications. If ``None``, then the ``model.yml``
+        file of the current project is read.
+
+    Attributes
+    ----------
+    model : alphapy.Model
+        The model object with the saved feature map.
+    predictor : object
+        The saved predictor from training.
+    features : list
+        The original features in training order.
+    dtypes : dict
+        The data type of each original feature.
+    dense : bool
+        ``True`` if the predictor requires a dense feature matrix.
+
+    Notes
+    -----
+    The predictor and feature map are loaded once, so each call
+    only transforms and scores the given rows. The treatments,
+    encoders, scalers, and support vectors are the ones fitted in
+    training, with the exception of t-SNE features.
+
+    Examples
+    --------
+
+    >>> scorer = Scorer()
+    >>> scorer.predict_proba({'Pclass' : 3, 'Sex' : 'male', 'Age' : 22.0})
+
+    """
+
+    # __init__
+
+    def __init__(self,
+                 specs=None):
+        # read the project configuration if necessary
+        if specs is None:
+            specs = get_model_config()
+        specs = dict(specs)
+        specs['predict_mode'] = True
+        # scoring a few rows is faster without worker processes
+        specs['n_jobs'] = 1
+        # load the feature map and predictor
+        directory = specs['directory']
+        self.model = load_feature_map(Model(specs), directory)
+        self.predictor = load_predictor(directory)
+        self.features = self.model.feature_map.get('features')
+        self.dtypes = self.model.feature_map.get('dtypes', {})
+        self.dense = 'keras' in type(self.predictor).__module__
+
+    # __str__
+
+    def __str__(self):
+        return type(self.predictor).__name__
+
+    # get_frame
+
+    def get_frame(self, data):
+        r"""Convert raw features to a frame in training order.
+
+        Parameters
+        ----------
+        data : dict, list, or pandas.DataFrame
+            A single row as a dictionary, a list of dictionaries,
+            or a frame of rows.
+
+        Returns
+        -------
+        X : pandas.DataFrame
+            The original features, with any missing features as NaN.
+
+        """
+        if isinstance(data, dict):
+            data = [data]
+        X = pd.DataFrame(data)
+        if self.features is not None:
+            X = X.reindex(columns=self.features)
+        for c in X.columns:
+            if c in self.dtypes and str(X[c].dtype) != self.dtypes[c]:
+                try:
+                    X[c] = X[c].astype(self.dtypes[c])
+                except (TypeError, ValueError):
+                    logger.info("Feature %s cannot be converted to %s",
+                                c, self.dtypes[c])
+        return X
+
+    # transform
+
+    def transform(self, data):
+        r"""Transform raw features for the predictor.
+
+        Parameters
+        ----------
+        data : dict, list, or pandas.DataFrame
+            The rows to transform.
+
+        Returns
+        -------
+        all_features : numpy array or scipy.sparse.csr_matrix
+            The feature matrix for the predictor.
+
+        """
+        X = self.get_frame(data)
+        all_features = transform_features(self.model, X)
+        if self.dense and sparse.issparse(all_features):
+            all_features = all_features.toarray()
+        return all_features
+
+    # predict
+
+    def predict(self, data):
+        r"""Predict labels or values for the given rows.
+
+        Parameters
+        ----------
+        data : dict, list, or pandas.DataFrame
+            The rows to score.
+
+        Returns
+        -------
+        preds : numpy array
+            The predictions.
+
+        """
+        return self.predictor.predict(self.transform(data))
+
+    # predict_proba
+
+    def predict_proba(self, data):
+        r"""Predict probabilities of the target class for the given rows.
+
+        Parameters
+        ----------
+        data : dict, list, or pandas.DataFrame
+            The rows to score.
+
+        Returns
+        -------
+        probas : numpy array
+            The probabilities of the target class.
+
+        Raises
+        ------
+        TypeError
+            Probabilities are for classification only.
+
+        """
+        if self.model.specs['model_type'] != ModelType.classification:
+            raise TypeError("Probabilities are for classification only")
+        return self.predictor.predict_proba(self.transform(data))[:, 1]
@@ -0,0 +1,516 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : server
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.globals import ModelType
+
+import asyncio
+from bisect import bisect_left
+import json
+import logging
+import time
+
+
+#
+# Initialize logger
+#
+
+logger = logging.getLogger(__name__)
+
+
+#
+# HTTP status lines
+#
+
+http_status = {200 : 'OK',
+               400 : 'Bad Request',
+               404 : 'Not Found',
+               405 : 'Method Not Allowed',
+               413 : 'Payload Too Large',
+               500 : 'Internal Server Error'}
+
+
+#
+# Class Histogram
+#
+
+class Histogram(object):
+    """Count observations in fixed buckets.
+
+    Parameters
+    ----------
+    bounds : list
+        The ascending upper bounds of the buckets. Larger values
+        are counted in an overflow bucket.
+
+    Attributes
+    ----------
+    bounds : list
+        The upper bounds of the buckets.
+    counts : list
+        The number of observations in each bucket.
+    count : int
+        The total number of observations.
+    total : float
+        The sum of the observations.
+    maximum : float
+        The largest observation.
+
+    """
+
+    # __init__
+
+    def __init__(self,
+                 bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    # add
+
+    def add(self, value):
+        r"""Record an observation."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    # percentile
+
+    def percentile(self, q):
+        r"""Estimate a percentile as the upper bound of its bucket.
+
+        Parameters
+        ----------
+        q : float
+            The percentile from 0 to 100.
+
+        Returns
+        -------
+        value : float
+            The estimated percentile, or the maximum observation
+            for the overflow bucket.
+
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q / 100.0 * self.count
+        running = 0
+        for i, n in enumerate(self.counts):
+            running += n
+            if running >= rank and n > 0:
+                return self.bounds[i] if i < len(self.bounds) else self.maximum
+        return self.maximum
+
+    # stats
+
+    def stats(self):
+        r"""Summarize the histogram as a dictionary."""
+        mean = self.total / self.count if self.count else 0.0
+        buckets = [[b, n] for b, n in zip(self.bounds + ['inf'], self.counts)]
+        return {'count'   : self.count,
+                'mean'    : mean,
+                'p50'     : self.percentile(50),
+                'p90'     : self.percentile(90),
+                'p99'     : self.percentile(99),
+                'max'     : self.maximum,
+                'buckets' : buckets}
+
+
+#
+# Class Batcher
+#
+
+class Batcher(object):
+    """Coalesce scoring requests into micro-batches.
+
+    Parameters
+    ----------
+    scorer : alphapy.Scorer
+        The scorer for the saved predictor.
+    batch_size : int
+        The maximum number of rows in a batch.
+    max_wait : float
+        The maximum time in milliseconds to wait for more rows after
+        the first request of a batch arrives.
+
+    Attributes
+    ----------
+    queue : asyncio.Queue
+        The pending requests, each a list of rows with its future,
+        created by ``start`` in the running event loop.
+    latency : alphapy.Histogram
+        Request latency in milliseconds, from arrival to response.
+    batches : alphapy.Histogram
+        The number of rows in each batch.
+    throughput : alphapy.Histogram
+        The rows per second scored in each batch.
+
+    """
+
+    # __init__
+
+    def __init__(self,
+                 scorer,
+                 batch_size,
+                 max_wait):
+        self.scorer = scorer
+        self.batch_size = batch_size
+        self.max_wait = max_wait / 1000.0
+        self.classify = scorer.model.specs['model_type'] == ModelType.classification
+        self.queue = None
+        self.latency = Histogram([0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000])
+        self.batches = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256, 512])
+        self.throughput = Histogram([10, 100, 1000, 10000, 100000, 1000000])
+        self.started = time.time()
+
+    # start
+
+    async def start(self):
+        r"""Create the request queue and start scoring batches.
+
+        Returns
+        -------
+        runner : asyncio.Task
+            The task running ``run``, to be cancelled at shutdown.
+
+        """
+        self.queue = asyncio.Queue()
+        return asyncio.ensure_future(self.run())
+
+    # score
+
+    async def score(self, rows):
+        r"""Queue rows for scoring and wait for the results.
+
+        Parameters
+        ----------
+        rows : list
+            The rows to score, each a dictionary of original features.
+
+        Returns
+        -------
+        results : dict
+            The predictions and, for classification, the probabilities.
+
+        """
+        if self.queue is None:
+            raise RuntimeError("Batcher is not started")
+        start = time.time()
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((rows, future))
+        results = await future
+        self.latency.add((time.time() - start) * 1000.0)
+        return results
+
+    # next_batch
+
+    async def next_batch(self, batch):
+        r"""Collect requests until the batch is full or the wait expires.
+
+        The requests are appended to ``batch`` as they arrive, so the
+        caller can still fail them if collecting raises an error.
+
+        """
+        loop = asyncio.get_event_loop()
+        batch.append(await self.queue.get())
+        nrows = len(batch[0][0])
+        deadline = loop.time() + self.max_wait
+        while nrows < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            nrows += len(item[0])
+
+    # run
+
+    async def run(self):
+        r"""Score batches until cancelled.
+
+        An error in one batch fails only the requests of that batch,
+        so the server keeps scoring later requests.
+
+        """
+        while True:
+            batch = []
+            try:
+                await self.next_batch(batch)
+                await self.score_batch(batch)
+            except asyncio.CancelledError:
+                self.fail(batch, RuntimeError("Server is stopping"))
+                raise
+            except Exception as e:
+                logger.error("Scoring failed: %s", e)
+                self.fail(batch, e)
+
+    # score_batch
+
+    async def score_batch(self, batch):
+        r"""Score the rows of a batch and resolve its futures.
+
+        If a batch of several requests fails, each request is scored
+        on its own, so one bad row returns an error only to the
+        request that sent it.
+
+        """
+        loop = asyncio.get_event_loop()
+        rows = [row for request, future in batch for row in request]
+        start = time.time()
+        try:
+            # score off the event loop so requests keep arriving
+            preds, probas = await loop.run_in_executor(None, self.predict, rows)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                raise
+            logger.info("Scoring %d requests together failed: %s", len(batch), e)
+            for item in batch:
+                try:
+                    await self.score_batch([item])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.fail([item], e)
+            return
+        elapsed = max(time.time() - start, 1e-9)
+        self.batches.add(len(rows))
+        self.throughput.add(len(rows) / elapsed)
+        # return each request its own slice of the results
+        i = 0
+        for request, future in batch:
+            j = i + len(request)
+            results = {'predictions' : preds[i:j]}
+            if probas is not None:
+                results['probabilities'] = probas[i:j]
+            if not future.done():
+                future.set_result(results)
+            i = j
+
+    # fail
+
+    def fail(self, batch, error):
+        r"""Return an error to the requests of a batch still waiting."""
+        for request, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    # predict
+
+    def predict(self, rows):
+        r"""Score rows with the predictor, transforming them only once."""
+        X = self.scorer.transform(rows)
+        predictor = self.scorer.predictor
+        preds = predictor.predict(X).tolist()
+        probas = predictor.predict_proba(X)[:, 1].tolist() if self.classify else None
+        return preds, probas
+
+    # stats
+
+    def stats(self):
+        r"""Summarize the latency and throughput of the server."""
+        uptime = time.time() - self.started
+        return {'uptime'     : uptime,
+                'requests'   : self.latency.count,
+                'rows'       : self.batches.total,
+                'latency'    : self.latency.stats(),
+                'batch_size' : self.batches.stats(),
+                'throughput' : self.throughput.stats()}
+
+
+#
+# Function write_response
+#
+
+async def write_response(writer, status, body):
+    r"""Write a JSON response and close the connection.
+
+    Parameters
+    ----------
+    writer : asyncio.StreamWriter
+        The stream of the client connection.
+    status : int
+        The HTTP status code.
+    body : dict
+        The content of the response.
+
+    Returns
+    -------
+    None : None
+
+    """
+    content = json.dumps(body).encode('utf-8')
+    header = ("HTTP/1.1 %d %s\r\n"
+              "Content-Type: application/json\r\n"
+              "Content-Length: %d\r\n"
+              "Connection: close\r\n\r\n") % (status, http_status[status], len(content))
+    writer.write(header.encode('latin-1') + content)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+#
+# Function handle_request
+#
+
+async def handle_request(batcher, reader, writer, max_body):
+    r"""Handle one HTTP request.
+
+    Parameters
+    ----------
+    batcher : alphapy.Batcher
+        The batcher for scoring requests.
+    reader : asyncio.StreamReader
+        The stream of the client request.
+    writer : asyncio.StreamWriter
+        The stream of the client connection.
+    max_body : int
+        The maximum number of bytes in a request body. A larger
+        ``Content-Length`` is rejected before the body is read.
+
+    Returns
+    -------
+    None : None
+
+    Notes
+    -----
+    ``POST /predict`` scores a JSON object or a list of objects of
+    original features, ``GET /stats`` returns the histograms, and
+    ``GET /health`` checks that the server is running.
+
+    """
+    try:
+        request_line = await reader.readline()
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value.strip())
+        if length < 0:
+            raise ValueError("Negative Content-Length")
+        if length > max_body:
+            await write_response(writer, 413, {'error' : 'Body exceeds %d bytes' % max_body})
+            return
+        body = await reader.readexactly(length) if length else b''
+    except (ValueError, asyncio.IncompleteReadError):
+        await write_response(writer, 400, {'error' : 'Malformed request'})
+        return
+
+    if path == '/health':
+        await write_response(writer, 200, {'status' : 'ok'})
+    elif path == '/stats':
+        await write_response(writer, 200, batcher.stats())
+    elif path != '/predict':
+        await write_response(writer, 404, {'error' : 'Unknown path %s' % path})
+    elif method != 'POST':
+        await write_response(writer, 405, {'error' : 'Use POST for %s' % path})
+    else:
+        try:
+            rows = json.loads(body.decode('utf-8'))
+        except ValueError:
+            await write_response(writer, 400, {'error' : 'Body must be JSON'})
+            return
+        if isinstance(rows, dict):
+            rows = [rows]
+        if not isinstance(rows, list) or \
+           not all(isinstance(row, dict) for row in rows):
+            await write_response(writer, 400, {'error' : 'Body must be an object or a list of objects'})
+            return
+        if not rows:
+            await write_response(writer, 400, {'error' : 'No rows to score'})
+            return
+        try:
+            results = await batcher.score(rows)
+            await write_response(writer, 200, results)
+        except Exception as e:
+            await write_response(writer, 500, {'error' : str(e)})
+
+
+#
+# Function serve
+#
+
+def serve(scorer, host, port, batch_size, max_wait, max_body=1 << 20):
+    r"""Run the scoring server until interrupted.
+
+    Parameters
+    ----------
+    scorer : alphapy.Scorer
+        The scorer for the saved predictor.
+    host : str
+        The interface to listen on, e.g., ``127.0.0.1``.
+    port : int
+        The port to listen on.
+    batch_size : int
+        The maximum number of rows in a batch.
+    max_wait : float
+        The maximum wait in milliseconds to fill a batch.
+    max_body : int, optional
+        The maximum number of bytes in a request body.
+
+    Returns
+    -------
+    None : None
+
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    batcher = Batcher(scorer, batch_size, max_wait)
+    runner = loop.run_until_complete(batcher.start())
+
+    async def handler(reader, writer):
+        await handle_request(batcher, reader, writer, max_body)
+
+    server = loop.run_until_complete(asyncio.start_server(handler, host, port))
+    logger.info("Serving predictions on http://%s:%d [batch size: %d, max wait: %.1f ms]",
+                host, port, batch_size, max_wait)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping Server")
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        runner.cancel()
+        try:
+            loop.run_until_complete(runner)
+        except asyncio.CancelledError:
+            pass
+        loop.close()
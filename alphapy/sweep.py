@@ -0,0 +1,554 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : sweep
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.frame import frame_name
+from alphapy.frame import write_frame
+from alphapy.globals import Orders
+from alphapy.globals import SSEP
+from alphapy.market_variables import vcompile
+from alphapy.market_variables import vrun
+from alphapy.space import Space
+from alphapy.system import system_frame
+from alphapy.system import trade_engine
+from alphapy.utilities import get_worker_count
+
+from collections import OrderedDict
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import logging
+import math
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import shutil
+import tempfile
+
+
+#
+# Initialize logger
+#
+
+logger = logging.getLogger(__name__)
+
+
+#
+# The system parameters that can be swept, in column order
+#
+
+sweep_params = ['longentry', 'shortentry', 'longexit', 'shortexit',
+                'holdperiod', 'scale']
+
+signal_params = ['longentry', 'shortentry', 'longexit', 'shortexit']
+
+
+#
+# Function sweep_grid
+#
+
+def sweep_grid(system, grid):
+    r"""Expand a grid of system parameters into combinations.
+
+    Parameters
+    ----------
+    system : alphapy.System
+        The system with the default parameters.
+    grid : dict
+        The values to sweep for each parameter in ``sweep_params``,
+        e.g., ``{'longentry' : ['xmaup_10_50', 'xmaup_20_100']}``.
+        A single value is the same as a list of one value.
+
+    Returns
+    -------
+    combos : list
+        Each combination as a dictionary of all ``sweep_params``,
+        where a parameter not in ``grid`` keeps its ``system`` value.
+
+    Raises
+    ------
+    ValueError
+        If the grid has a parameter that cannot be swept.
+
+    """
+    unknown = [k for k in grid if k not in sweep_params]
+    if unknown:
+        raise ValueError("Cannot sweep system parameters: %s" % unknown)
+    values = []
+    for param in sweep_params:
+        if param in grid:
+            pvalues = grid[param]
+            if not isinstance(pvalues, list):
+                pvalues = [pvalues]
+        else:
+            pvalues = [getattr(system, param)]
+        values.append(pvalues)
+    combos = [OrderedDict(zip(sweep_params, combo)) for combo in product(*values)]
+    return combos
+
+
+#
+# Function sweep_signals
+#
+
+def sweep_signals(pf, plan, signals, intraday):
+    r"""Evaluate all of the signals of a sweep on one price frame.
+
+    Parameters
+    ----------
+    pf : pandas.DataFrame
+        The price frame of the symbol.
+    plan : list
+        The compiled plan of ``signals`` from ``vcompile``.
+    signals : list
+        All of the distinct signals in the sweep.
+    intraday : bool
+        If True, then read the ``end_of_day`` column.
+
+    Returns
+    -------
+    data : dict
+        The ``dates`` index, the ``close`` prices, the ``eod`` flags,
+        and the ``signals`` as a dictionary of boolean arrays.
+
+    Notes
+    -----
+    The signals are compiled into a single plan, so an indicator
+    shared by several signals, e.g., the 50-bar moving average of
+    ``xmaup_10_50`` and ``xmaup_20_50``, is computed only once.
+    The plan is compiled by the caller, so a worker process neither
+    recompiles it nor needs the variable definitions. Only the boolean
+    arrays are kept for the combinations.
+
+    """
+    pf = vrun(pf, plan)
+    nbars = pf.shape[0]
+    if intraday:
+        eod = pf['end_of_day'].values.astype(bool)
+    else:
+        eod = np.zeros(nbars, dtype=bool)
+    data = {'dates'   : pf.index,
+            'close'   : pf['close'].values.astype(float),
+            'eod'     : eod,
+            'signals' : {s : pf[s].values.astype(bool) for s in signals}}
+    return data
+
+
+#
+# Function sweep_frame
+#
+
+def sweep_frame(close, signals, eod, combos):
+    r"""Trade every combination on one price series.
+
+    Parameters
+    ----------
+    close : numpy array
+        The closing price of each bar.
+    signals : dict
+        The boolean array of each signal used by ``combos``.
+    eod : numpy array
+        End-of-day flag for each bar.
+    combos : list
+        The combinations from ``sweep_grid``.
+
+    Returns
+    -------
+    pnl : numpy array
+        The return of each combination on each bar, with shape
+        ``(combinations, bars)``, for a position of one unit.
+    ntrades : numpy array
+        The number of entries for each combination.
+
+    Notes
+    -----
+    A position is opened at the close of the entry bar, so the
+    return of bar ``i`` is the position held at the close of bar
+    ``i - 1`` times the percent change of the close.
+
+    """
+    nbars = len(close)
+    pchange = np.zeros(nbars)
+    if nbars > 1:
+        pchange[1:] = close[1:] / close[:-1] - 1.0
+    # the trade engine is fastest with lists
+    close = close.tolist()
+    eod = eod.tolist()
+    never = [False] * nbars
+    lists = {s : v.tolist() for s, v in signals.items()}
+    pnl = np.zeros((len(combos), nbars))
+    ntrades = np.zeros(len(combos), dtype=int)
+    for j, combo in enumerate(combos):
+        le, se, lx, sx = [lists[combo[x]] if combo[x] else never
+                          for x in signal_params]
+        trades = trade_engine(close, le, se, lx, sx, eod, combo['holdperiod'],
+                              combo['scale'], 1)
+        if not trades:
+            continue
+        bars, orders, quantities, _ = zip(*trades)
+        delta = np.zeros(nbars)
+        np.add.at(delta, np.array(bars), np.array(quantities, dtype=float))
+        position = np.cumsum(delta)
+        pnl[j, 1:] = position[:-1] * pchange[1:]
+        ntrades[j] = sum([1 for x in orders if x == Orders.le or x == Orders.se])
+    return pnl, ntrades
+
+
+#
+# Function sweep_store
+#
+
+def sweep_store(arrays, dir_name, k):
+    r"""Store the arrays of a symbol for the sweep workers.
+
+    Parameters
+    ----------
+    arrays : tuple
+        The ``(close, signals, eod)`` arrays of the symbol.
+    dir_name : str
+        The directory of the ``.npy`` files.
+    k : int
+        The position of the symbol in the group.
+
+    Returns
+    -------
+    files : tuple
+        The ``close``, ``signals``, and ``eod`` files, with the names
+        of the signals in the order of the rows of the signals file.
+
+    """
+    close, signals, eod = arrays
+    names = list(signals)
+    matrix = np.zeros((len(names), len(close)), dtype=bool)
+    for i, s in enumerate(names):
+        matrix[i] = signals[s]
+    files = []
+    for tag, data in [('close', close), ('signals', matrix), ('eod', eod)]:
+        file_name = SSEP.join([dir_name, 'sweep_%d_%s.npy' % (k, tag)])
+        np.save(file_name, data)
+        files.append(file_name)
+    return tuple(files) + (names,)
+
+
+#
+# Function sweep_load
+#
+
+def sweep_load(files):
+    r"""Map the arrays of a symbol stored by ``sweep_store``.
+
+    Parameters
+    ----------
+    files : tuple
+        The files and signal names from ``sweep_store``.
+
+    Returns
+    -------
+    arrays : tuple
+        The ``(close, signals, eod)`` arrays of the symbol, which
+        are paged in from disk on demand.
+
+    """
+    close_file, signals_file, eod_file, names = files
+    matrix = np.load(signals_file, mmap_mode='r')
+    signals = {s : matrix[i] for i, s in enumerate(names)}
+    return (np.load(close_file, mmap_mode='r'), signals,
+            np.load(eod_file, mmap_mode='r'))
+
+
+#
+# Function sweep_symbols
+#
+
+def sweep_symbols(arrays, locs, ndates, allocation, combos):
+    r"""Trade a chunk of combinations on some symbols and sum the profit.
+
+    Parameters
+    ----------
+    arrays : list
+        The ``(close, signals, eod)`` arrays of each symbol.
+    locs : list
+        The positions of the bars of each symbol in the group dates.
+    ndates : int
+        The number of group dates.
+    allocation : float
+        The capital allocated to each symbol.
+    combos : list
+        The combinations from ``sweep_grid``.
+
+    Returns
+    -------
+    pnl : numpy array
+        The profit of each combination on each group date, summed
+        over the symbols, with shape ``(combinations, dates)``.
+    ntrades : numpy array
+        The number of entries for each combination.
+
+    """
+    pnl = np.zeros((len(combos), ndates))
+    ntrades = np.zeros(len(combos), dtype=int)
+    for (close, signals, eod), loc in zip(arrays, locs):
+        spnl, strades = sweep_frame(close, signals, eod, combos)
+        pnl[:, loc] += allocation * spnl
+        ntrades += strades
+    return pnl, ntrades
+
+
+#
+# Function sweep_chunk
+#
+
+def sweep_chunk(files, locs, ndates, allocation, combos):
+    r"""Trade a chunk of combinations on some symbols in a sweep worker.
+
+    The arrays of the symbols are memory-mapped from the files of
+    ``sweep_store``, so a task carries only the file names and the
+    chunk. The parameters and results are the same as for
+    ``sweep_symbols``.
+
+    """
+    arrays = [sweep_load(sfiles) for sfiles in files]
+    return sweep_symbols(arrays, locs, ndates, allocation, combos)
+
+
+#
+# Function sweep_metrics
+#
+
+def sweep_metrics(pnl, startcap, periods):
+    r"""Calculate the performance of each combination.
+
+    Parameters
+    ----------
+    pnl : numpy array
+        The profit of each combination on each date, with shape
+        ``(combinations, dates)``.
+    startcap : float
+        The starting capital.
+    periods : int
+        The number of bars per year for the Sharpe ratio.
+
+    Returns
+    -------
+    metrics : pandas.DataFrame
+        The ``netprofit``, ``return``, ``drawdown``, and ``sharpe``
+        of each combination.
+
+    """
+    equity = startcap + np.cumsum(pnl, axis=1)
+    prior = np.hstack([np.full((pnl.shape[0], 1), float(startcap)), equity[:, :-1]])
+    returns = pnl / prior
+    peak = np.maximum.accumulate(np.maximum(equity, startcap), axis=1)
+    drawdown = (equity / peak - 1.0).min(axis=1)
+    sd = returns.std(axis=1)
+    sharpe = np.zeros(len(sd))
+    nonzero = sd > 0
+    sharpe[nonzero] = math.sqrt(periods) * returns.mean(axis=1)[nonzero] / sd[nonzero]
+    metrics = DataFrame({'netprofit' : equity[:, -1] - startcap,
+                         'return'    : equity[:, -1] / startcap - 1.0,
+                         'drawdown'  : drawdown,
+                         'sharpe'    : sharpe},
+                        columns=['netprofit', 'return', 'drawdown', 'sharpe'])
+    return metrics
+
+
+#
+# Function sweep_system
+#
+
+def sweep_system(model,
+                 system,
+                 group,
+                 grid,
+                 intraday = False,
+                 startcap = 100000,
+                 periods = 252,
+                 chunk_size = 256,
+                 n_jobs = 1):
+    r"""Backtest a system over a grid of its parameters.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        The model object with specifications.
+    system : alphapy.System
+        The system with the default parameters.
+    group : alphapy.Group
+        The group of symbols to trade.
+    grid : dict
+        The values to sweep for each system parameter.
+    intraday : bool, optional
+        If true, this is an intraday system.
+    startcap : float, optional
+        The starting capital, which is divided equally among the
+        symbols for each unit of a position.
+    periods : int, optional
+        The number of bars per year for the Sharpe ratio.
+    chunk_size : int, optional
+        The number of combinations evaluated at once.
+    n_jobs : int, optional
+        The number of worker processes, where -1 means all cores.
+
+    Returns
+    -------
+    rf : pandas.DataFrame
+        One row for each combination with its parameters, number
+        of trades, net profit, return, maximum drawdown, and Sharpe
+        ratio, in grid order.
+
+    Raises
+    ------
+    ValueError
+        The group has no members.
+
+    Notes
+    -----
+    The signals of every symbol are evaluated once and cached as
+    boolean arrays, so the indicators are not recomputed for each
+    combination. The combinations are then traded in chunks, and
+    only the profit of the current chunk is held in memory. In
+    parallel mode, the arrays of the symbols are stored in temporary
+    ``.npy`` files that the workers map into memory, and each worker
+    trades a share of the symbols and returns their summed profit,
+    so a chunk needs one ``(combinations, dates)`` array per worker.
+
+    The returns are for an equal-dollar allocation of ``startcap``
+    to each symbol, without the rules and position sizing of
+    ``gen_portfolio``, so use the sweep to rank the combinations
+    and then run the best ones through the full pipeline.
+
+    """
+
+    system_name = system.name
+    combos = sweep_grid(system, grid)
+    ncombos = len(combos)
+    logger.info("Sweeping %d Combinations of System %s", ncombos, system_name)
+
+    # Unpack the model data.
+
+    directory = model.specs['directory']
+    extension = model.specs['extension']
+    separator = model.specs['separator']
+
+    # Extract the group information.
+
+    gname = group.name
+    gmembers = list(group.members)
+    gspace = group.space
+    nsyms = len(gmembers)
+    if not nsyms:
+        raise ValueError("Group %s has no members to sweep" % gname)
+
+    # Evaluate the signals of every symbol once
+
+    signals = []
+    for combo in combos:
+        for param in signal_params:
+            if combo[param] and combo[param] not in signals:
+                signals.append(combo[param])
+    logger.info("Evaluating %d Signals for %d Symbols", len(signals), nsyms)
+    plan = vcompile(signals)
+
+    nworkers = get_worker_count(n_jobs, nsyms)
+    executor = None
+    tmp_dir = None
+    if nworkers > 1:
+        logger.info("Sweeping with %d workers", nworkers)
+        executor = ProcessPoolExecutor(max_workers=nworkers)
+    try:
+        if executor:
+            futures = [executor.submit(sweep_signals,
+                                       system_frame(model, system, gspace, symbol),
+                                       plan, signals, intraday)
+                       for symbol in gmembers]
+            sdata = [future.result() for future in futures]
+        else:
+            sdata = [sweep_signals(system_frame(model, system, gspace, symbol),
+                                   plan, signals, intraday)
+                     for symbol in gmembers]
+
+        # Align the symbols on the dates of the group
+
+        dates = sdata[0]['dates']
+        for data in sdata[1:]:
+            dates = dates.union(data['dates'])
+        locs = [dates.get_indexer(data['dates']) for data in sdata]
+        ndates = len(dates)
+        allocation = float(startcap) / nsyms
+        arrays = [(data['close'], data['signals'], data['eod']) for data in sdata]
+        del sdata
+
+        # Store the arrays once for the workers to map
+
+        if executor:
+            tmp_dir = tempfile.mkdtemp(prefix='sweep')
+            files = [sweep_store(sarrays, tmp_dir, k)
+                     for k, sarrays in enumerate(arrays)]
+            del arrays
+            shares = np.array_split(np.arange(nsyms), nworkers)
+
+        # Trade the combinations in chunks
+
+        results = []
+        for start in range(0, ncombos, chunk_size):
+            chunk = combos[start:start + chunk_size]
+            if executor:
+                futures = [executor.submit(sweep_chunk, [files[k] for k in share],
+                                           [locs[k] for k in share], ndates,
+                                           allocation, chunk)
+                           for share in shares]
+                pnl = np.zeros((len(chunk), ndates))
+                ntrades = np.zeros(len(chunk), dtype=int)
+                for future in as_completed(futures):
+                    spnl, strades = future.result()
+                    pnl += spnl
+                    ntrades += strades
+                    del spnl
+            else:
+                pnl, ntrades = sweep_symbols(arrays, locs, ndates, allocation, chunk)
+            metrics = sweep_metrics(pnl, startcap, periods)
+            metrics.insert(0, 'trades', ntrades)
+            results.append(metrics)
+            logger.info("Swept %d of %d Combinations", start + len(chunk), ncombos)
+    finally:
+        if executor:
+            executor.shutdown()
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # Create the results frame
+
+    pframe = DataFrame(combos, columns=sweep_params)
+    rf = pd.concat([pframe, pd.concat(results, ignore_index=True)], axis=1)
+    sspace = Space(system_name, "sweep", gspace.fractal)
+    system_dir = SSEP.join([directory, 'systems'])
+    write_frame(rf, system_dir, frame_name(gname, sspace), extension, separator)
+    best = rf['sharpe'].idxmax()
+    logger.info("Best Combination: %s", dict(rf.loc[best, sweep_params]))
+
+    # Return results frame
+    return rf
@@ -33,10 +33,16 @@ from alphapy.frame import write_frame
 from alphapy.globals import Orders
 from alphapy.globals import BSEP, SSEP
 from alphapy.market_variables import vexec
+from alphapy.market_variables import vrestore
+from alphapy.market_variables import vstate
 from alphapy.space import Space
 from alphapy.portfolio import Trade
+from alphapy.utilities import get_worker_count
 from alphapy.utilities import most_recent_file
 
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from heapq import merge
 import logging
 import numbers
 import pandas as pd
@@ -168,24 +174,57 @@ def trade_system(model, system, space, intraday, name, quantity):
 
     """
 
+    # Read in the price frame, then evaluate the system
+
+    pf = system_frame(model, system, space, name)
+    signals = [system.longentry, system.shortentry,
+               system.longexit, system.shortexit]
+    tradelist = trade_frame(pf, name, signals, system.holdperiod,
+                            system.scale, intraday, quantity)
+    return tradelist
+
+
+#
+# Function system_frame
+#
+
+def system_frame(model, system, space, name):
+    r"""Get the price frame for trading a system.
+
+    Parameters
+    ----------
+    model : alphapy.Model
+        The model object with specifications.
+    system : alphapy.System
+        The long/short system to run.
+    space : alphapy.Space
+        Namespace of instrument prices.
+    name : str
+        The symbol to trade.
+
+    Returns
+    -------
+    pf : pandas.DataFrame
+        The price frame, including a ``probability`` column
+        if the system uses model output as a signal.
+
+    Other Parameters
+    ----------------
+    Frame.frames : dict
+        All of the data frames containing price data.
+
+    """
+
     # Unpack the model data.
 
     directory = model.specs['directory']
     extension = model.specs['extension']
     separator = model.specs['separator']
 
-    # Unpack the system parameters.
-
-    longentry = system.longentry
-    shortentry = system.shortentry
-    longexit = system.longexit
-    shortexit = system.shortexit
-    holdperiod = system.holdperiod
-    scale = system.scale
-
     # Determine whether or not this is a model-driven system.
 
-    entries_and_exits = [longentry, shortentry, longexit, shortexit]
+    entries_and_exits = [system.longentry, system.shortentry,
+                         system.longexit, system.shortexit]
     active_signals = [x for x in entries_and_exits if x is not None]
     use_model = False
     for signal in active_signals:
@@ -210,10 +249,150 @@ def trade_system(model, system, space, intraday, name, quantity):
         # add probability column to price frame
         pf = pd.concat([pf, probs_frame], axis=1)
 
+    return pf
+
+
+#
+# Function trade_frame
+#
+
+def trade_frame(pf, name, signals, holdperiod, scale, intraday, quantity,
+                vdefs=None):
+    r"""Trade a system on the given price frame.
+
+    Parameters
+    ----------
+    pf : pandas.DataFrame
+        The price frame of the symbol.
+    name : str
+        The symbol to trade.
+    signals : list
+        The long entry, short entry, long exit, and short exit
+        signals, where a missing signal is ``None``.
+    holdperiod : int
+        Holding period of a position.
+    scale : bool
+        Add to a position for a signal in the same direction.
+    intraday : bool
+        If True, then run an intraday system.
+    quantity : float
+        The amount of the ``name`` to trade, e.g., number of shares
+    vdefs : tuple, optional
+        Variable definitions from ``vstate`` to restore when
+        running in a worker process.
+
+    Returns
+    -------
+    tradelist : list
+        List of trade entries and exits, ordered by date.
+
+    """
+
+    # Restore the variable definitions in a worker process
+
+    if vdefs:
+        vrestore(vdefs)
+
     # Evaluate the long and short events in the price frame
 
-    for signal in active_signals:
-        vexec(pf, signal)
+    for signal in signals:
+        if signal is not None:
+            vexec(pf, signal)
+
+    # Extract the price and signal arrays, then generate trades
+
+    close = pf['close'].tolist()
+    nbars = len(close)
+    le, se, lx, sx = [signal_array(pf, x) for x in signals]
+    if intraday:
+        eod = signal_array(pf, 'end_of_day')
+    else:
+        eod = [False] * nbars
+    trades = trade_engine(close, le, se, lx, sx, eod, holdperiod, scale, quantity)
+    dates = pf.index
+    tradelist = [(dates[i], [name, order, tq, tp]) for i, order, tq, tp in trades]
+    return tradelist
+
+
+#
+# Function signal_array
+#
+
+def signal_array(pf, signal):
+    r"""Convert a signal column into a list of truth values.
+
+    Parameters
+    ----------
+    pf : pandas.DataFrame
+        The frame containing the evaluated signal.
+    signal : str
+        Name of the signal column. If ``None``, the signal never fires.
+
+    Returns
+    -------
+    values : list
+        The truth value of the signal for each bar.
+
+    Notes
+    -----
+    The conversion follows Python truth testing, so a missing value
+    (NaN) is treated as ``True``, just as in a row-by-row test.
+
+    """
+    if signal:
+        values = pf[signal].values.astype(bool).tolist()
+    else:
+        values = [False] * pf.shape[0]
+    return values
+
+
+#
+# Function trade_engine
+#
+
+def trade_engine(close, le, se, lx, sx, eod, holdperiod, scale, quantity):
+    r"""Generate the trades for a single price series.
+
+    Parameters
+    ----------
+    close : list
+        The closing price of each bar.
+    le : list
+        Long entry signal for each bar.
+    se : list
+        Short entry signal for each bar.
+    lx : list
+        Long exit signal for each bar.
+    sx : list
+        Short exit signal for each bar.
+    eod : list
+        End-of-day flag for each bar. Positions are closed on
+        these bars, so pass all ``False`` values for daily data.
+    holdperiod : int
+        Holding period of a position.
+    scale : bool
+        Add to a position for a signal in the same direction.
+    quantity : float
+        The amount to trade, e.g., number of shares
+
+    Returns
+    -------
+    trades : list
+        List of ``(bar, order, quantity, price)`` tuples, where
+        ``bar`` is the integer position of the trade in the series.
+
+    Notes
+    -----
+    When no position is open, nothing can happen until the next
+    entry signal, so the engine jumps directly to that bar instead
+    of walking through every bar in between.
+
+    """
+
+    # Locate the bars with an entry signal
+
+    entries = [i for i, (x, y) in enumerate(zip(le, se)) if x or y]
+    nentries = len(entries)
 
     # Initialize trading state variables
 
@@ -222,84 +401,85 @@ def trade_system(model, system, space, intraday, name, quantity):
     h = 0
     p = 0
     q = quantity
-    tradelist = []
-
-    # Loop through prices and generate trades
-
-    for dt, row in pf.iterrows():
+    trades = []
+
+    # Loop through the bars and generate trades
+
+    i = 0
+    nbars = len(close)
+    while i < nbars:
+        # when flat, skip ahead to the next entry signal
+        if not inlong and not inshort:
+            k = bisect_left(entries, i)
+            if k == nentries:
+                break
+            i = entries[k]
         # get closing price
-        c = row['close']
-        if intraday:
-            bar_number = row['bar_number']
-            end_of_day = row['end_of_day']            
-        # evaluate entry and exit conditions
-        lerow = row[longentry] if longentry else None
-        serow = row[shortentry] if shortentry else None
-        lxrow = row[longexit] if longexit else None
-        sxrow = row[shortexit] if shortexit else None
+        c = close[i]
         # process the long and short events
-        if lerow:
+        if le[i]:
             if p < 0:
                 # short active, so exit short
-                tradelist.append((dt, [name, Orders.sx, -p, c]))
+                trades.append((i, Orders.sx, -p, c))
                 inshort = False
                 h = 0
                 p = 0
             if p == 0 or scale:
                 # go long (again)
-                tradelist.append((dt, [name, Orders.le, q, c]))
+                trades.append((i, Orders.le, q, c))
                 inlong = True
                 p = p + q
-        elif serow:
+        elif se[i]:
             if p > 0:
                 # long active, so exit long
-                tradelist.append((dt, [name, Orders.lx, -p, c]))
+                trades.append((i, Orders.lx, -p, c))
                 inlong = False
                 h = 0
                 p = 0
             if p == 0 or scale:
                 # go short (again)
-                tradelist.append((dt, [name, Orders.se, -q, c]))
+                trades.append((i, Orders.se, -q, c))
                 inshort = True
                 p = p - q
         # check exit conditions
-        if inlong and h > 0 and lxrow:
+        if inlong and h > 0 and lx[i]:
             # long active, so exit long
-            tradelist.append((dt, [name, Orders.lx, -p, c]))
+            trades.append((i, Orders.lx, -p, c))
             inlong = False
             h = 0
             p = 0
-        if inshort and h > 0 and sxrow:
+        if inshort and h > 0 and sx[i]:
             # short active, so exit short
-            tradelist.append((dt, [name, Orders.sx, -p, c]))
+            trades.append((i, Orders.sx, -p, c))
             inshort = False
             h = 0
             p = 0
         # if a holding period was given, then check for exit
         if holdperiod and h >= holdperiod:
             if inlong:
-                tradelist.append((dt, [name, Orders.lh, -p, c]))
+                trades.append((i, Orders.lh, -p, c))
                 inlong = False
             if inshort:
-                tradelist.append((dt, [name, Orders.sh, -p, c]))
+                trades.append((i, Orders.sh, -p, c))
                 inshort = False
             h = 0
             p = 0
         # increment the hold counter
         if inlong or inshort:
             h += 1
-            if intraday and end_of_day:
+            if eod[i]:
                 if inlong:
                     # long active, so exit long
-                    tradelist.append((dt, [name, Orders.lx, -p, c]))
+                    trades.append((i, Orders.lx, -p, c))
                     inlong = False
                 if inshort:
                     # short active, so exit short
-                    tradelist.append((dt, [name, Orders.sx, -p, c]))
+                    trades.append((i, Orders.sx, -p, c))
                     inshort = False
                 h = 0
                 p = 0
-    return tradelist
+        i += 1
+    return trades
 
 
 #
@@ -310,7 +490,8 @@ def run_system(model,
                system,
                group,
                intraday = False,
-               quantity = 1):
+               quantity = 1,
+               n_jobs = 1):
     r"""Run a system for a given group, creating a trades frame.
 
     Parameters
@@ -325,12 +506,23 @@ def run_system(model,
         If true, this is an intraday system.
     quantity : float, optional
         The amount to trade for each symbol, e.g., number of shares
+    n_jobs : int, optional
+        The number of worker processes for trading the symbols in
+        parallel, where -1 means all cores. The default of 1 trades
+        the symbols one after another in this process.
 
     Returns
     -------
     tf : pandas.DataFrame
         All of the trades for this ``group``.
 
+    Notes
+    -----
+    Each symbol is traded independently, so in parallel mode each
+    price frame is shipped to a worker process along with the variable
+    definitions. The per-symbol trade lists are already in date order,
+    so they are combined with a k-way merge instead of a full sort.
+
     """
 
     system_name = system.name
@@ -345,28 +537,37 @@ def run_system(model,
     # Extract the group information.
 
     gname = group.name
-    gmembers = group.members
+    gmembers = list(group.members)
     gspace = group.space
 
     # Run the system for each member of the group
 
-    gtlist = []
-    for symbol in gmembers:
-        # generate the trades for this member
-        tlist = trade_system(model, system, gspace, intraday, symbol, quantity)
-        if tlist:
-            # add trades to global trade list
-            for item in tlist:
-                gtlist.append(item)
-        else:
+    nworkers = get_worker_count(n_jobs, len(gmembers))
+    if nworkers > 1:
+        logger.info("Trading %d symbols with %d workers", len(gmembers), nworkers)
+        signals = [system.longentry, system.shortentry,
+                   system.longexit, system.shortexit]
+        vdefs = vstate()
+        with ProcessPoolExecutor(max_workers=nworkers) as executor:
+            futures = [executor.submit(trade_frame,
+                                       system_frame(model, system, gspace, symbol),
+                                       symbol, signals, system.holdperiod,
+                                       system.scale, intraday, quantity, vdefs)
+                       for symbol in gmembers]
+            tlists = [future.result() for future in futures]
+    else:
+        tlists = [trade_system(model, system, gspace, intraday, symbol, quantity)
+                  for symbol in gmembers]
+    for symbol, tlist in zip(gmembers, tlists):
+        if not tlist:
             logger.info("No trades for symbol %s", symbol)
 
     # Create group trades frame
 
     tf = None
+    gtlist = list(merge(*tlists, key=lambda x: x[0]))
     if gtlist:
         tspace = Space(system_name, "trades", group.space.fractal)
-        gtlist = sorted(gtlist, key=lambda x: x[0])
         tf = DataFrame.from_items(gtlist, orient='index', columns=Trade.states)
         tfname = frame_name(gname, tspace)
         system_dir = SSEP.join([directory, 'systems'])
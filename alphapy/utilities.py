@@ -34,11 +34,13 @@ import glob
 import inspect
 from itertools import groupby
 import logging
+from multiprocessing import cpu_count
 import numpy as np
 import os
 from os import listdir
 from os.path import isfile, join
 import re
+from scipy import sparse
 
 
 #
@@ -67,6 +69,39 @@ def get_datestamp():
     return datestamp
 
 
+#
+# Function get_worker_count
+#
+
+def get_worker_count(n_jobs, ntasks=None):
+    r"""Get the number of worker processes for a parallel job.
+
+    Parameters
+    ----------
+    n_jobs : int
+        Number of jobs to run in parallel, where -1 means all cores
+        and -2 means all cores but one, and so on.
+    ntasks : int, optional
+        The number of tasks to run, which caps the number of workers.
+
+    Returns
+    -------
+    nworkers : int
+        The number of workers, always at least 1.
+
+    """
+    ncpus = cpu_count()
+    if not n_jobs:
+        nworkers = 1
+    elif n_jobs < 0:
+        nworkers = max(ncpus + 1 + n_jobs, 1)
+    else:
+        nworkers = n_jobs
+    if ntasks is not None:
+        nworkers = min(nworkers, max(ntasks, 1))
+    return nworkers
+
+
 #
 # Function most_recent_file
 #
@@ -95,6 +130,41 @@ def most_recent_file(directory, file_spec):
     return file_name
 
 
+#
+# Function np_memmap_data
+#
+
+def np_memmap_data(data, dir_name, file_name):
+    r"""Store a NumPy array and map it back into memory.
+
+    Parameters
+    ----------
+    data : numpy array
+        The array to store.
+    dir_name : str
+        Full directory specification.
+    file_name : str
+        Name of the ``.npy`` file, excluding the extension.
+
+    Returns
+    -------
+    mmap : numpy.memmap
+        A copy-on-write view of the stored array, which is paged in
+        from disk on demand. Arrays of objects cannot be mapped and
+        are returned unchanged, as are sparse matrices.
+
+    """
+    if sparse.issparse(data) or data.dtype.hasobject:
+        logger.info("Cannot map a sparse matrix or objects to %s", file_name)
+        return data
+    output_file = PSEP.join([file_name, 'npy'])
+    output = SSEP.join([dir_name, output_file])
+    logger.info("Mapping %s array to %s", data.shape, output)
+    np.save(output, data)
+    mmap = np.load(output, mmap_mode='c')
+    return mmap
+
+
 #
 # Function np_store_data
 #
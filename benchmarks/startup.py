@@ -0,0 +1,171 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : startup
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+import argparse
+import subprocess
+import sys
+
+
+#
+# Entry points of the command line tools
+#
+
+entry_points = {'alphapy' : 'alphapy.__main__',
+                'mflow'   : 'alphapy.market_flow',
+                'sflow'   : 'alphapy.sport_flow'}
+
+
+#
+# Function time_imports
+#
+
+def time_imports(module):
+    r"""Time the imports of a module in a fresh interpreter.
+
+    Parameters
+    ----------
+    module : str
+        The module to import, e.g., ``alphapy.__main__``.
+
+    Returns
+    -------
+    timings : list
+        The ``(module, self, cumulative)`` times in microseconds of
+        each import, in the order that the imports completed.
+
+    Notes
+    -----
+    The times come from the ``-X importtime`` option of Python 3.7
+    and later, which writes one line to stderr for each import.
+
+    """
+    command = [sys.executable, '-X', 'importtime', '-c', 'import %s' % module]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError("Could not import %s:\n%s" % (module, result.stderr))
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        timings.append((fields[2].rstrip(), int(fields[0]), int(fields[1])))
+    return timings
+
+
+#
+# Function get_package_times
+#
+
+def get_package_times(timings):
+    r"""Sum the import times by top-level package.
+
+    Parameters
+    ----------
+    timings : list
+        The ``(module, self, cumulative)`` times from ``time_imports``.
+
+    Returns
+    -------
+    packages : dict
+        The total self time of each top-level package in microseconds,
+        so every import is counted once.
+
+    """
+    packages = {}
+    for name, self_time, _ in timings:
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + self_time
+    return packages
+
+
+#
+# Function report_startup
+#
+
+def report_startup(tool, module, top):
+    r"""Print the import times of a command line tool.
+
+    Parameters
+    ----------
+    tool : str
+        The name of the command line tool.
+    module : str
+        The module imported by the tool.
+    top : int
+        The number of packages and modules to list.
+
+    Returns
+    -------
+    total : float
+        The total import time in seconds.
+
+    """
+    timings = time_imports(module)
+    total = sum(t[1] for t in timings) / 1e6
+    print("%s (%s): %.3f seconds, %d modules" % (tool, module, total, len(timings)))
+    print("  Packages:")
+    packages = get_package_times(timings)
+    for package, us in sorted(packages.items(), key=lambda x: -x[1])[:top]:
+        print("    %-30s %10.1f ms" % (package, us / 1000.0))
+    print("  Modules (cumulative):")
+    for name, _, cumulative in sorted(timings, key=lambda x: -x[2])[:top]:
+        print("    %-30s %10.1f ms" % (name.strip(), cumulative / 1000.0))
+    print()
+    return total
+
+
+#
+# Function main
+#
+
+def main(args=None):
+    r"""Report the startup time of the AlphaPy command line tools.
+
+    Examples
+    --------
+
+    ``python benchmarks/startup.py``
+    ``python benchmarks/startup.py --tools mflow --top 30``
+
+    """
+    parser = argparse.ArgumentParser(description="AlphaPy Startup Benchmark")
+    parser.add_argument('--tools', nargs='+', choices=sorted(entry_points),
+                        default=sorted(entry_points))
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args(args)
+    for tool in args.tools:
+        report_startup(tool, entry_points[tool], args.top)
+
+
+#
+# MAIN PROGRAM
+#
+
+if __name__ == "__main__":
+    main()
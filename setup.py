@@ -28,6 +28,7 @@ install_reqs = [
     'category_encoders>=1.2.0',
     'imbalanced-learn>=0.3',
     'ipython>=5.0',
+    'joblib>=0.11',
     'matplotlib>=2.0.0',
     'numpy>=1.12',
     'pandas>=0.22',
@@ -40,6 +41,10 @@ install_reqs = [
     'xgboost>=0.71',
 ]
 
+extras_reqs = {
+    'arrow' : ['pyarrow>=0.8'],
+}
+
 if __name__ == "__main__":
     setup(
         name=DISTNAME,
@@ -53,6 +58,7 @@ if __name__ == "__main__":
         packages=find_packages(),
         classifiers=classifiers,
         install_requires=install_reqs,
+        extras_require=extras_reqs,
         entry_points={
             'console_scripts': [
                 'alphapy = alphapy.__main__:main',
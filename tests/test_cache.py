@@ -0,0 +1,151 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_cache
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.cache import get_stage_keys
+from alphapy.cache import stage_specs
+from alphapy.cache import StageCache
+
+import os
+import shutil
+import tempfile
+
+
+#
+# Function write_file
+#
+
+def write_file(file_path, content):
+    r"""Write the text ``content`` to a file."""
+    with open(file_path, 'w') as f:
+        f.write(content)
+    return file_path
+
+
+#
+# Function changed_stages
+#
+
+def changed_stages(keys1, keys2):
+    r"""Get the names of the stages whose keys differ."""
+    return [s1 for (s1, k1), (s2, k2) in zip(keys1, keys2) if k1 != k2]
+
+
+#
+# Function test_stage_keys_specs
+#
+
+def test_stage_keys_specs():
+    directory = tempfile.mkdtemp()
+    try:
+        files = [write_file(os.path.join(directory, 'train.csv'), 'a,b\n1,2\n')]
+        specs = {'drop' : [], 'pca' : False, 'interactions' : True,
+                 'lv_threshold' : 0.1, 'algorithms' : ['RF']}
+        keys = get_stage_keys(specs, files)
+        assert [stage for stage, key in keys] == [s for s, _ in stage_specs]
+        assert get_stage_keys(dict(specs), files) == keys
+        # a setting only invalidates its own stage and the later stages
+        expected = {'drop'         : ['treatments', 'features',
+                                      'interactions', 'lv_features'],
+                    'pca'          : ['features', 'interactions', 'lv_features'],
+                    'interactions' : ['interactions', 'lv_features'],
+                    'lv_threshold' : ['lv_features'],
+                    'algorithms'   : []}
+        for name, value in [('drop', ['b']), ('pca', True), ('interactions', False),
+                            ('lv_threshold', 0.2), ('algorithms', ['XGB'])]:
+            changed = dict(specs)
+            changed[name] = value
+            assert changed_stages(keys, get_stage_keys(changed, files)) == expected[name]
+    finally:
+        shutil.rmtree(directory)
+
+
+#
+# Function test_stage_keys_files
+#
+
+def test_stage_keys_files():
+    directory = tempfile.mkdtemp()
+    try:
+        file_path = write_file(os.path.join(directory, 'train.csv'), 'a,b\n1,2\n')
+        specs = {'pca' : False}
+        keys = get_stage_keys(specs, [file_path])
+        # rewriting the same content keeps the keys
+        write_file(file_path, 'a,b\n1,2\n')
+        assert get_stage_keys(specs, [file_path]) == keys
+        # new input data invalidates every stage
+        write_file(file_path, 'a,b\n1,3\n')
+        assert len(changed_stages(keys, get_stage_keys(specs, [file_path]))) == len(keys)
+    finally:
+        shutil.rmtree(directory)
+
+
+#
+# Function test_cache_evict
+#
+
+def test_cache_evict():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = StageCache(directory, 1.0)
+        # four entries of 0.4 MB, the first being the oldest
+        paths = []
+        for i in range(4):
+            file_path = cache.get_path('features', 'key%d' % i)
+            write_file(file_path, 'x' * (400 * 1024))
+            os.utime(file_path, (1000 + i, 1000 + i))
+            paths.append(file_path)
+        cache.evict()
+        assert [os.path.exists(p) for p in paths] == [False, False, True, True]
+        # an entry to keep is never removed, even if it is the oldest
+        cache.max_size = 0.5
+        os.utime(paths[2], (2000, 2000))
+        cache.evict(keep=paths[2])
+        assert [os.path.exists(p) for p in paths] == [False, False, True, False]
+    finally:
+        shutil.rmtree(directory)
+
+
+#
+# Function test_cache_restore
+#
+
+def test_cache_restore():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = StageCache(os.path.join(directory, 'cache'), 10.0)
+        keys = [('treatments', 'k1'), ('features', 'k2'), ('interactions', 'k3')]
+        assert cache.restore(keys) == (None, None)
+        cache.save('treatments', 'k1', {'stage' : 1})
+        cache.save('features', 'k2', {'stage' : 2})
+        assert cache.restore(keys) == ('features', {'stage' : 2})
+        # loading an entry marks it as recently used
+        os.utime(cache.get_path('features', 'k2'), (1000, 1000))
+        cache.load('features', 'k2')
+        assert os.path.getmtime(cache.get_path('features', 'k2')) > 1000
+    finally:
+        shutil.rmtree(directory)
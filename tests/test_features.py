@@ -0,0 +1,155 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_features
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.features import create_crosstabs
+from alphapy.features import create_features
+from alphapy.features import get_column_model
+from alphapy.features import transform_features
+from alphapy.globals import Encoders
+from alphapy.globals import ModelType
+from alphapy.globals import Scalers
+from alphapy.model import Model
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+#
+# Function feature_specs
+#
+
+def feature_specs(**kwargs):
+    r"""Create the model specifications of the feature pipeline."""
+    specs = {'algorithms'        : ['LOGR'],
+             'cluster_inc'       : 1,
+             'cluster_max'       : 4,
+             'cluster_min'       : 3,
+             'clustering'        : True,
+             'counts'            : False,
+             'drop'              : [],
+             'encoder'           : Encoders.onehot,
+             'factors'           : ['c'],
+             'feature_dtype'     : 'float64',
+             'feature_selection' : False,
+             'interactions'      : False,
+             'isample_pct'       : 10,
+             'isomap'            : False,
+             'logtransform'      : True,
+             'lv_remove'         : False,
+             'lv_threshold'      : 0.1,
+             'model_type'        : ModelType.classification,
+             'n_jobs'            : 1,
+             'ngrams_max'        : 1,
+             'numpy'             : True,
+             'pca'               : True,
+             'pca_inc'           : 1,
+             'pca_max'           : 2,
+             'pca_min'           : 1,
+             'pca_whiten'        : False,
+             'poly_degree'       : 2,
+             'predict_mode'      : False,
+             'pvalue_level'      : 0.01,
+             'rfe'               : False,
+             'rounding'          : 2,
+             'scaler_option'     : True,
+             'scaler_type'       : Scalers.standard,
+             'scipy'             : False,
+             'seed'              : 5,
+             'sentinel'          : -1,
+             'sparse'            : False,
+             'target_value'      : 1,
+             'treatments'        : None,
+             'tsne'              : False,
+             'vectorize'         : False,
+             'verbosity'         : 0}
+    specs.update(kwargs)
+    return specs
+
+
+#
+# Function feature_frame
+#
+
+def feature_frame(nrows, seed):
+    r"""Create numerical, factor, and text features with missing values."""
+    rs = np.random.RandomState(seed)
+    X = pd.DataFrame({'a' : rs.randn(nrows),
+                      'b' : rs.randint(0, 5, nrows).astype('int64'),
+                      'c' : rs.choice(['x', 'y', 'z'], nrows),
+                      'd' : np.exp(rs.randn(nrows)),
+                      't' : rs.choice(['red fox', 'blue cat', 'red cat'], nrows)})
+    X['c'] = X['c'].astype(object)
+    X['t'] = X['t'].astype(object)
+    X.loc[rs.choice(nrows, 10, replace=False), 'a'] = np.nan
+    y = pd.Series((X['a'].fillna(0) + rs.randn(nrows) > 0).astype(int))
+    return X, y
+
+
+#
+# Function test_transform_features_subset
+#
+
+def test_transform_features_subset():
+    X, y = feature_frame(300, 0)
+    rows = np.array([5, 17, 40, 41, 42, 150, 299])
+    for n_jobs, sparse_flag in [(1, False), (1, True), (2, False)]:
+        model = Model(feature_specs(n_jobs=n_jobs, sparse=sparse_flag))
+        model.X_train, model.y_train = X, y
+        create_crosstabs(model)
+        all_features = create_features(model, X.copy())
+        # the feature map from training reproduces the rows of new data
+        model.specs['predict_mode'] = True
+        new_features = transform_features(model, X.iloc[rows].copy())
+        if sparse_flag:
+            assert sparse.issparse(new_features)
+            all_features = all_features.toarray()
+            new_features = new_features.toarray()
+        assert new_features.shape == (len(rows), all_features.shape[1])
+        assert np.allclose(new_features, all_features[rows])
+
+
+#
+# Function test_get_column_model
+#
+
+def test_get_column_model():
+    model = Model(feature_specs())
+    model.feature_map = {'crosstabs'    : {'impute' : 'ct', 'x' : 'ctx'},
+                         'transformers' : {'impute_impute' : 1,
+                                           'log_impute'    : 2,
+                                           'numpy_impute'  : 3,
+                                           'impute'        : 4,
+                                           'impute_x'      : 5,
+                                           'scaler'        : 6}}
+    cmodel = get_column_model(model, 'impute')
+    assert cmodel.feature_map == {'crosstabs'    : {'impute' : 'ct'},
+                                  'transformers' : {'impute_impute' : 1,
+                                                    'log_impute'    : 2}}
+    assert get_column_model(model, 'y').feature_map == {'crosstabs'    : {},
+                                                        'transformers' : {}}
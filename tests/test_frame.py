@@ -0,0 +1,202 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_frame
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.frame import Frame
+from alphapy.frame import frame_name
+from alphapy.frame import get_panel
+from alphapy.frame import read_frame
+from alphapy.frame import write_frame
+from alphapy.space import Space
+
+import numpy as np
+import pandas as pd
+import pytest
+import shutil
+import tempfile
+
+
+#
+# Function write_files
+#
+
+def write_files():
+    r"""Write the same frame as a text file and a NumPy file."""
+    directory = tempfile.mkdtemp()
+    df = pd.DataFrame({'date'  : ['2017-01-03', '2017-01-04', '2017-01-05'],
+                       'open'  : [1.0, 2.0, 3.0],
+                       'close' : [1.5, 2.5, 3.5],
+                       'name'  : ['a', 'b', 'c']},
+                      columns=['date', 'open', 'close', 'name'])
+    for extension in ['csv', 'npy']:
+        write_frame(df, directory, 'prices', extension, ',')
+    return directory
+
+
+#
+# Function test_read_frame_index_projection
+#
+
+def test_read_frame_index_projection():
+    directory = write_files()
+    try:
+        for extension in ['csv', 'npy']:
+            for index_col in ['date', 0]:
+                df = read_frame(directory, 'prices', extension, ',',
+                                index_col=index_col, columns=['close'])
+                assert list(df.columns) == ['close'], extension
+                assert list(df.index) == ['2017-01-03', '2017-01-04', '2017-01-05']
+            df = read_frame(directory, 'prices', extension, ',',
+                            index_col=3, columns=['open', 'close'])
+            assert list(df.columns) == ['open', 'close'], extension
+            assert list(df.index) == ['a', 'b', 'c']
+            sf = read_frame(directory, 'prices', extension, ',',
+                            index_col=1, squeeze=True, columns=['close'])
+            assert isinstance(sf, pd.Series)
+            assert list(sf.index) == [1.0, 2.0, 3.0]
+    finally:
+        shutil.rmtree(directory)
+
+
+#
+# Function test_read_frame_no_projection
+#
+
+def test_read_frame_no_projection():
+    directory = write_files()
+    try:
+        for extension in ['csv', 'npy']:
+            df = read_frame(directory, 'prices', extension, ',', index_col=0)
+            assert list(df.columns) == ['open', 'close', 'name'], extension
+            assert df.index.name == 'date'
+    finally:
+        shutil.rmtree(directory)
+
+
+#
+# Function test_get_panel_rebuilds
+#
+
+def test_get_panel_rebuilds():
+    space = Space('stock', 'prices', 'panel')
+    dates = pd.date_range('2017-01-03', periods=3, freq='D')
+    Frame('pnla', space, pd.DataFrame({'close' : [1.0, 2.0, 3.0]}, index=dates))
+    panel = get_panel('pnl', space, ['pnla'])
+    assert get_panel('pnl', space, ['pnla']) is panel
+    # extending a frame builds a new panel with the new dates
+    dates = pd.date_range('2017-01-03', periods=4, freq='D')
+    fname = frame_name('pnla', space)
+    Frame.frames[fname].df = pd.DataFrame({'close' : [1.0, 2.0, 3.0, 4.0]},
+                                          index=dates)
+    panel = get_panel('pnl', space, ['pnla'])
+    assert panel.get('pnla', dates[-1]) == 4.0
+    # replacing a frame with the same dates also builds a new panel
+    Frame.frames[fname].df = pd.DataFrame({'close' : [5.0, 6.0, 7.0, 8.0]},
+                                          index=dates)
+    assert get_panel('pnl', space, ['pnla']).get('pnla', dates[0]) == 5.0
+
+
+#
+# Function round_trip
+#
+
+def round_trip(df, extension):
+    r"""Write a frame and read it back in the given format."""
+    directory = tempfile.mkdtemp()
+    try:
+        write_frame(df, directory, 'trip', extension, ',')
+        return read_frame(directory, 'trip', extension, ',')
+    finally:
+        shutil.rmtree(directory)
+
+
+#
+# Function typed_frame
+#
+
+def typed_frame():
+    r"""Create a frame with a column of each common type."""
+    df = pd.DataFrame({'x' : [1.5, np.nan, -2.25, 1e-9],
+                       'n' : [1, 2, 3, 4],
+                       'b' : [True, False, False, True],
+                       's' : ['a', np.nan, 'c d', 'e']},
+                      columns=['x', 'n', 'b', 's'])
+    df['s'] = df['s'].astype(object)
+    return df
+
+
+#
+# Function test_round_trip_formats
+#
+
+def test_round_trip_formats():
+    df = typed_frame()
+    for extension in ['csv', 'npy']:
+        pd.testing.assert_frame_equal(round_trip(df, extension), df,
+                                      check_dtype=False)
+
+
+#
+# Function test_round_trip_arrow
+#
+
+def test_round_trip_arrow():
+    pytest.importorskip('pyarrow')
+    df = typed_frame()
+    for extension in ['feather', 'parquet']:
+        pd.testing.assert_frame_equal(round_trip(df, extension), df,
+                                      check_dtype=False)
+
+
+#
+# Function test_round_trip_npy_objects
+#
+
+def test_round_trip_npy_objects():
+    df = pd.DataFrame({'s' : ['', np.nan, 'a', None],
+                       'm' : ['a', 1, 2.5, True],
+                       'e' : [np.nan] * 4},
+                      columns=['s', 'm', 'e'])
+    df = df.astype(object)
+    tf = round_trip(df, 'npy')
+    # empty strings and missing values are kept apart
+    assert tf['s'][0] == ''
+    assert tf['s'][1:2].isnull().all() and tf['s'][3:].isnull().all()
+    assert tf['s'][2] == 'a'
+    # the values of a mixed column keep their types
+    assert list(tf['m']) == ['a', 1, 2.5, True]
+    assert [type(v) for v in tf['m']] == [str, int, float, bool]
+    assert tf['e'].isnull().all()
+    # projection reads only the requested columns
+    directory = tempfile.mkdtemp()
+    try:
+        write_frame(df, directory, 'trip', 'npy', ',')
+        tf = read_frame(directory, 'trip', 'npy', ',', columns=['m'])
+        assert list(tf.columns) == ['m']
+        assert list(tf['m']) == ['a', 1, 2.5, True]
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,255 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_market_variables
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.alias import Alias
+from alphapy.frame import Frame
+from alphapy.frame import frame_name
+from alphapy.group import Group
+from alphapy.market_variables import Variable
+from alphapy.market_variables import vcompile
+from alphapy.market_variables import vextend
+from alphapy.market_variables import vkey
+from alphapy.market_variables import vload
+from alphapy.market_variables import vmapply
+from alphapy.market_variables import vmextend
+from alphapy.market_variables import vrun
+from alphapy.market_variables import vsave
+from alphapy.space import Space
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+
+#
+# The ADX needs the average true range
+#
+
+Alias('atr', 'ma_truerange')
+
+
+#
+# Variables to extend, including exponential and lagged variables
+#
+
+variables = ['ma_close_10', 'ema_close_8', 'rsi_close_14', 'adx_14',
+             'ma_close_10[2]', 'ema_close_8[1]', 'adx_14[3]']
+
+base_columns = ['open', 'high', 'low', 'close', 'volume']
+
+
+#
+# Function price_frame
+#
+
+def price_frame(nbars, seed):
+    r"""Create a random frame of daily prices."""
+    rs = np.random.RandomState(seed)
+    close = 50.0 + rs.randn(nbars).cumsum()
+    spread = rs.uniform(0.1, 1.0, nbars)
+    pf = pd.DataFrame(index=pd.date_range('2017-01-03', periods=nbars, freq='D'))
+    pf['open'] = close + rs.uniform(-0.5, 0.5, nbars) * spread
+    pf['high'] = np.maximum(pf['open'], close) + spread
+    pf['low'] = np.minimum(pf['open'], close) - spread
+    pf['close'] = close
+    pf['volume'] = rs.randint(1000, 5000, nbars).astype(float)
+    return pf
+
+
+#
+# Function full_frame
+#
+
+def full_frame(pf, name):
+    r"""Apply the variables to all of the rows with ``vmapply``."""
+    space = Space('stock', 'prices', 'test')
+    group = Group(name, space, members=set([name]))
+    Frame(name, space, pf.copy())
+    vmapply(group, variables)
+    return Frame.frames[frame_name(name, space)].df
+
+
+#
+# Function check_columns
+#
+
+def check_columns(actual, expected):
+    assert list(actual.index) == list(expected.index)
+    for v in variables:
+        assert np.allclose(actual[v].values.astype(float),
+                           expected[v].values.astype(float),
+                           rtol=1e-8, atol=1e-8, equal_nan=True), v
+
+
+#
+# Function test_vextend_bar_by_bar
+#
+
+def test_vextend_bar_by_bar():
+    pf = price_frame(150, 11)
+    expected = full_frame(pf, 'vxbars')
+    nstart = 40
+    ef = vrun(pf.iloc[:nstart].copy(), vcompile(variables))
+    vstates = None
+    for i in range(nstart, pf.shape[0]):
+        ef, vstates = vextend(ef, pf.iloc[i:i + 1][base_columns], variables,
+                              None, vstates)
+    check_columns(ef, expected)
+
+
+#
+# Function test_vextend_short_history
+#
+
+def test_vextend_short_history():
+    pf = price_frame(60, 12)
+    expected = full_frame(pf, 'vxshort')
+    ef = vrun(pf.iloc[:3].copy(), vcompile(variables))
+    ef, vstates = vextend(ef, pf.iloc[3:10][base_columns], variables)
+    for i in range(10, pf.shape[0]):
+        ef, vstates = vextend(ef, pf.iloc[i:i + 1][base_columns], variables,
+                              None, vstates)
+    check_columns(ef, expected)
+
+
+#
+# Function test_vmextend_seeded
+#
+
+def test_vmextend_seeded():
+    pf = price_frame(120, 13)
+    expected = full_frame(pf, 'vxfull')
+    space = Space('stock', 'prices', 'test')
+    group = Group('vxseed', space, members=set(['vxseed']))
+    Frame('vxseed', space, pf.iloc[:70].copy())
+    fname = frame_name('vxseed', space)
+    vcache = vmextend(group, variables)
+    for i in range(70, pf.shape[0], 7):
+        Frame.frames[fname].df = pf.iloc[:i + 7].copy()
+        vcache = vmextend(group, variables, None, vcache)
+    check_columns(Frame.frames[fname].df, expected)
+
+
+#
+# Function test_vmextend_revised_bars
+#
+
+def test_vmextend_revised_bars():
+    pf = price_frame(100, 14)
+    space = Space('stock', 'prices', 'test')
+    group = Group('vxrevise', space, members=set(['vxrevise']))
+    fname = frame_name('vxrevise', space)
+    # the last bar is only partially formed when it is cached
+    partial = pf.iloc[:60].copy()
+    partial.iloc[-1, partial.columns.get_loc('close')] *= 0.99
+    Frame('vxrevise', space, partial)
+    vcache = vmextend(group, variables)
+    Frame.frames[fname].df = pf.iloc[:80].copy()
+    vcache = vmextend(group, variables, None, vcache)
+    check_columns(Frame.frames[fname].df, full_frame(pf.iloc[:80], 'vxrevfull'))
+    # a bar revised in the middle of the cached rows
+    revised = pf.iloc[:90].copy()
+    revised.iloc[30, revised.columns.get_loc('high')] += 1.0
+    Frame.frames[fname].df = revised.copy()
+    vcache = vmextend(group, variables, None, vcache)
+    check_columns(Frame.frames[fname].df, full_frame(revised, 'vxrevmid'))
+
+
+#
+# Function test_vmextend_history_window
+#
+
+def test_vmextend_history_window():
+    pf = price_frame(100, 15)
+    space = Space('stock', 'prices', 'test')
+    group = Group('vxwindow', space, members=set(['vxwindow']))
+    fname = frame_name('vxwindow', space)
+    Frame('vxwindow', space, pf.iloc[:60].copy())
+    vcache = vmextend(group, variables)
+    # the price data keeps only the latest rows of the history
+    Frame.frames[fname].df = pf.iloc[20:90].copy()
+    vcache = vmextend(group, variables, None, vcache)
+    assert vcache[fname][0].shape[0] == 70
+    expected = full_frame(pf.iloc[:90], 'vxwinfull').iloc[20:]
+    check_columns(Frame.frames[fname].df, expected)
+
+
+#
+# Function test_vsave_vload
+#
+
+def test_vsave_vload():
+    directory = tempfile.mkdtemp()
+    plans_file = os.path.join(directory, 'plans.pkl')
+    try:
+        vcompile(['ma_close_30'])
+        # only the plans used in this run are saved
+        Variable.used.clear()
+        vs = ['ma_close_5', 'ema_close_3[1]']
+        plan = vcompile(vs)
+        assert vsave(plans_file) == 1
+        Variable.plans.clear()
+        assert vload(plans_file) == 1
+        assert Variable.plans[vkey(vs)] == plan
+        # a new variable definition discards the saved plans
+        Variable('vxsaved', 'close > 1.2345 * open')
+        assert vload(plans_file) == 0
+        assert not os.path.isfile(plans_file)
+    finally:
+        shutil.rmtree(directory)
+
+
+#
+# Function test_vmapply_executor
+#
+
+def test_vmapply_executor():
+    space = Space('stock', 'prices', 'pool')
+    names = ['pla', 'plb', 'plc']
+    group = Group('vm_pool', space, members=set(names))
+    frames = {}
+    for executor in [None, ThreadPoolExecutor(2), ProcessPoolExecutor(2)]:
+        for k, name in enumerate(names):
+            Frame.frames.pop(frame_name(name, space), None)
+            Frame(name, space, price_frame(90, 30 + k))
+        try:
+            vmapply(group, variables, executor=executor)
+        finally:
+            if executor:
+                executor.shutdown()
+        frames[type(executor).__name__] = [Frame.frames[frame_name(name, space)].df
+                                           for name in names]
+    serial = frames['NoneType']
+    assert all([v in serial[0].columns for v in variables])
+    for pool in ['ThreadPoolExecutor', 'ProcessPoolExecutor']:
+        for expected, actual in zip(serial, frames[pool]):
+            pd.testing.assert_frame_equal(actual, expected)
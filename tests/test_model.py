@@ -0,0 +1,156 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_model
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.globals import ModelType
+from alphapy.model import CalibratedPredictor
+from alphapy.model import get_oof_predictions
+from alphapy.model import Model
+
+import numpy as np
+from sklearn.base import BaseEstimator
+from sklearn.base import ClassifierMixin
+from sklearn.linear_model import LogisticRegression
+
+
+#
+# Class RowMemory
+#
+
+class RowMemory(BaseEstimator, ClassifierMixin):
+    r"""Predict the last class for the row numbers seen in training."""
+
+    def fit(self, X, y):
+        self.classes_ = np.unique(y)
+        self.seen_ = set(X[:, 0].astype(int))
+        return self
+
+    def predict_proba(self, X):
+        p = np.array([float(int(r) in self.seen_) for r in X[:, 0]])
+        return np.column_stack((1.0 - p, p))
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X)[:, 1].astype(int)]
+
+
+#
+# Function model_specs
+#
+
+def model_specs(model_type):
+    r"""Create a model with the specifications of the shared folds."""
+    return Model({'algorithms' : ['LOGR'],
+                  'cv_folds'   : 4,
+                  'model_type' : model_type,
+                  'seed'       : 7})
+
+
+#
+# Function binary_data
+#
+
+def binary_data(nrows, seed):
+    r"""Create a noisy binary problem with string labels."""
+    rs = np.random.RandomState(seed)
+    X = rs.randn(nrows, 3)
+    p = 1.0 / (1.0 + np.exp(-3.0 * X[:, 0]))
+    y = np.where(rs.rand(nrows) < p, 'up', 'down')
+    return X, y
+
+
+#
+# Function test_oof_predictions_held_out
+#
+
+def test_oof_predictions_held_out():
+    model = model_specs(ModelType.classification)
+    X = np.arange(100, dtype=float).reshape(-1, 1)
+    y = np.array(['a', 'b'] * 50)
+    est = RowMemory().fit(X, y)
+    assert (est.predict(X) == 'b').all()
+    # every row is predicted by a model that never saw it
+    preds, probas = get_oof_predictions(model, 'MEM', est, X, y)
+    assert (preds == 'a').all()
+    assert (probas == 0.0).all()
+
+
+#
+# Function test_oof_predictions_regression
+#
+
+def test_oof_predictions_regression():
+    model = model_specs(ModelType.regression)
+    X = np.arange(40, dtype=float).reshape(-1, 1)
+    y = np.arange(40, dtype=float)
+    est = RowMemory().fit(X, y)
+    preds, probas = get_oof_predictions(model, 'MEM', est, X, y)
+    assert probas is None
+    # each fold predicts the smallest of its own labels, never a held-out one
+    assert (preds != y).all()
+
+
+#
+# Function test_calibrated_predictor
+#
+
+def test_calibrated_predictor():
+    model = model_specs(ModelType.classification)
+    X, y = binary_data(400, 0)
+    est = LogisticRegression(C=0.01).fit(X, y)
+    preds, oof_probas = get_oof_predictions(model, 'LOGR', est, X, y)
+    raw = est.predict_proba(X)[:, 1]
+    order = np.argsort(raw)
+    for method in ['sigmoid', 'isotonic']:
+        cal = CalibratedPredictor(est, method).fit(oof_probas, y)
+        probas = cal.predict_proba(X)
+        assert probas.shape == (400, 2)
+        assert ((probas >= 0.0) & (probas <= 1.0)).all()
+        assert np.allclose(probas.sum(axis=1), 1.0)
+        # calibration keeps the order of the probabilities
+        assert (np.diff(probas[order, 1]) >= -1e-12).all()
+        assert np.array_equal(cal.predict(X),
+                              np.where(probas[:, 1] >= 0.5, 'up', 'down'))
+    # out-of-range probabilities are clipped by the isotonic calibrator
+    cal = CalibratedPredictor(est, 'isotonic').fit(oof_probas, y)
+    assert ((cal.calibrate(np.array([-1.0, 2.0])) >= 0.0) &
+            (cal.calibrate(np.array([-1.0, 2.0])) <= 1.0)).all()
+
+
+#
+# Function test_calibrated_predictor_multiclass
+#
+
+def test_calibrated_predictor_multiclass():
+    X, _ = binary_data(90, 1)
+    y = np.array(['a', 'b', 'c'] * 30)
+    est = LogisticRegression().fit(X, y)
+    try:
+        CalibratedPredictor(est, 'sigmoid')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("A multiclass estimator must raise ValueError")
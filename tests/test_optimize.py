@@ -0,0 +1,193 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_optimize
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.optimize import FastRFECV
+from alphapy.optimize import HalvingSearchCV
+
+import numpy as np
+from sklearn.base import BaseEstimator
+from sklearn.linear_model import LogisticRegression
+
+
+#
+# Class ParamScore
+#
+
+class ParamScore(BaseEstimator):
+    r"""An estimator that scores ``a``, or ``NaN`` for an even ``a``."""
+
+    def __init__(self, a=0, n=27):
+        self.a = a
+        self.n = n
+
+    def fit(self, X, y):
+        return self
+
+    def score(self, X, y):
+        return float('nan') if self.a % 2 == 0 else float(self.a)
+
+
+#
+# Class ColumnScore
+#
+
+class ColumnScore(BaseEstimator):
+    r"""An estimator whose best score is with ``peak`` features."""
+
+    def __init__(self, peak=0):
+        self.peak = peak
+
+    def fit(self, X, y):
+        self.feature_importances_ = X.mean(axis=0)
+        return self
+
+    def score(self, X, y):
+        return -abs(X.shape[1] - self.peak)
+
+
+#
+# Function column_data
+#
+
+def column_data(nrows, ncols):
+    r"""Create columns whose importance is their position plus one."""
+    X = np.tile(np.arange(1.0, ncols + 1), (nrows, 1))
+    y = np.arange(nrows) % 2
+    return X, y
+
+
+#
+# Function imbalanced_data
+#
+
+def imbalanced_data(nrows, npos, seed):
+    r"""Create a binary problem with only ``npos`` positive rows."""
+    rs = np.random.RandomState(seed)
+    y = np.zeros(nrows, dtype=int)
+    y[rs.choice(nrows, npos, replace=False)] = 1
+    X = rs.randn(nrows, 4) + y[:, None]
+    return X, y
+
+
+#
+# Function test_halving_imbalanced_classes
+#
+
+def test_halving_imbalanced_classes():
+    X, y = imbalanced_data(600, 17, 0)
+    grid = {'C' : list(np.logspace(-3, 3, 27))}
+    search = HalvingSearchCV(LogisticRegression(), grid, scoring='roc_auc',
+                             cv=3, factor=3, random_state=1)
+    search.fit(X, y)
+    assert not np.isnan(search.cv_results_['mean_test_score']).any()
+    # the first round has 2 * cv rows of the smallest class
+    nmin = search.cv_results_['n_resources'].min()
+    assert y[search.order_[:nmin]].sum() >= 6
+    # every prefix of the row order is stratified
+    for k in range(20, 600, 20):
+        assert abs(y[search.order_[:k]].sum() - k * 17 / 600.0) <= 1
+
+
+#
+# Function test_halving_nan_last
+#
+
+def test_halving_nan_last():
+    X = np.zeros((90, 1))
+    y = np.zeros(90)
+    search = HalvingSearchCV(ParamScore(), {'a' : list(range(9))}, cv=3,
+                             factor=3, random_state=2)
+    search.fit(X, y)
+    results = search.cv_results_
+    assert search.best_params_ == {'a' : 7}
+    assert list(results['n_resources']) == [90, 30, 30] + [10] * 6
+    assert [p['a'] for p in results['params'][:4]] == [7, 5, 3, 1]
+    assert np.isnan(results['mean_test_score'][4:]).all()
+
+
+#
+# Function test_hyperband_brackets
+#
+
+def test_hyperband_brackets():
+    X = np.zeros((30, 1))
+    y = np.zeros(30)
+    grid = {'a' : list(range(60))}
+    search = HalvingSearchCV(ParamScore(), grid, cv=3, resource='n',
+                             factor=3, hyperband=True, random_state=3)
+    search.fit(X, y)
+    results = search.cv_results_
+    # brackets of 27, 12, 6 and 4 candidates starting at n = 1, 3, 9 and 27
+    assert len(results['params']) == 27 + 12 + 6 + 4
+    assert sorted(set(results['n_resources'])) == [1, 3, 9, 27]
+    assert (results['n_resources'] == 27).sum() == 1 + 2 + 2 + 4
+    odd = [p['a'] for p in results['params'] if p['a'] % 2]
+    assert search.best_params_ == {'a' : max(odd)}
+    assert search.best_score_ == max(odd)
+
+
+#
+# Function test_fast_rfecv_schedule
+#
+
+def test_fast_rfecv_schedule():
+    X, y = column_data(30, 100)
+    rfe = FastRFECV(ColumnScore(), fraction=0.2, patience=100).fit(X, y)
+    # a fifth of the features are removed in each round, at least one
+    assert sorted(rfe.scores_, reverse=True) == [100, 80, 64, 52, 42, 34, 28, 23,
+                                                 19, 16, 13, 11, 9, 8, 7, 6, 5,
+                                                 4, 3, 2, 1]
+    assert rfe.n_features_ == 1
+    assert list(np.flatnonzero(rfe.support_)) == [99]
+    # a larger step and a minimum number of features
+    rfe = FastRFECV(ColumnScore(), step=5, fraction=0.2, patience=100,
+                    min_features=10).fit(X, y)
+    assert sorted(rfe.scores_, reverse=True) == [100, 80, 64, 52, 42, 34, 28, 23,
+                                                 18, 13, 10]
+    assert rfe.n_features_ == 10
+
+
+#
+# Function test_fast_rfecv_patience
+#
+
+def test_fast_rfecv_patience():
+    X, y = column_data(30, 100)
+    rfe = FastRFECV(ColumnScore(peak=30), fraction=0.2, patience=2).fit(X, y)
+    # the elimination stops after two rounds without a better score
+    assert sorted(rfe.scores_, reverse=True) == [100, 80, 64, 52, 42, 34, 28, 23, 19]
+    assert rfe.scores_[28] == -2
+    assert rfe.n_features_ == 28
+    assert rfe.support_.sum() == rfe.n_features_
+    assert list(np.flatnonzero(rfe.support_)) == list(range(72, 100))
+    assert (rfe.ranking_[rfe.support_] == 1).all()
+    assert (rfe.ranking_[~rfe.support_] > 1).all()
+    # the features eliminated first are ranked last
+    assert rfe.ranking_[0] == rfe.ranking_.max()
+    assert rfe.ranking_[71] == 2
+    assert rfe.estimator_.feature_importances_.shape == (28,)
@@ -0,0 +1,398 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_portfolio
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.frame import Frame
+from alphapy.frame import frame_name
+from alphapy.frame import get_panel
+from alphapy.frame import read_frame
+from alphapy.frame import write_frame
+from alphapy.globals import Orders
+from alphapy.group import Group
+from alphapy.portfolio import balance
+from alphapy.portfolio import balance_rule
+from alphapy.portfolio import exec_trade
+from alphapy.portfolio import gen_portfolio
+from alphapy.portfolio import kick_out
+from alphapy.portfolio import kick_out_rule
+from alphapy.portfolio import Portfolio
+from alphapy.portfolio import stop_loss
+from alphapy.portfolio import stop_loss_rule
+from alphapy.portfolio import valuate_portfolio
+from alphapy.space import Space
+
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+
+#
+# Class SpecsModel
+#
+
+class SpecsModel(object):
+    r"""The part of a model that ``gen_portfolio`` reads."""
+
+    def __init__(self, directory):
+        self.specs = {'directory' : directory,
+                      'extension' : 'npy',
+                      'separator' : ','}
+
+
+#
+# Function price_frames
+#
+
+def price_frames(space, symbols, dates, seed, gaps=True):
+    r"""Create the price frames, with some dates missing for the last symbol."""
+    rs = np.random.RandomState(seed)
+    for k, symbol in enumerate(symbols):
+        close = np.round(20.0 + rs.rand() * 30 + rs.randn(len(dates)).cumsum(), 2)
+        df = pd.DataFrame({'open'   : close + 0.1,
+                           'high'   : close + 0.5,
+                           'low'    : close - 0.5,
+                           'close'  : close,
+                           'volume' : 1000.0}, index=dates)
+        if gaps and k == len(symbols) - 1:
+            df = df.drop(dates[3:len(dates):4])
+        fname = frame_name(symbol, space)
+        if fname in Frame.frames:
+            Frame.frames[fname].df = df
+        else:
+            Frame(symbol, space, df)
+
+
+#
+# Function trade_frame
+#
+
+def trade_frame(rows):
+    r"""Create a trades frame from ``(date, name, order, quantity, price)`` rows."""
+    tf = pd.DataFrame([row[1:] for row in rows],
+                      index=pd.DatetimeIndex([row[0] for row in rows]),
+                      columns=['name', 'order', 'quantity', 'price'])
+    return tf
+
+
+#
+# Function trade_loop
+#
+
+def trade_loop(group, system, tframe, startcap, posby):
+    r"""Run the trades with the original per-trade loop.
+
+    Each trade is executed with ``exec_trade`` and the portfolio is
+    valued with ``valuate_portfolio`` every day, which is the path
+    that ``portfolio_engine`` replaced.
+
+    """
+    gmembers = group.members
+    p = Portfolio(group.name, system, group.space, posby=posby,
+                  restricted=False, startcap=startcap,
+                  fixedfrac=1.0 / len(gmembers))
+    p.panel = get_panel(group.name, group.space, list(gmembers))
+    days = tframe.index.map(lambda x: x.date().strftime('%Y-%m-%d'))
+    drange = pd.date_range(tframe.index[0], tframe.index[-1]) \
+               .map(lambda x: x.date().strftime('%Y-%m-%d'))
+    rs = []
+    pcols = list(gmembers) + ['cash']
+    pf = pd.DataFrame(0.0, index=drange, columns=pcols)
+    ts = []
+    for d in drange:
+        for tdate, row in tframe[days == d].iterrows():
+            tsize = exec_trade(p, row['name'], row['order'], row['quantity'],
+                               row['price'], tdate)
+            if tsize != 0:
+                ts.append((d, [tsize, row['price'], row['name']]))
+        for pos in p.positions.values():
+            pf.loc[d, pos.name] = pos.value if pos.quantity > 0 else -pos.value
+        pf.loc[d, 'cash'] = p.cash
+        p = valuate_portfolio(p, d)
+        rs.append(p.netreturn)
+    rf = pd.DataFrame({'return' : rs}, index=drange, columns=['return'])
+    tf = pd.DataFrame([t[1] for t in ts], index=[t[0] for t in ts],
+                      columns=['amount', 'price', 'symbol'])
+    return p, rf, pf, tf
+
+
+#
+# Function check_portfolio
+#
+
+def check_portfolio(system, tframe, posby):
+    space = Space('stock', 'prices', 'ptest')
+    symbols = ['aaa', 'bbb', 'ccc']
+    dates = pd.date_range('2017-01-02', periods=40, freq='D')
+    price_frames(space, symbols, dates, 17)
+    group = Group(system, space, members=set(symbols))
+    directory = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(directory, 'systems'))
+        p = gen_portfolio(SpecsModel(directory), system, group, tframe,
+                          startcap=100000, posby=posby)
+        tag = system + '_loop'
+        q, rf, pf, tf = trade_loop(group, tag, tframe, 100000, posby)
+        system_dir = os.path.join(directory, 'systems')
+        for schema, df in [('returns', rf), ('positions', pf),
+                           ('transactions', tf)]:
+            # write the loop frames the same way to compare the files
+            fname = frame_name(system, Space(system, schema, 'ptest'))
+            write_frame(df, system_dir, fname + '_loop', 'npy', ',',
+                        index=True, index_label='date')
+            actual = read_frame(system_dir, fname, 'npy', ',', index_col=0)
+            expected = read_frame(system_dir, fname + '_loop', 'npy', ',',
+                                  index_col=0)
+            assert not actual.empty, schema
+            pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+        assert sorted(p.positions) == sorted(q.positions)
+        for name in p.positions:
+            for attr in ['quantity', 'netpos', 'price', 'value', 'profit',
+                         'costbasis', 'netreturn', 'ntrades']:
+                assert getattr(p.positions[name], attr) == \
+                       getattr(q.positions[name], attr), (name, attr)
+        for attr in ['cash', 'value', 'npos', 'totalprofit', 'totalreturn']:
+            assert getattr(p, attr) == getattr(q, attr), attr
+    finally:
+        shutil.rmtree(directory)
+
+
+#
+# Function test_gen_portfolio_partial_exits
+#
+
+def test_gen_portfolio_partial_exits():
+    tframe = trade_frame([
+        ('2017-01-03', 'aaa', Orders.le, 300, 25.00),
+        ('2017-01-04', 'bbb', Orders.se, -200, 31.50),
+        ('2017-01-05', 'ccc', Orders.le, 100, 40.25),
+        ('2017-01-09', 'aaa', Orders.lx, -100, 26.10),
+        ('2017-01-09', 'aaa', Orders.le, 50, 26.20),
+        ('2017-01-12', 'bbb', Orders.sx, 120, 30.75),
+        ('2017-01-13', 'ccc', Orders.le, 100, 41.00),
+        ('2017-01-16', 'aaa', Orders.lx, -250, 24.80),
+        ('2017-01-17', 'bbb', Orders.sx, 80, 29.90),
+        ('2017-01-18', 'bbb', Orders.se, -150, 29.50),
+        ('2017-01-21', 'ccc', Orders.lx, -50, 39.00),
+        ('2017-01-25', 'aaa', Orders.se, -100, 23.40),
+        ('2017-01-30', 'ccc', Orders.lx, -150, 38.10),
+        ('2017-02-02', 'bbb', Orders.sx, 75, 28.00)])
+    check_portfolio('ptpartial', tframe, None)
+
+
+#
+# Function test_gen_portfolio_position_sizing
+#
+
+def test_gen_portfolio_position_sizing():
+    tframe = trade_frame([
+        ('2017-01-03', 'aaa', Orders.le, 1, 25.00),
+        ('2017-01-03', 'bbb', Orders.se, -1, 31.50),
+        ('2017-01-04', 'ccc', Orders.le, 1, 40.25),
+        ('2017-01-10', 'aaa', Orders.lx, -1, 26.10),
+        ('2017-01-11', 'bbb', Orders.sx, 1, 30.75),
+        ('2017-01-11', 'bbb', Orders.le, 1, 30.75),
+        ('2017-01-13', 'ccc', Orders.lx, -1, 39.00),
+        ('2017-01-17', 'aaa', Orders.se, -1, 24.00),
+        ('2017-01-24', 'ccc', Orders.se, -1, 37.50),
+        ('2017-02-06', 'aaa', Orders.sx, 1, 22.00)])
+    check_portfolio('ptsizing', tframe, 'close')
+
+
+#
+# Function test_stop_loss_rule
+#
+
+def test_stop_loss_rule():
+    stops = stop_loss_rule([0.05, -0.1, -0.2, np.nan], 0.1)
+    assert list(stops) == [False, True, True, False]
+
+
+#
+# Function test_kick_out_rule
+#
+
+def test_kick_out_rule():
+    kovalues = [5.0, -3.0, 10.0, 0.0]
+    assert list(kick_out_rule(kovalues, 4, 3, 1, True)) == [False, True, False, True]
+    assert list(kick_out_rule(kovalues, 4, 3, 1, False)) == [True, False, True, False]
+    assert list(kick_out_rule(kovalues, 4, 4, 1, True)) == [False, True, False, False]
+    assert not kick_out_rule(kovalues, 4, 4, 0, True).any()
+    assert not kick_out_rule(kovalues, 3, 4, 1, True).any()
+    # the unavailable positions still count toward maxpos
+    assert list(kick_out_rule(kovalues[:2], 4, 3, 0, True)) == [False, True]
+
+
+#
+# Function test_balance_rule
+#
+
+def test_balance_rule():
+    bdata = [10.0, 20.0, np.nan]
+    quantity = [100, -50, 30]
+    price = [10.0, 20.0, 5.0]
+    newq = balance_rule(bdata, False, quantity, price, 1.0, 3000.0)
+    assert list(newq) == [100, -100, 30]
+    newq = balance_rule(bdata, True, quantity, price, 1.0, 3000.0)
+    assert list(newq) == [200, -50, 30]
+    newq = balance_rule([0.0, 0.0, 0.0], False, quantity, price, 1.0, 3000.0)
+    assert list(newq) == quantity
+
+
+#
+# Function rule_loop
+#
+
+def rule_loop(group, system, tframe, startcap, posby, rebalance, rules):
+    r"""Run the trades with ``exec_trade`` and the rules on the Portfolio.
+
+    At the close of the last day of each ``rebalance`` period, the
+    portfolio is trimmed with ``stop_loss`` and ``kick_out`` and then
+    rebalanced with ``balance``, as configured in ``rules``.
+
+    """
+    gmembers = group.members
+    p = Portfolio(group.name, system, group.space, posby=posby,
+                  restricted=False, startcap=startcap,
+                  fixedfrac=1.0 / len(gmembers), **rules)
+    p.panel = get_panel(group.name, group.space, list(gmembers))
+    days = tframe.index.map(lambda x: x.date().strftime('%Y-%m-%d'))
+    dates = pd.date_range(tframe.index[0], tframe.index[-1])
+    drange = dates.map(lambda x: x.date().strftime('%Y-%m-%d'))
+    periods = dates.to_period(rebalance)
+    rdays = np.append(periods[1:] != periods[:-1], True)
+    rs = []
+    pf = pd.DataFrame(0.0, index=drange, columns=list(gmembers) + ['cash'])
+    for d, rdate, rday in zip(drange, dates, rdays):
+        for tdate, row in tframe[days == d].iterrows():
+            exec_trade(p, row['name'], row['order'], row['quantity'],
+                       row['price'], tdate)
+        for pos in p.positions.values():
+            pf.loc[d, pos.name] = pos.value if pos.quantity > 0 else -pos.value
+        pf.loc[d, 'cash'] = p.cash
+        p = valuate_portfolio(p, d)
+        rs.append(p.netreturn)
+        if rday:
+            if p.maxloss:
+                p = stop_loss(p, rdate)
+            if p.maxpos:
+                p = kick_out(p, rdate)
+            if p.weightby:
+                p = balance(p, rdate, p.mincash)
+    rf = pd.DataFrame({'return' : rs}, index=drange, columns=['return'])
+    return p, rf, pf
+
+
+#
+# Function check_rules
+#
+
+def check_rules(system, tframe, posby, rules):
+    r"""Compare the rules of ``gen_portfolio`` with the Portfolio rules."""
+    space = Space('stock', 'prices', 'prule')
+    symbols = ['aaa', 'bbb', 'ccc', 'ddd']
+    dates = pd.date_range('2017-01-02', periods=40, freq='D')
+    price_frames(space, symbols, dates, 17, gaps=False)
+    group = Group(system, space, members=set(symbols))
+    directory = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(directory, 'systems'))
+        p = gen_portfolio(SpecsModel(directory), system, group, tframe,
+                          startcap=100000, posby=posby, rebalance='W',
+                          **rules)
+        q, rf, pf = rule_loop(group, system + '_loop', tframe, 100000, posby,
+                              'W', rules)
+        system_dir = os.path.join(directory, 'systems')
+        frames = {}
+        for schema, df in [('returns', rf), ('positions', pf)]:
+            fname = frame_name(system, Space(system, schema, 'prule'))
+            actual = read_frame(system_dir, fname, 'npy', ',', index_col=0)
+            assert list(actual.index) == list(df.index), schema
+            assert list(actual.columns) == list(df.columns), schema
+            assert np.allclose(actual.values, df.values, rtol=1e-9), schema
+            frames[schema] = actual
+        assert sorted(p.positions) == sorted(q.positions)
+        for name in p.positions:
+            for attr in ['quantity', 'price', 'value', 'profit', 'netreturn']:
+                assert np.isclose(getattr(p.positions[name], attr),
+                                  getattr(q.positions[name], attr)), (name, attr)
+        for attr in ['cash', 'value', 'npos']:
+            assert np.isclose(getattr(p, attr), getattr(q, attr)), attr
+        return p, frames
+    finally:
+        shutil.rmtree(directory)
+
+
+#
+# Function test_gen_portfolio_stop_kick
+#
+
+def test_gen_portfolio_stop_kick():
+    tframe = trade_frame([
+        ('2017-01-03', 'aaa', Orders.le, 300, 27.00),
+        ('2017-01-03', 'bbb', Orders.se, -200, 44.00),
+        ('2017-01-03', 'ccc', Orders.le, 100, 35.50),
+        ('2017-01-04', 'ddd', Orders.le, 150, 27.50),
+        ('2017-01-10', 'ccc', Orders.lx, -100, 33.00),
+        ('2017-01-12', 'ccc', Orders.le, 100, 32.00),
+        ('2017-01-17', 'aaa', Orders.lx, -300, 33.00),
+        ('2017-01-18', 'ddd', Orders.se, -100, 29.00),
+        ('2017-01-25', 'ccc', Orders.lx, -100, 32.00),
+        ('2017-02-02', 'bbb', Orders.sx, 200, 43.00)])
+    rules = {'maxpos' : 3, 'kopos' : 0, 'koby' : '-profit',
+             'weightby' : None, 'maxloss' : 0.05}
+    p, frames = check_rules('pxstop', tframe, None, rules)
+    pf = frames['positions']
+    # ccc is stopped out on 01-08, so its exit on 01-10 does not go short
+    assert (pf.loc['2017-01-09':'2017-01-11', 'ccc'] == 0).all()
+    # ccc opens again on 01-12 and is kicked out on 01-15
+    assert (pf.loc['2017-01-12':'2017-01-15', 'ccc'] > 0).all()
+    assert (pf.loc['2017-01-16':, 'ccc'] == 0).all()
+    assert (pf.loc['2017-01-16', ['aaa', 'bbb', 'ccc', 'ddd']] != 0).sum() == 3
+    assert sorted(p.positions) == ['ddd']
+
+
+#
+# Function test_gen_portfolio_balance
+#
+
+def test_gen_portfolio_balance():
+    tframe = trade_frame([
+        ('2017-01-03', 'aaa', Orders.le, 1, 27.00),
+        ('2017-01-03', 'bbb', Orders.se, -1, 44.00),
+        ('2017-01-04', 'ccc', Orders.le, 1, 35.00),
+        ('2017-01-11', 'ddd', Orders.le, 1, 28.50),
+        ('2017-01-17', 'aaa', Orders.lx, -1, 33.00),
+        ('2017-01-24', 'aaa', Orders.se, -1, 31.50)])
+    rules = {'maxpos' : None, 'kopos' : 0, 'koby' : '-profit',
+             'weightby' : 'close', 'maxloss' : None}
+    p, frames = check_rules('pxbalance', tframe, 'close', rules)
+    # the last day closes a period, so the positions end up balanced
+    quantities = [abs(pos.quantity) for pos in p.positions.values()]
+    assert len(p.positions) == 4
+    assert len(set(quantities)) == 1
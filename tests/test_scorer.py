@@ -0,0 +1,146 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_scorer
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.features import create_crosstabs
+from alphapy.features import create_features
+from alphapy.globals import Encoders
+from alphapy.globals import ModelType
+from alphapy.globals import Scalers
+from alphapy.model import Model
+from alphapy.model import save_feature_map
+from alphapy.model import save_predictor
+from alphapy.scorer import Scorer
+
+import numpy as np
+import os
+import pandas as pd
+import shutil
+from sklearn.linear_model import LogisticRegression
+import tempfile
+
+
+#
+# Function scorer_specs
+#
+
+def scorer_specs(directory):
+    r"""Create the model specifications of a small classifier."""
+    return {'algorithms'        : ['LOGR'],
+            'cluster_inc'       : 1,
+            'cluster_max'       : 3,
+            'cluster_min'       : 3,
+            'clustering'        : True,
+            'counts'            : False,
+            'directory'         : directory,
+            'drop'              : [],
+            'encoder'           : Encoders.onehot,
+            'factors'           : ['c'],
+            'feature_dtype'     : 'float64',
+            'feature_selection' : False,
+            'interactions'      : False,
+            'isample_pct'       : 10,
+            'isomap'            : False,
+            'logtransform'      : False,
+            'lv_remove'         : False,
+            'lv_threshold'      : 0.1,
+            'model_type'        : ModelType.classification,
+            'n_jobs'            : 1,
+            'ngrams_max'        : 1,
+            'numpy'             : True,
+            'pca'               : False,
+            'poly_degree'       : 2,
+            'predict_mode'      : False,
+            'pvalue_level'      : 0.01,
+            'rfe'               : False,
+            'rounding'          : 2,
+            'scaler_option'     : True,
+            'scaler_type'       : Scalers.standard,
+            'scipy'             : False,
+            'seed'              : 3,
+            'sentinel'          : -1,
+            'sparse'            : False,
+            'target_value'      : 1,
+            'treatments'        : None,
+            'tsne'              : False,
+            'vectorize'         : False,
+            'verbosity'         : 0}
+
+
+#
+# Function train_model
+#
+
+def train_model(directory, nrows, seed):
+    r"""Train and save a classifier, returning its training features."""
+    rs = np.random.RandomState(seed)
+    X = pd.DataFrame({'a' : rs.randn(nrows),
+                      'b' : rs.randint(0, 4, nrows).astype('int64'),
+                      'c' : rs.choice(['x', 'y', 'z'], nrows).astype(object)})
+    X.loc[[3, 8, 21], 'a'] = np.nan
+    y = pd.Series((X['a'].fillna(0) + (X['c'] == 'x') > 0.3).astype(int))
+    model = Model(scorer_specs(directory))
+    model.X_train, model.y_train = X, y
+    model.feature_map['features'] = list(X.columns)
+    model.feature_map['dtypes'] = X.dtypes.astype(str).to_dict()
+    create_crosstabs(model)
+    all_features = create_features(model, X.copy())
+    model.estimators['BEST'] = LogisticRegression().fit(all_features, y)
+    model.best_algo = 'LOGR'
+    os.mkdir(os.path.join(directory, 'model'))
+    save_predictor(model, '20170711')
+    save_feature_map(model, '20170711')
+    return model, X, all_features
+
+
+#
+# Function test_scorer_round_trip
+#
+
+def test_scorer_round_trip():
+    directory = tempfile.mkdtemp()
+    try:
+        model, X, all_features = train_model(directory, 200, 0)
+        est = model.estimators['BEST']
+        scorer = Scorer(scorer_specs(directory))
+        rows = [0, 3, 50, 51, 199]
+        # a frame of raw rows
+        assert np.array_equal(scorer.predict(X.iloc[rows]),
+                              est.predict(all_features[rows]))
+        assert np.allclose(scorer.predict_proba(X.iloc[rows]),
+                           est.predict_proba(all_features[rows])[:, 1])
+        # a single row as a dictionary, with the columns out of order
+        row = {'c' : X['c'][50], 'b' : int(X['b'][50]), 'a' : float(X['a'][50])}
+        assert np.allclose(scorer.predict_proba(row),
+                           est.predict_proba(all_features[[50]])[:, 1])
+        # a missing feature is imputed like a missing value in training
+        row = {'b' : int(X['b'][8]), 'c' : X['c'][8]}
+        assert np.allclose(scorer.predict_proba([row]),
+                           est.predict_proba(all_features[[8]])[:, 1])
+        assert np.array_equal(scorer.predict(row), est.predict(all_features[[8]]))
+    finally:
+        shutil.rmtree(directory)
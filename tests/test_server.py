@@ -0,0 +1,172 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_server
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.globals import ModelType
+from alphapy.server import Batcher
+from alphapy.server import handle_request
+
+import asyncio
+import json
+import numpy as np
+
+
+#
+# Class ThresholdPredictor
+#
+
+class ThresholdPredictor(object):
+    r"""Predict the class of the first feature with a zero threshold."""
+
+    def predict(self, X):
+        return (X[:, 0] > 0).astype(int)
+
+    def predict_proba(self, X):
+        p = (X[:, 0] > 0).astype(float)
+        return np.column_stack([1.0 - p, p])
+
+
+#
+# Class RowScorer
+#
+
+class RowScorer(object):
+    r"""A scorer that casts the ``x`` feature of each row to float."""
+
+    def __init__(self):
+        self.model = type('Model', (object,),
+                          {'specs' : {'model_type' : ModelType.classification}})
+        self.predictor = ThresholdPredictor()
+        self.ntransforms = 0
+
+    def transform(self, rows):
+        self.ntransforms += 1
+        return np.array([[float(row['x'])] for row in rows])
+
+
+#
+# Class BufferWriter
+#
+
+class BufferWriter(object):
+    r"""Collect the bytes of a response in memory."""
+
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+#
+# Function run_batcher
+#
+
+def run_batcher(coroutine, batch_size=16, max_wait=20.0):
+    r"""Run a coroutine against a started batcher in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        batcher = Batcher(RowScorer(), batch_size, max_wait)
+        runner = loop.run_until_complete(batcher.start())
+        result = loop.run_until_complete(coroutine(batcher))
+        assert not runner.done()
+        runner.cancel()
+        try:
+            loop.run_until_complete(runner)
+        except asyncio.CancelledError:
+            pass
+        return batcher, result
+    finally:
+        loop.close()
+
+
+#
+# Function post
+#
+
+async def post(batcher, body):
+    r"""Send a ``POST /predict`` request and return the status and body."""
+    reader = asyncio.StreamReader()
+    content = body.encode('utf-8')
+    reader.feed_data(("POST /predict HTTP/1.1\r\n"
+                      "Content-Length: %d\r\n\r\n" % len(content)).encode('latin-1'))
+    reader.feed_data(content)
+    reader.feed_eof()
+    writer = BufferWriter()
+    await asyncio.wait_for(handle_request(batcher, reader, writer, 1 << 20), 5)
+    header, _, response = writer.data.partition(b'\r\n\r\n')
+    return int(header.split()[1]), json.loads(response.decode('utf-8'))
+
+
+#
+# Function test_batcher_coalesces
+#
+
+def test_batcher_coalesces():
+    async def requests(batcher):
+        return await asyncio.gather(*[batcher.score([{'x' : x}]) for x in [1, -1, 2]])
+    batcher, results = run_batcher(requests)
+    assert [r['predictions'] for r in results] == [[1], [0], [1]]
+    assert [r['probabilities'] for r in results] == [[1.0], [0.0], [1.0]]
+    assert batcher.scorer.ntransforms == 1
+
+
+#
+# Function test_batcher_bad_row
+#
+
+def test_batcher_bad_row():
+    async def requests(batcher):
+        scores = [batcher.score([{'x' : 1}]), batcher.score([{'x' : 'abc'}]),
+                  batcher.score([{'x' : -3}, {'x' : 4}])]
+        return await asyncio.gather(*scores, return_exceptions=True)
+    batcher, results = run_batcher(requests)
+    # only the request with the bad row fails
+    assert results[0]['predictions'] == [1]
+    assert isinstance(results[1], ValueError)
+    assert results[2]['predictions'] == [0, 1]
+
+
+#
+# Function test_handle_request_rejects
+#
+
+def test_handle_request_rejects():
+    async def requests(batcher):
+        responses = []
+        for body in ['5', '"x"', '[1, 2]', '[]', '{"x": ', '{"x": 2}']:
+            responses.append(await post(batcher, body))
+        return responses
+    batcher, responses = run_batcher(requests)
+    assert [status for status, body in responses] == [400, 400, 400, 400, 400, 200]
+    assert responses[-1][1]['predictions'] == [1]
@@ -0,0 +1,159 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_sweep
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.frame import Frame
+from alphapy.globals import Orders
+from alphapy.group import Group
+from alphapy.market_variables import vcompile
+from alphapy.space import Space
+from alphapy.sweep import sweep_frame
+from alphapy.sweep import sweep_metrics
+from alphapy.sweep import sweep_signals
+from alphapy.sweep import sweep_system
+from alphapy.system import System
+from alphapy.system import trade_frame
+
+from collections import OrderedDict
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+
+#
+# Class SpecsModel
+#
+
+class SpecsModel(object):
+    r"""The part of a model that ``sweep_system`` reads."""
+
+    def __init__(self, directory):
+        self.specs = {'directory' : directory,
+                      'extension' : 'csv',
+                      'separator' : ','}
+
+
+#
+# Function signal_frame
+#
+
+def signal_frame(nbars, seed):
+    r"""Create a random price frame with entry and exit signals."""
+    rs = np.random.RandomState(seed)
+    pf = pd.DataFrame(index=pd.date_range('2017-01-03', periods=nbars, freq='D'))
+    pf['close'] = np.round(50.0 + rs.randn(nbars).cumsum(), 2)
+    for signal in ['le', 'se', 'lx', 'sx']:
+        pf[signal] = rs.rand(nbars) < 0.15
+    return pf
+
+
+#
+# Function test_sweep_frame_matches_trade_frame
+#
+
+def test_sweep_frame_matches_trade_frame():
+    signals = ['le', 'se', 'lx', 'sx']
+    for seed in range(5):
+        pf = signal_frame(150, seed)
+        data = sweep_signals(pf.copy(), vcompile(signals), signals, False)
+        for holdperiod, scale in [(0, False), (3, False), (0, True)]:
+            combo = OrderedDict([('longentry', 'le'), ('shortentry', 'se'),
+                                 ('longexit', 'lx'), ('shortexit', 'sx'),
+                                 ('holdperiod', holdperiod), ('scale', scale)])
+            pnl, ntrades = sweep_frame(data['close'], data['signals'],
+                                       data['eod'], [combo])
+            tradelist = trade_frame(pf.copy(), 'abc', signals, holdperiod,
+                                    scale, False, 1)
+            # the profit of the trades, with any open position at the last close
+            close = pf['close'].values
+            position = sum([t[1][2] for t in tradelist])
+            profit = -sum([t[1][2] * t[1][3] for t in tradelist]) + position * close[-1]
+            entries = [t for t in tradelist if t[1][1] in (Orders.le, Orders.se)]
+            assert ntrades[0] == len(entries)
+            assert np.isclose((pnl[0, 1:] * close[:-1]).sum(), profit)
+
+
+#
+# Function test_sweep_metrics
+#
+
+def test_sweep_metrics():
+    pnl = np.array([[0.0, 100.0, -300.0, 50.0],
+                    [0.0, 0.0, 0.0, 0.0]])
+    metrics = sweep_metrics(pnl, 1000, 252)
+    assert list(metrics['netprofit']) == [-150.0, 0.0]
+    assert np.allclose(metrics['return'], [-0.15, 0.0])
+    assert np.allclose(metrics['drawdown'], [800.0 / 1100.0 - 1.0, 0.0])
+    returns = np.array([0.0, 0.1, -300.0 / 1100.0, 50.0 / 800.0])
+    sharpe = np.sqrt(252) * returns.mean() / returns.std()
+    assert np.allclose(metrics['sharpe'], [sharpe, 0.0])
+
+
+#
+# Function test_sweep_system_empty_group
+#
+
+def test_sweep_system_empty_group():
+    system = System('sweep_empty', 'le')
+    group = Group('sweep_empty', Space('stock', 'prices', 'sweep'), members=set())
+    try:
+        sweep_system(SpecsModel('.'), system, group, {'holdperiod' : [1, 2]})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("An empty group must raise ValueError")
+
+
+#
+# Function test_sweep_system_parallel
+#
+
+def test_sweep_system_parallel():
+    space = Space('stock', 'prices', 'sweep')
+    symbols = ['swa', 'swb', 'swc']
+    for k, symbol in enumerate(symbols):
+        pf = signal_frame(120, 20 + k)
+        if k == len(symbols) - 1:
+            pf = pf.drop(pf.index[5::6])
+        Frame(symbol, space, pf)
+    system = System('sweep_par', 'le', 'se', 'lx', 'sx')
+    group = Group('sweep_par', space, members=set(symbols))
+    grid = {'holdperiod' : [0, 2, 5], 'scale' : [False, True],
+            'longexit' : ['lx', None]}
+    directory = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(directory, 'systems'))
+        model = SpecsModel(directory)
+        serial = sweep_system(model, system, group, grid, chunk_size=5, n_jobs=1)
+        parallel = sweep_system(model, system, group, grid, chunk_size=5, n_jobs=2)
+    finally:
+        shutil.rmtree(directory)
+    assert serial.shape[0] == 12
+    assert (serial['trades'] > 0).all()
+    pd.testing.assert_frame_equal(serial, parallel)
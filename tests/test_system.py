@@ -0,0 +1,287 @@
+################################################################################
+#
+# Package   : AlphaPy
+# Module    : test_system
+# Created   : July 11, 2013
+#
+# Copyright 2017 ScottFree Analytics LLC
+# Mark Conway & Robert D. Scott II
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+################################################################################
+
+
+#
+# Imports
+#
+
+from alphapy.alias import Alias
+from alphapy.frame import Frame
+from alphapy.frame import frame_name
+from alphapy.globals import Orders
+from alphapy.group import Group
+from alphapy.space import Space
+from alphapy.system import run_system
+from alphapy.system import System
+from alphapy.system import trade_engine
+from alphapy.system import trade_frame
+
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+
+#
+# Signal columns of the test frames
+#
+
+signals = ['le', 'se', 'lx', 'sx']
+
+
+#
+# Signal aliases for running a system on a group
+#
+
+Alias('sysup', 'higher_close')
+Alias('sysdown', 'lower_close')
+
+
+#
+# Function trade_loop
+#
+
+def trade_loop(pf, name, signals, holdperiod, scale, intraday, quantity):
+    r"""Trade a price frame with the original row-by-row loop.
+
+    This is the reference implementation that ``trade_engine``
+    replaced, kept here to check that both produce the same trades.
+
+    """
+    longentry, shortentry, longexit, shortexit = signals
+    inlong = False
+    inshort = False
+    h = 0
+    p = 0
+    q = quantity
+    tradelist = []
+    for dt, row in pf.iterrows():
+        c = row['close']
+        if intraday:
+            end_of_day = row['end_of_day']
+        lerow = row[longentry] if longentry else None
+        serow = row[shortentry] if shortentry else None
+        lxrow = row[longexit] if longexit else None
+        sxrow = row[shortexit] if shortexit else None
+        if lerow:
+            if p < 0:
+                tradelist.append((dt, [name, Orders.sx, -p, c]))
+                inshort = False
+                h = 0
+                p = 0
+            if p == 0 or scale:
+                tradelist.append((dt, [name, Orders.le, q, c]))
+                inlong = True
+                p = p + q
+        elif serow:
+            if p > 0:
+                tradelist.append((dt, [name, Orders.lx, -p, c]))
+                inlong = False
+                h = 0
+                p = 0
+            if p == 0 or scale:
+                tradelist.append((dt, [name, Orders.se, -q, c]))
+                inshort = True
+                p = p - q
+        if inlong and h > 0 and lxrow:
+            tradelist.append((dt, [name, Orders.lx, -p, c]))
+            inlong = False
+            h = 0
+            p = 0
+        if inshort and h > 0 and sxrow:
+            tradelist.append((dt, [name, Orders.sx, -p, c]))
+            inshort = False
+            h = 0
+            p = 0
+        if holdperiod and h >= holdperiod:
+            if inlong:
+                tradelist.append((dt, [name, Orders.lh, -p, c]))
+                inlong = False
+            if inshort:
+                tradelist.append((dt, [name, Orders.sh, -p, c]))
+                inshort = False
+            h = 0
+            p = 0
+        if inlong or inshort:
+            h += 1
+            if intraday and end_of_day:
+                if inlong:
+                    tradelist.append((dt, [name, Orders.lx, -p, c]))
+                    inlong = False
+                if inshort:
+                    tradelist.append((dt, [name, Orders.sx, -p, c]))
+                    inshort = False
+                h = 0
+                p = 0
+    return tradelist
+
+
+#
+# Function random_frame
+#
+
+def random_frame(rs, nbars, intraday):
+    r"""Create a random price frame with sparse signals and NaN values."""
+    if intraday:
+        index = pd.date_range('2017-01-03 09:30', periods=nbars, freq='30min')
+    else:
+        index = pd.date_range('2017-01-03', periods=nbars, freq='D')
+    pf = pd.DataFrame(index=index)
+    pf['close'] = np.round(100.0 + rs.randn(nbars).cumsum(), 2)
+    for signal in signals:
+        values = (rs.rand(nbars) < rs.uniform(0.05, 0.3)).astype(float)
+        values[rs.rand(nbars) < 0.03] = np.nan
+        pf[signal] = values
+    if intraday:
+        bar_number = np.arange(nbars) % 13
+        pf['bar_number'] = bar_number
+        pf['end_of_day'] = bar_number == 12
+    return pf
+
+
+#
+# Function check_frame
+#
+
+def check_frame(pf, holdperiod, scale, intraday, quantity, fsignals=signals):
+    expected = trade_loop(pf, 'abc', fsignals, holdperiod, scale,
+                          intraday, quantity)
+    actual = trade_frame(pf.copy(), 'abc', fsignals, holdperiod, scale,
+                         intraday, quantity)
+    assert actual == expected, \
+        "holdperiod=%s scale=%s intraday=%s" % (holdperiod, scale, intraday)
+    return actual
+
+
+#
+# Function test_trade_frame_random
+#
+
+def test_trade_frame_random():
+    rs = np.random.RandomState(42)
+    for _ in range(200):
+        intraday = bool(rs.randint(2))
+        pf = random_frame(rs, rs.randint(1, 120), intraday)
+        holdperiod = int(rs.choice([0, 1, 2, 5]))
+        scale = bool(rs.randint(2))
+        quantity = float(rs.choice([1, 100, 2.5]))
+        check_frame(pf, holdperiod, scale, intraday, quantity)
+
+
+#
+# Function test_trade_frame_missing_signals
+#
+
+def test_trade_frame_missing_signals():
+    rs = np.random.RandomState(7)
+    for fsignals in [['le', None, 'lx', None],
+                     [None, 'se', None, 'sx'],
+                     ['le', 'se', None, None]]:
+        for intraday in [False, True]:
+            pf = random_frame(rs, 80, intraday)
+            check_frame(pf, 3, True, intraday, 1, fsignals)
+
+
+#
+# Function test_trade_frame_open_position
+#
+
+def test_trade_frame_open_position():
+    pf = random_frame(np.random.RandomState(3), 10, False)
+    pf[signals] = 0.0
+    pf.loc[pf.index[4], 'le'] = 1.0
+    pf.loc[pf.index[8], 'le'] = 1.0
+    tradelist = check_frame(pf, 0, True, False, 1)
+    orders = [trade[1][1] for trade in tradelist]
+    assert orders == [Orders.le, Orders.le]
+
+
+#
+# Function test_trade_frame_nan_signal
+#
+
+def test_trade_frame_nan_signal():
+    pf = random_frame(np.random.RandomState(5), 6, False)
+    pf[signals] = 0.0
+    pf.loc[pf.index[2], 'se'] = np.nan
+    tradelist = check_frame(pf, 0, False, False, 1)
+    assert tradelist == [(pf.index[2], ['abc', Orders.se, -1, pf['close'].iloc[2]])]
+
+
+#
+# Function test_trade_engine_end_of_day
+#
+
+def test_trade_engine_end_of_day():
+    close = [10.0, 11.0, 12.0, 13.0]
+    le = [True, False, False, False]
+    off = [False] * 4
+    eod = [False, True, False, False]
+    trades = trade_engine(close, le, off, off, off, eod, 0, False, 1)
+    assert trades == [(0, Orders.le, 1, 10.0), (1, Orders.lx, -1, 11.0)]
+
+
+#
+# Class SpecsModel
+#
+
+class SpecsModel(object):
+    r"""The part of a model that ``run_system`` reads."""
+
+    def __init__(self, directory):
+        self.specs = {'directory' : directory,
+                      'extension' : 'csv',
+                      'separator' : ','}
+
+
+#
+# Function test_run_system_parallel
+#
+
+def test_run_system_parallel():
+    space = Space('stock', 'prices', 'sysp')
+    symbols = ['sya', 'syb', 'syc', 'syd']
+    group = Group('sys_par', space, members=set(symbols))
+    system = System('sys_par', 'sysup', 'sysdown', holdperiod=3)
+    directory = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(directory, 'systems'))
+        model = SpecsModel(directory)
+        tfs = []
+        for n_jobs in [1, 2]:
+            # fresh frames, as the serial run adds the signals in place
+            rs = np.random.RandomState(11)
+            for symbol in symbols:
+                pf = random_frame(rs, 80, False)[['close']]
+                Frame.frames.pop(frame_name(symbol, space), None)
+                Frame(symbol, space, pf)
+            tfs.append(run_system(model, system, group, n_jobs=n_jobs))
+    finally:
+        shutil.rmtree(directory)
+    serial, parallel = tfs
+    assert len(serial) > 0
+    assert set(serial['name']) == set(symbols)
+    assert serial.index.is_monotonic_increasing
+    pd.testing.assert_frame_equal(serial, parallel)